@@ -0,0 +1 @@
+"""Benchmarks for flydelta, run with `python -m benchmarks.<name>`."""
@@ -0,0 +1,68 @@
+"""Compare the results of two benchmark runs.
+
+    python -m benchmarks.throughput > before.jsonl
+    git checkout feature && python -m benchmarks.throughput > after.jsonl
+    python -m benchmarks.compare before.jsonl after.jsonl
+
+Results are matched on their parameters (benchmark name and all integer or
+string fields except the metadata), then every timing, throughput and
+memory field is shown with the relative change.
+"""
+
+import argparse
+import json
+from typing import Any
+
+METADATA = ("version", "commit")
+
+
+def _load(path: str) -> dict[tuple[Any, ...], dict[str, Any]]:
+    results = {}
+    with open(path) as lines:
+        for line in lines:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            results[_key(result)] = result
+    return results
+
+
+def _is_param(name: str, value: Any) -> bool:
+    if name in METADATA or _is_measure(name):
+        return False
+    return isinstance(value, (int, str))
+
+
+def _key(result: dict[str, Any]) -> tuple[Any, ...]:
+    params = (item for item in result.items() if _is_param(*item))
+    return tuple(sorted(params))
+
+
+def _is_measure(name: str) -> bool:
+    if name in ("batches", "queries") or name.startswith("latency"):
+        return True
+    return name.endswith(("seconds", "per_second", "rss", "bytes"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+
+    before, after = _load(args.before), _load(args.after)
+    for key, new in after.items():
+        old = before.get(key)
+        if old is None:
+            continue
+        params = ", ".join(f"{name}={value}" for name, value in key)
+        print(params)
+        for name, value in new.items():
+            if not _is_measure(name) or not old.get(name) or value is None:
+                continue
+            change = (value - old[name]) / old[name] * 100
+            print(f"  {name:<28} {old[name]:>14.4g} {value:>14.4g} {change:>+8.1f}%")
+
+
+if __name__ == "__main__":
+    main()
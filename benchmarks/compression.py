@@ -0,0 +1,78 @@
+"""Bytes on the wire and throughput of the result stream compression codecs.
+
+    python -m benchmarks.compression --rows 1000000
+
+The wire size is the number of bytes the server sends to stream the result
+with the respective codec, counted by a TCP relay between client and server
+and including the gRPC framing.
+"""
+
+import argparse
+import time
+
+import pyarrow.flight as flight
+
+from benchmarks.utils import (
+    ByteCounter,
+    counting_proxy,
+    delta_table,
+    make_table,
+    report,
+    running_server,
+)
+from flydelta import Client
+from flydelta.ipc import COMPRESSION_HEADER
+
+SQL = "SELECT * FROM bench"
+
+
+def wire_bytes(proxy: str, counter: ByteCounter, codec: str) -> int:
+    """Count the bytes sent for the result streams of the query."""
+    headers = [(COMPRESSION_HEADER.encode(), codec.encode())]
+    options = flight.FlightCallOptions(headers=headers)
+    with flight.connect(proxy) as conn:
+        info = conn.get_flight_info(flight.FlightDescriptor.for_command(SQL))
+        counter.reset()
+        # endpoints list the server itself, fetch them through the relay
+        for endpoint in info.endpoints:
+            conn.do_get(endpoint.ticket, options).read_all()
+        return counter.reset()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--strings", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    source = make_table(args.rows, strings=args.strings)
+    with delta_table(source) as path:
+        with running_server(
+            tables={"bench": path},
+            compression_threshold=0,
+        ) as location:
+            with Client(location) as client, counting_proxy(location) as relay:
+                for codec in ["none", "lz4", "zstd"]:
+                    timings = []
+                    for _ in range(args.repeat):
+                        start = time.perf_counter()
+                        result = client.query(SQL, compression=codec)
+                        timings.append(time.perf_counter() - start)
+                    seconds = min(timings)
+                    report(
+                        {
+                            "benchmark": "compression",
+                            "codec": codec,
+                            "rows": result.num_rows,
+                            "bytes": result.nbytes,
+                            "wire_bytes": wire_bytes(*relay, codec),
+                            "seconds": seconds,
+                            "rows_per_second": result.num_rows / seconds,
+                            "mb_per_second": result.nbytes / seconds / 1e6,
+                        }
+                    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Query throughput and latency with concurrent clients.
+
+    python -m benchmarks.concurrency --pool-size 4 --clients 1 2 4 8 16
+    python -m benchmarks.concurrency --database isolated shared
+
+Each client runs on its own thread with its own connection and repeats a
+small aggregation, so the server's connection pool becomes the bottleneck
+once there are more clients than `--pool-size` connections. `--database`
+runs the server with a DuckDB database per pooled connection (`isolated`),
+with cursors of one database (`shared`) or both in turn.
+"""
+
+import argparse
+import statistics
+import threading
+import time
+
+import pyarrow.flight as flight
+
+from benchmarks.utils import delta_table, make_table, peak_rss, report, server_process
+from flydelta import Client
+
+SQL = "SELECT label_0, COUNT(*), SUM(value) FROM bench GROUP BY label_0"
+
+
+def run_clients(location: str, clients: int, queries: int) -> tuple[list[float], int]:
+    """Run `queries` queries on each of `clients` threads.
+
+    Returns the latencies of the successful queries and the number of
+    failed ones.
+    """
+    latencies: list[float] = []
+    errors = 0
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients)
+
+    def work() -> None:
+        nonlocal errors
+        with Client(location) as client:
+            barrier.wait()
+            for _ in range(queries):
+                start = time.perf_counter()
+                try:
+                    client.query(SQL)
+                except flight.FlightError:
+                    with lock:
+                        errors += 1
+                    continue
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+
+    threads = [threading.Thread(target=work) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def p95(latencies: list[float]) -> float | None:
+    """Get the 95th percentile of latencies, quantiles need two of them."""
+    if len(latencies) < 2:
+        return latencies[0] if latencies else None
+    return statistics.quantiles(latencies, n=20, method="inclusive")[-1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument(
+        "--database", nargs="+", choices=["isolated", "shared"], default=["isolated"]
+    )
+    args = parser.parse_args()
+
+    source = make_table(args.rows, strings=1)
+    with delta_table(source) as path:
+        for database in args.database:
+            run(args, path, database)
+
+
+def run(args: argparse.Namespace, path: str, database: str) -> None:
+    """Measure a server in one database mode with each number of clients."""
+    with server_process(
+        tables={"bench": path},
+        pool_size=args.pool_size,
+        pool_min_size=0,
+        shared_database=database == "shared",
+    ) as (location, process):
+        run_clients(location, 1, 1)  # warm up
+        for clients in args.clients:
+            start = time.perf_counter()
+            latencies, errors = run_clients(location, clients, args.queries)
+            seconds = time.perf_counter() - start
+            latencies.sort()
+            report(
+                {
+                    "benchmark": "concurrency",
+                    "database": database,
+                    "rows": args.rows,
+                    "pool_size": args.pool_size,
+                    "clients": clients,
+                    "queries": len(latencies),
+                    "errors": errors,
+                    "seconds": seconds,
+                    "queries_per_second": len(latencies) / seconds,
+                    "latency_p50": statistics.median(latencies) if latencies else None,
+                    "latency_p95": p95(latencies),
+                    "latency_max": latencies[-1] if latencies else None,
+                    "server_peak_rss": peak_rss(process.pid),
+                }
+            )
+
+
+if __name__ == "__main__":
+    main()
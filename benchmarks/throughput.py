@@ -0,0 +1,95 @@
+"""Throughput, time to first batch and memory per server batch size.
+
+    python -m benchmarks.throughput --rows 1000000 --batch-size 10000 100000
+
+For every batch size a server is started in a separate process. The result
+is read with `Client.query` and iterated with `Client.stream_query`. Peak
+memory is the high-water mark of the server process and, where it can be
+reset, of the client process per batch size.
+"""
+
+import argparse
+import time
+
+from benchmarks.utils import (
+    delta_table,
+    make_table,
+    peak_rss,
+    report,
+    reset_peak_rss,
+    server_process,
+)
+from flydelta import Client
+
+SQL = "SELECT * FROM bench"
+
+
+def time_query(client: Client, repeat: int) -> tuple[float, int, int]:
+    """Get the best time to read the result into a table, its rows and bytes."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = client.query(SQL)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result.num_rows, result.nbytes
+
+
+def time_stream(client: Client, repeat: int) -> tuple[float, float, int]:
+    """Get the best time to first batch and to iterate all batches."""
+    first, total = [], []
+    for _ in range(repeat):
+        batches = 0
+        start = time.perf_counter()
+        for _batch in client.stream_query(SQL):
+            if not batches:
+                first.append(time.perf_counter() - start)
+            batches += 1
+        total.append(time.perf_counter() - start)
+    return min(first), min(total), batches
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--strings", type=int, default=2)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument(
+        "--batch-size", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    source = make_table(args.rows, strings=args.strings)
+    with delta_table(source, files=args.files) as path:
+        for batch_size in args.batch_size:
+            reset_peak_rss()
+            server = server_process(tables={"bench": path}, batch_size=batch_size)
+            with server as (location, process):
+                with Client(location) as client:
+                    query_seconds, rows, nbytes = time_query(client, args.repeat)
+                    first_batch, stream_seconds, batches = time_stream(
+                        client, args.repeat
+                    )
+                server_rss = peak_rss(process.pid)
+            report(
+                {
+                    "benchmark": "throughput",
+                    "rows": rows,
+                    "files": args.files,
+                    "strings": args.strings,
+                    "batch_size": batch_size,
+                    "bytes": nbytes,
+                    "batches": batches,
+                    "query_seconds": query_seconds,
+                    "query_rows_per_second": rows / query_seconds,
+                    "stream_seconds": stream_seconds,
+                    "stream_rows_per_second": rows / stream_seconds,
+                    "first_batch_seconds": first_batch,
+                    "server_peak_rss": server_rss,
+                    "client_peak_rss": peak_rss(),
+                }
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""Helpers to run benchmarks against an in-process server."""
+
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Generator
+
+import pyarrow as pa
+import pyarrow.flight as flight
+from deltalake import write_deltalake
+
+from flydelta import Client, Server, __version__
+
+
+def make_table(rows: int, strings: int = 2, cardinality: int = 100) -> pa.Table:
+    """Generate a table with numeric and string columns."""
+    data: dict[str, Any] = {
+        "id": pa.array(range(rows), pa.int64()),
+        "value": pa.array((i * 0.5 for i in range(rows)), pa.float64()),
+    }
+    for i in range(strings):
+        data[f"label_{i}"] = pa.array(
+            f"label-{i}-{j % cardinality}" for j in range(rows)
+        )
+    return pa.table(data)
+
+
+@contextmanager
+def delta_table(
+    table: pa.Table, files: int = 1, partition_by: list[str] | None = None
+) -> Generator[str, None, None]:
+    """Write a table as a temporary Delta table spread over `files` commits."""
+    with tempfile.TemporaryDirectory() as path:
+        step = max(1, -(-table.num_rows // files))
+        for offset in range(0, table.num_rows, step):
+            write_deltalake(
+                path,
+                table.slice(offset, step),
+                mode="append",
+                partition_by=partition_by,
+            )
+        yield path
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port: int = sock.getsockname()[1]
+        return port
+
+
+def start_server(location: str | None = None, **kwargs: Any) -> Server:
+    """Serve in a background thread, on a free port unless `location` is given.
+
+    The port opens when the server is created, it is returned once its tables
+    have been loaded.
+    """
+    location = location or f"grpc://127.0.0.1:{free_port()}"
+    server = Server(location=location, **kwargs)
+    threading.Thread(target=server.serve, daemon=True).start()
+    server.wait_ready()
+    return server
+
+
+@contextmanager
+def running_server(**kwargs: Any) -> Generator[str, None, None]:
+    """Run a server in a background thread and yield its location."""
+    server = start_server(**kwargs)
+    try:
+        yield server.location
+    finally:
+        server.shutdown()
+
+
+class ByteCounter:
+    """Bytes relayed by a `counting_proxy` from the server to its clients."""
+
+    def __init__(self) -> None:
+        self.received = 0
+        self._lock = threading.Lock()
+
+    def add(self, nbytes: int) -> None:
+        with self._lock:
+            self.received += nbytes
+
+    def reset(self) -> int:
+        """Return the bytes received so far and start counting from zero."""
+        with self._lock:
+            received, self.received = self.received, 0
+        return received
+
+
+def _relay(
+    source: socket.socket, target: socket.socket, counter: ByteCounter | None
+) -> None:
+    try:
+        while data := source.recv(65536):
+            target.sendall(data)
+            if counter is not None:
+                counter.add(len(data))
+    except OSError:
+        pass
+    finally:
+        target.close()
+        source.close()
+
+
+@contextmanager
+def counting_proxy(location: str) -> Generator[tuple[str, ByteCounter], None, None]:
+    """Relay TCP connections to a server and count the bytes it sends.
+
+    Yields the location to connect clients to and the counter of the bytes
+    on the wire, including gRPC and HTTP/2 framing.
+    """
+    host, _, port = location.removeprefix("grpc://").rpartition(":")
+    counter = ByteCounter()
+    listener = socket.create_server(("127.0.0.1", 0))
+
+    def accept() -> None:
+        while True:
+            try:
+                client, _ = listener.accept()
+            except OSError:
+                return
+            server = socket.create_connection((host, int(port)))
+            for args in ((client, server, None), (server, client, counter)):
+                threading.Thread(target=_relay, args=args, daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    try:
+        yield f"grpc://127.0.0.1:{listener.getsockname()[1]}", counter
+    finally:
+        listener.close()
+
+
+def _serve(location: str, kwargs: dict[str, Any]) -> None:
+    Server(location=location, **kwargs).serve()
+
+
+@contextmanager
+def server_process(
+    **kwargs: Any,
+) -> Generator[tuple[str, multiprocessing.Process], None, None]:
+    """Run a server in a separate process, so its memory can be measured."""
+    location = f"grpc://127.0.0.1:{free_port()}"
+    context = multiprocessing.get_context("spawn")
+    process = context.Process(target=_serve, args=(location, kwargs), daemon=True)
+    process.start()
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                # the port opens before the server has finished starting
+                with Client(location) as client:
+                    if client.health()["ready"]:
+                        break
+            except flight.FlightError:
+                if time.monotonic() > deadline or not process.is_alive():
+                    raise
+            time.sleep(0.1)
+        yield location, process
+    finally:
+        process.terminate()
+        process.join()
+
+
+def peak_rss(pid: int | None = None) -> int | None:
+    """Get the peak resident memory of a process in bytes.
+
+    Other processes can only be measured on Linux.
+    """
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid is None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes elsewhere
+        return rss if sys.platform == "darwin" else rss * 1024
+    return None
+
+
+def reset_peak_rss() -> None:
+    """Reset the peak resident memory of this process where supported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as refs:
+            refs.write("5")
+    except OSError:
+        pass
+
+
+def _commit() -> str | None:
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(__file__),
+        )
+    except OSError:
+        return None
+    return output.stdout.strip() or None
+
+
+COMMIT = _commit()
+
+
+def report(result: dict[str, Any]) -> None:
+    """Write a benchmark result as a JSON line to stdout.
+
+    The flydelta version and git commit are added to compare runs.
+    """
+    result = {**result, "version": __version__, "commit": COMMIT}
+    sys.stdout.write(json.dumps(result) + "\n")
+    sys.stdout.flush()
@@ -1,10 +1,11 @@
 """flydelta - A Flight SQL proxy for Delta Lake."""
 
+from flydelta.aio import AsyncClient
 from flydelta.client import Client
 from flydelta.server import SERVER_DEPS_AVAILABLE
 
 __version__ = "0.0.3"
-__all__ = ["Client", "__version__"]
+__all__ = ["AsyncClient", "Client", "__version__"]
 
 if SERVER_DEPS_AVAILABLE:
     from flydelta.server import Server, serve  # noqa: F401
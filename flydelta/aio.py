@@ -0,0 +1,99 @@
+"""Asyncio client for flydelta.
+
+Flight calls block, so they run on a pool of worker threads sharing one
+thread-safe `Client`. The event loop only waits for their results.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncGenerator, Callable, TypeVar
+
+import pyarrow as pa
+
+from flydelta.client import Client
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+class AsyncClient:
+    """Asyncio client for querying flydelta server.
+
+    Args:
+        location: Server location
+        workers: Threads running blocking Flight calls, i.e. the number of
+            calls in progress at once
+        **options: Further `Client` options, e.g. `timeout` or `compression`.
+            `connections` defaults to `workers`.
+    """
+
+    def __init__(
+        self, location: str = "grpc://localhost:8815", workers: int = 8, **options: Any
+    ):
+        options.setdefault("connections", workers)
+        self.client = Client(location, **options)
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="flydelta"
+        )
+
+    async def _run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        return await loop.run_in_executor(self._executor, call)
+
+    async def query(self, sql: str, **kwargs: Any) -> pa.Table:
+        """Execute a SQL query and return results as Arrow table."""
+        return await self._run(self.client.query, sql, **kwargs)
+
+    async def stream_query(
+        self, sql: str, **kwargs: Any
+    ) -> AsyncGenerator[pa.RecordBatch, None]:
+        """Stream query results as record batches with `async for`.
+
+        Each batch is read on a worker thread. Leaving the loop early cancels
+        the query on the server.
+        """
+        batches = self.client.stream_query(sql, **kwargs)
+        try:
+            while True:
+                batch = await self._run(next, batches, _DONE)
+                if batch is _DONE:
+                    return
+                yield batch
+        finally:
+            await self._run(batches.close)
+
+    async def lookup(
+        self, table: str, keys: pa.Table | pa.RecordBatch, **kwargs: Any
+    ) -> pa.Table:
+        """Get the rows of a table matching any row of `keys`."""
+        return await self._run(self.client.lookup, table, keys, **kwargs)
+
+    async def list_tables(self) -> list[str]:
+        """List available tables on the server."""
+        return await self._run(self.client.list_tables)
+
+    async def refresh(self, table: str | None = None) -> dict[str, int]:
+        """Make the server load new versions of one or all tables."""
+        return await self._run(self.client.refresh, table)
+
+    async def cancel(self, query_id: str) -> int:
+        """Cancel running queries started with the given `query_id`."""
+        return await self._run(self.client.cancel, query_id)
+
+    async def health(self) -> dict[str, Any]:
+        """Get whether the server has loaded all tables, and load errors."""
+        return await self._run(self.client.health)
+
+    async def close(self) -> None:
+        """Wait for running calls and close the client connections."""
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+        self.client.close()
+
+    async def __aenter__(self) -> "AsyncClient":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.close()
@@ -0,0 +1,199 @@
+"""In-memory caches with a byte budget and LRU eviction."""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Generator, Generic, Hashable, Iterable, TypeVar
+
+import pyarrow as pa
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace outside of quoted strings and strip trailing `;`."""
+    out: list[str] = []
+    quote: str | None = None
+    pending_space = False
+    for char in sql.strip().rstrip(";").strip():
+        if quote is not None:
+            out.append(char)
+            if char == quote:
+                quote = None
+            continue
+        if char.isspace():
+            pending_space = True
+            continue
+        if pending_space and out:
+            out.append(" ")
+        pending_space = False
+        out.append(char)
+        if char in ("'", '"'):
+            quote = char
+    return "".join(out)
+
+
+@dataclass
+class _Entry(Generic[V]):
+    value: V
+    nbytes: int
+    expires_at: float | None
+
+
+class LRUCache(Generic[K, V]):
+    """Thread-safe LRU cache bounded by the total size of its values.
+
+    Values are stored together with their size in bytes; least recently used
+    entries are evicted until the total fits into `max_bytes`. Entries older
+    than `ttl` seconds are treated as missing.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float | None = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._nbytes = 0
+        self._entries: OrderedDict[K, _Entry[V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        with self._lock:
+            return self._lookup(key) is not None
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def _lookup(self, key: K) -> _Entry[V] | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at is not None and entry.expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        return entry
+
+    def _remove(self, key: K) -> None:
+        entry = self._entries.pop(key)
+        self._nbytes -= entry.nbytes
+
+    def get(self, key: K) -> V | None:
+        """Return the cached value and mark it as recently used."""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def peek(self, key: K) -> V | None:
+        """Return the cached value without touching counters or LRU order."""
+        with self._lock:
+            entry = self._lookup(key)
+            return entry.value if entry is not None else None
+
+    def put(self, key: K, value: V, nbytes: int) -> bool:
+        """Store a value, evicting old entries. Returns False if it can't fit."""
+        if nbytes > self.max_bytes:
+            return False
+        with self._lock:
+            self._insert(key, value, nbytes)
+        return True
+
+    def _insert(self, key: K, value: V, nbytes: int) -> None:
+        if key in self._entries:
+            self._remove(key)
+        self._evict(nbytes)
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._entries[key] = _Entry(value, nbytes, expires_at)
+        self._nbytes += nbytes
+
+    def _evict(self, nbytes: int) -> None:
+        """Remove least recently used entries until `nbytes` more fit."""
+        while self._entries and self._nbytes + nbytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def pop(self, key: K) -> V | None:
+        """Remove a value from the cache and return it."""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                return None
+            self._remove(key)
+            return entry.value
+
+    def keys(self) -> list[K]:
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._nbytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+@dataclass(frozen=True)
+class ResultKey:
+    """Cache key of a query result: normalized SQL and referenced versions."""
+
+    sql: str
+    versions: tuple[tuple[str, int], ...] = field(default=())
+
+    @property
+    def tables(self) -> set[str]:
+        return {name for name, _ in self.versions}
+
+
+class ResultCache(LRUCache[ResultKey, pa.Table]):
+    """Cache of finished query results as Arrow tables."""
+
+    def collect(
+        self,
+        key: ResultKey,
+        schema: pa.Schema,
+        batches: Iterable[pa.RecordBatch],
+    ) -> Generator[pa.RecordBatch, None, None]:
+        """Pass batches through and cache them once the stream is exhausted.
+
+        Collection is abandoned as soon as the result outgrows the budget.
+        """
+        collected: list[pa.RecordBatch] | None = []
+        nbytes = 0
+        for batch in batches:
+            if collected is not None:
+                nbytes += batch.nbytes
+                if nbytes > self.max_bytes:
+                    collected = None
+                else:
+                    collected.append(batch)
+            yield batch
+        if collected is not None:
+            self.put(key, pa.Table.from_batches(collected, schema), nbytes)
+
+    def invalidate(self, table: str) -> int:
+        """Drop all results that reference the given table."""
+        dropped = 0
+        for key in self.keys():
+            if table in key.tables and self.pop(key) is not None:
+                dropped += 1
+        return dropped
@@ -3,6 +3,7 @@
 The serve command requires server dependencies: pip install flydelta[server]
 """
 
+import sys
 from typing import Annotated, Optional
 
 import typer
@@ -33,7 +34,51 @@ def cli_serve(
     port: Annotated[int, typer.Option("--port", "-p", help="Port to bind to")] = 8815,
     table: Annotated[
         Optional[list[str]],
-        typer.Option("--table", "-t", help="Table in format name=uri"),
+        typer.Option(
+            "--table",
+            "-t",
+            help="Table in format name=uri, name=uri:pin to keep it in memory",
+        ),
+    ] = None,
+    pin_memory: Annotated[
+        Optional[int],
+        typer.Option("--pin-memory", help="Memory for pinned tables in MB"),
+    ] = None,
+    materialized_view: Annotated[
+        Optional[list[str]],
+        typer.Option(
+            "--materialized-view",
+            help="View in format name=SQL, kept up to date as tables change",
+        ),
+    ] = None,
+    disk_cache_dir: Annotated[
+        Optional[str],
+        typer.Option("--disk-cache-dir", help="Cache table files in this directory"),
+    ] = None,
+    disk_cache_size: Annotated[
+        int,
+        typer.Option("--disk-cache-size", help="Disk cache size in MB"),
+    ] = 10240,
+    snapshot_cache_size: Annotated[
+        int,
+        typer.Option("--snapshot-cache-size", help="Older table versions kept loaded"),
+    ] = 16,
+    load_workers: Annotated[
+        int,
+        typer.Option("--load-workers", help="Threads loading tables on startup"),
+    ] = 8,
+    background_load: Annotated[
+        bool,
+        typer.Option(
+            "--background-load",
+            help="Accept connections while tables are still loading",
+        ),
+    ] = False,
+    metadata_cache: Annotated[
+        Optional[str],
+        typer.Option(
+            "--metadata-cache", help="File keeping table schemas across restarts"
+        ),
     ] = None,
     pool_size: Annotated[
         int, typer.Option("--pool-size", help="DuckDB connection pool size")
@@ -41,6 +86,179 @@ def cli_serve(
     batch_size: Annotated[
         int, typer.Option("--batch-size", help="Rows per batch when streaming")
     ] = 100_000,
+    batch_bytes: Annotated[
+        Optional[int],
+        typer.Option(
+            "--batch-bytes",
+            help="Coalesce and split result batches to about N bytes",
+        ),
+    ] = None,
+    prefetch: Annotated[
+        int,
+        typer.Option(
+            "--prefetch", help="Batches read ahead of the client per query (0 off)"
+        ),
+    ] = 0,
+    spill_after: Annotated[
+        Optional[float],
+        typer.Option(
+            "--spill-after",
+            help="Spill results to disk if a client doesn't read for N seconds",
+        ),
+    ] = None,
+    spill_dir: Annotated[
+        Optional[str],
+        typer.Option("--spill-dir", help="Directory for spilled results"),
+    ] = None,
+    spool_dir: Annotated[
+        Optional[str],
+        typer.Option(
+            "--spool-dir", help="Directory for results spooled on client request"
+        ),
+    ] = None,
+    spool_size: Annotated[
+        int,
+        typer.Option("--spool-size", help="Disk space for spooled results in MB"),
+    ] = 10240,
+    spool_ttl: Annotated[
+        float,
+        typer.Option("--spool-ttl", help="Seconds spooled results are kept"),
+    ] = 3600,
+    spool_segment_size: Annotated[
+        int,
+        typer.Option("--spool-segment-size", help="Size of spool segments in MB"),
+    ] = 64,
+    max_query_time: Annotated[
+        Optional[float],
+        typer.Option("--max-query-time", help="Interrupt queries after N seconds"),
+    ] = None,
+    max_rows: Annotated[
+        Optional[int],
+        typer.Option("--max-rows", help="Fail queries returning more than N rows"),
+    ] = None,
+    query_memory_limit: Annotated[
+        Optional[str],
+        typer.Option(
+            "--query-memory-limit", help="DuckDB memory limit per query, e.g. 2GB"
+        ),
+    ] = None,
+    query_threads: Annotated[
+        Optional[int],
+        typer.Option("--query-threads", help="DuckDB threads per query"),
+    ] = None,
+    shared_database: Annotated[
+        bool,
+        typer.Option(
+            "--shared-database",
+            help="Run all queries in one DuckDB database with a cursor each",
+        ),
+    ] = False,
+    memory_limit: Annotated[
+        Optional[str],
+        typer.Option(
+            "--memory-limit", help="Memory limit of the shared database, e.g. 8GB"
+        ),
+    ] = None,
+    threads: Annotated[
+        Optional[int],
+        typer.Option("--threads", help="Threads of the shared database"),
+    ] = None,
+    pool_min_size: Annotated[
+        int,
+        typer.Option("--pool-min-size", help="Connections kept open per pool lane"),
+    ] = 1,
+    pool_lane: Annotated[
+        Optional[list[str]],
+        typer.Option(
+            "--pool-lane", help="Extra pool lane in format name=size (e.g. bulk=4)"
+        ),
+    ] = None,
+    pool_timeout: Annotated[
+        Optional[float],
+        typer.Option("--pool-timeout", help="Max seconds to wait for a connection"),
+    ] = None,
+    pool_max_waiting: Annotated[
+        Optional[int],
+        typer.Option("--pool-max-waiting", help="Max queries waiting per pool lane"),
+    ] = None,
+    pool_idle_timeout: Annotated[
+        float,
+        typer.Option(
+            "--pool-idle-timeout",
+            help="Close surplus connections idle for N seconds (0 never)",
+        ),
+    ] = 300,
+    cache_size: Annotated[
+        int,
+        typer.Option("--cache-size", help="Result cache size in MB (0 disables)"),
+    ] = 0,
+    cache_ttl: Annotated[
+        Optional[float],
+        typer.Option("--cache-ttl", help="Result cache entry lifetime in seconds"),
+    ] = None,
+    plan_cache_size: Annotated[
+        int,
+        typer.Option("--plan-cache-size", help="Query plan cache size in MB"),
+    ] = 64,
+    statement_ttl: Annotated[
+        float,
+        typer.Option(
+            "--statement-ttl",
+            help="Drop prepared statements unused for N seconds (0 never)",
+        ),
+    ] = 3600,
+    max_statements: Annotated[
+        int,
+        typer.Option("--max-statements", help="Max prepared statements kept"),
+    ] = 1000,
+    max_endpoints: Annotated[
+        int,
+        typer.Option(
+            "--max-endpoints", help="Split table scans into up to N parallel streams"
+        ),
+    ] = 1,
+    peer: Annotated[
+        Optional[list[str]],
+        typer.Option(
+            "--peer", help="Location of another cluster node, e.g. grpc://host:8815"
+        ),
+    ] = None,
+    peers_file: Annotated[
+        Optional[str],
+        typer.Option("--peers-file", help="File listing cluster nodes, one per line"),
+    ] = None,
+    refresh_interval: Annotated[
+        Optional[float],
+        typer.Option(
+            "--refresh-interval", help="Check tables for new versions every N seconds"
+        ),
+    ] = None,
+    compression: Annotated[
+        Optional[str],
+        typer.Option("--compression", help="Wire compression: lz4 or zstd"),
+    ] = None,
+    compression_level: Annotated[
+        Optional[int],
+        typer.Option("--compression-level", help="Compression level of the codec"),
+    ] = None,
+    compression_threshold: Annotated[
+        int,
+        typer.Option(
+            "--compression-threshold",
+            help="Don't compress results with a first batch below N bytes",
+        ),
+    ] = 65536,
+    dictionary_ratio: Annotated[
+        float,
+        typer.Option(
+            "--dictionary-ratio",
+            help="Max share of distinct values to dictionary encode strings",
+        ),
+    ] = 0,
+    metrics_port: Annotated[
+        Optional[int],
+        typer.Option("--metrics-port", help="Serve Prometheus metrics on this port"),
+    ] = None,
 ):
     """
     Start the flydelta Flight SQL server.
@@ -58,6 +276,7 @@ def cli_serve(
     from flydelta.server import serve
 
     tables = {}
+    pinned = []
     if table:
         for t in table:
             if "=" not in t:
@@ -65,20 +284,103 @@ def cli_serve(
                 console.print("Use: name=uri (e.g., users=s3://bucket/users)")
                 raise typer.Exit(1)
             name, uri = t.split("=", 1)
+            if uri.endswith(":pin"):
+                uri = uri.removesuffix(":pin")
+                pinned.append(name)
             tables[name] = uri
 
     if not tables:
         console.print("[yellow]Warning: No tables registered[/yellow]")
 
+    views = {}
+    for view in materialized_view or []:
+        name, _, sql = view.partition("=")
+        if not sql:
+            console.print(f"[red]Invalid materialized view format: {view}[/red]")
+            console.print("Use: name=SQL (e.g., daily=SELECT day, COUNT(*) ...)")
+            raise typer.Exit(1)
+        views[name.strip()] = sql
+
+    lanes: dict[str, int] = {}
+    for lane in pool_lane or []:
+        name, _, lane_size = lane.partition("=")
+        if not lane_size.isdigit():
+            console.print(f"[red]Invalid pool lane format: {lane}[/red]")
+            console.print("Use: name=size (e.g., bulk=4)")
+            raise typer.Exit(1)
+        lanes[name] = int(lane_size)
+
     console.print(f"[green]Starting flydelta on grpc://{host}:{port}[/green]")
     console.print(
         f"[green]Connection pool size: {pool_size}, batch size: {batch_size}[/green]"
     )
+    for name, size in lanes.items():
+        console.print(f"[green]Pool lane {name}: {size} connections[/green]")
+    if cache_size:
+        console.print(f"[green]Result cache size: {cache_size} MB[/green]")
+    if disk_cache_dir is not None:
+        console.print(
+            f"[green]Disk cache: {disk_cache_dir} ({disk_cache_size} MB)[/green]"
+        )
+    if spool_dir is not None:
+        console.print(f"[green]Spool: {spool_dir} ({spool_size} MB)[/green]")
+    if metrics_port is not None:
+        console.print(f"[green]Metrics on http://{host}:{metrics_port}/metrics[/green]")
     for name, uri in tables.items():
-        console.print(f"  [blue]{name}[/blue] -> {uri}")
+        pin = " (pinned)" if name in pinned else ""
+        console.print(f"  [blue]{name}[/blue] -> {uri}{pin}")
+    for name, sql in views.items():
+        console.print(f"  [blue]{name}[/blue] = {sql} (materialized)")
 
     serve(
-        host=host, port=port, tables=tables, pool_size=pool_size, batch_size=batch_size
+        host=host,
+        port=port,
+        tables=tables,
+        pinned=pinned,
+        pin_memory=pin_memory * 1024 * 1024 if pin_memory is not None else None,
+        materialized_views=views,
+        disk_cache_dir=disk_cache_dir,
+        disk_cache_size=disk_cache_size * 1024 * 1024,
+        snapshot_cache_size=snapshot_cache_size,
+        load_workers=load_workers,
+        background_load=background_load,
+        metadata_cache=metadata_cache,
+        pool_size=pool_size,
+        batch_size=batch_size,
+        batch_bytes=batch_bytes,
+        prefetch=prefetch,
+        spill_after=spill_after,
+        spill_dir=spill_dir,
+        spool_dir=spool_dir,
+        spool_size=spool_size * 1024 * 1024,
+        spool_ttl=spool_ttl,
+        spool_segment_bytes=spool_segment_size * 1024 * 1024,
+        max_query_time=max_query_time,
+        max_rows=max_rows,
+        query_memory_limit=query_memory_limit,
+        query_threads=query_threads,
+        shared_database=shared_database,
+        memory_limit=memory_limit,
+        threads=threads,
+        pool_min_size=pool_min_size,
+        pool_lanes=lanes,
+        pool_timeout=pool_timeout,
+        pool_max_waiting=pool_max_waiting,
+        pool_idle_timeout=pool_idle_timeout or None,
+        cache_size=cache_size * 1024 * 1024,
+        cache_ttl=cache_ttl,
+        plan_cache_size=plan_cache_size * 1024 * 1024,
+        statement_ttl=statement_ttl or None,
+        max_statements=max_statements,
+        max_endpoints=max_endpoints,
+        peers=peer or [],
+        peers_file=peers_file,
+        refresh_interval=refresh_interval,
+        compression=compression,
+        compression_level=compression_level,
+        compression_threshold=compression_threshold,
+        dictionary_ratio=dictionary_ratio,
+        metrics_port=metrics_port,
     )
 
 
@@ -90,31 +392,59 @@ def cli_query(
     ] = "localhost",
     port: Annotated[int, typer.Option("--port", "-p", help="Server port")] = 8815,
     output: Annotated[
-        str, typer.Option("--output", "-o", help="Output format")
-    ] = "table",
+        Optional[str],
+        typer.Option(
+            "--output",
+            "-o",
+            help="Output format: table, json, ndjson, csv, parquet, arrow, feather",
+        ),
+    ] = None,
+    out: Annotated[
+        Optional[str],
+        typer.Option("--out", help="Stream results into this file"),
+    ] = None,
+    compression: Annotated[
+        Optional[str],
+        typer.Option("--compression", help="Request wire compression: lz4 or zstd"),
+    ] = None,
 ):
     """
     Execute a SQL query against flydelta server.
 
+    Results other than the table output are written batch by batch.
+
     Example:
         flydelta query "SELECT * FROM users LIMIT 10"
+        flydelta query "SELECT * FROM users" --out users.parquet
     """
     from flydelta.client import Client
+    from flydelta.export import FORMATS, guess_format
 
     location = f"grpc://{host}:{port}"
 
-    with Client(location) as client:
-        result = client.query(sql)
+    if output is None:
+        output = "table"
+        if out is not None:
+            try:
+                output = guess_format(out)
+            except ValueError as e:
+                console.print(f"[red]{e}[/red]")
+                raise typer.Exit(1)
+    if output != "table" and output not in FORMATS:
+        console.print(f"[red]Unknown output format: {output}[/red]")
+        raise typer.Exit(1)
 
-        if output == "table":
+    with Client(location, compression=compression) as client:
+        if out is not None:
+            rows = client.export(sql, out, output)
+            console.print(f"[green]Wrote {rows} rows to {out}[/green]")
+        elif output == "table":
+            result = client.read_all(sql)
             console.print(result.to_pandas().to_string())
-        elif output == "json":
-            print(result.to_pandas().to_json(orient="records"))
-        elif output == "csv":
-            print(result.to_pandas().to_csv(index=False))
         else:
-            console.print(f"[red]Unknown output format: {output}[/red]")
-            raise typer.Exit(1)
+            sys.stdout.flush()
+            client.export(sql, sys.stdout.buffer, output)
+            sys.stdout.buffer.flush()
 
 
 @cli.command("tables")
@@ -1,46 +1,655 @@
 """Flight client for connecting to flydelta."""
 
-from typing import Generator
+import base64
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Full, Queue
+from typing import IO, Any, Generator, Sequence
 
 import pyarrow as pa
 import pyarrow.flight as flight
 
+from flydelta.clientcache import ClientCache
+from flydelta.export import check_format, guess_format, write_batches
+from flydelta.ipc import BATCH_BYTES_HEADER, COMPRESSION_HEADER, QUERY_ID_HEADER
+from flydelta.lookup import Lookup, encode_lookup
+from flydelta.pool import LANE_HEADER
+from flydelta.spool import SPOOL_HEADER
+from flydelta.statement import encode_ticket, params_batch
+from flydelta.tracing import trace_headers
+
+# Batches buffered per endpoint when fetching endpoints in parallel
+PREFETCH_BATCHES = 4
+
+# Rows of keys sent per batch to the server by lookup
+LOOKUP_BATCH_ROWS = 65536
+
+# Errors of a server that is busy or still starting, worth retrying
+RETRYABLE_ERRORS = (flight.FlightUnavailableError,)
+
+_DONE = object()
+
+
+def _put(queue: Queue[Any], item: Any, stop: threading.Event) -> bool:
+    """Put an item into a bounded queue unless the consumer has stopped."""
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            continue
+    return False
+
+
+class PreparedStatement:
+    """A statement prepared on the server, executed with bound parameters.
+
+    Each execution is a single request, the server keeps the statement
+    prepared on its connections until it is closed.
+    """
+
+    def __init__(
+        self, client: "Client", handle: str, parameters: int, schema: pa.Schema
+    ):
+        self.handle = handle
+        self.parameters = parameters
+        self.schema = schema
+        self._client = client
+
+    def execute(
+        self,
+        params: Sequence[Any] = (),
+        compression: str | None = None,
+        lane: str | None = None,
+    ) -> pa.Table:
+        """Execute the statement with one set of parameters."""
+        return self.executemany([params], compression=compression, lane=lane)
+
+    def executemany(
+        self,
+        params: Sequence[Sequence[Any]] | pa.RecordBatch | pa.Table,
+        compression: str | None = None,
+        lane: str | None = None,
+    ) -> pa.Table:
+        """Execute the statement for each row of parameters.
+
+        `params` is a sequence of rows or an Arrow batch/table with one column
+        per parameter. The results of all rows are concatenated, no rows give
+        an empty result without a request.
+        """
+        if len(params) == 0:
+            return self.schema.empty_table()
+        if isinstance(params, pa.Table):
+            params = params.combine_chunks().to_batches()[0]
+        elif not isinstance(params, pa.RecordBatch):
+            params = params_batch(params) if self.parameters else None
+        ticket = flight.Ticket(encode_ticket(self.handle, params))
+        options = self._client._call_options(compression, lane)
+        return self._client._connection().do_get(ticket, options).read_all()
+
+    def close(self) -> None:
+        """Release the statement on the server."""
+        action = flight.Action("close_prepared_statement", self.handle.encode())
+        list(self._client._connection().do_action(action))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 
 class Client:
-    """Client for querying flydelta server."""
+    """Client for querying flydelta server.
+
+    The client is thread-safe. Calls are spread over `connections` gRPC
+    channels in turn, so many threads can stream results at once without
+    sharing one connection.
+
+    Args:
+        location: Server location
+        compression: Wire compression requested for results
+        batch_bytes: Target size of result batches in bytes
+        connections: Number of gRPC channels to the server
+        timeout: Timeout of each call in seconds
+        retries: Retries of planning a query while the server is unavailable,
+            and of a spooled segment interrupted by a connection error
+        retry_backoff: Seconds before the first retry, doubled for each next
+        max_message_size: Largest gRPC message sent or received, in bytes
+        keepalive: Seconds between keepalive pings on idle channels
+        generic_options: Further gRPC channel arguments
+        cache_size: Bytes of `query` results cached by the client, 0 disables
+            the cache
+        cache_dir: Directory keeping cached results across runs, in memory
+            if omitted
+        cache_ttl: Seconds cached results are used at most
+    """
 
-    def __init__(self, location: str = "grpc://localhost:8815"):
+    def __init__(
+        self,
+        location: str = "grpc://localhost:8815",
+        compression: str | None = None,
+        batch_bytes: int | None = None,
+        connections: int = 1,
+        timeout: float | None = None,
+        retries: int = 3,
+        retry_backoff: float = 0.1,
+        max_message_size: int | None = None,
+        keepalive: float | None = None,
+        generic_options: Sequence[tuple[str, Any]] = (),
+        cache_size: int = 0,
+        cache_dir: str | None = None,
+        cache_ttl: float | None = None,
+    ):
         self.location = location
-        self._client = flight.connect(location)
+        self.compression = compression
+        self.batch_bytes = batch_bytes
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        options = list(generic_options)
+        if max_message_size is not None:
+            options.append(("grpc.max_receive_message_length", max_message_size))
+            options.append(("grpc.max_send_message_length", max_message_size))
+        if keepalive is not None:
+            options.append(("grpc.keepalive_time_ms", int(keepalive * 1000)))
+        if connections > 1:
+            # channels with equal arguments would share one TCP connection
+            options.append(("grpc.use_local_subchannel_pool", 1))
+        self._options = options
+        self._clients = [
+            flight.connect(location, generic_options=options)
+            for _ in range(max(1, connections))
+        ]
+        self._client = self._clients[0]
+        self._next = itertools.cycle(self._clients)
+        self._next_lock = threading.Lock()
+        # Connections to other nodes of a cluster serving endpoints
+        self._nodes: dict[str, flight.FlightClient] = {}
+        self._cache: ClientCache | None = None
+        if cache_size > 0:
+            self._cache = ClientCache(cache_size, cache_dir, cache_ttl)
+
+    def _connection(self, location: str | None = None) -> flight.FlightClient:
+        """Get the next of the client's connections, or one to `location`."""
+        with self._next_lock:
+            if location is None or location == self.location:
+                return next(self._next)
+            client = self._nodes.get(location)
+            if client is None:
+                client = flight.connect(location, generic_options=self._options)
+                self._nodes[location] = client
+            return client
+
+    def _open(
+        self, endpoint: flight.FlightEndpoint, options: flight.FlightCallOptions
+    ) -> flight.FlightStreamReader:
+        """Request the stream of an endpoint from the first available location.
+
+        Endpoints without locations are read from the client's server.
+        """
+        locations: list[str | None] = [
+            location.uri.decode("utf-8") for location in endpoint.locations
+        ]
+        for location in locations[:-1]:
+            try:
+                return self._connection(location).do_get(endpoint.ticket, options)
+            except RETRYABLE_ERRORS:
+                continue
+        last = locations[-1] if locations else None
+        return self._connection(last).do_get(endpoint.ticket, options)
+
+    def _action(self, name: str, body: bytes = b"") -> Any:
+        """Run an action on the server and decode its JSON result."""
+        action = flight.Action(name, body)
+        options = flight.FlightCallOptions(timeout=self.timeout)
+        result = next(iter(self._connection().do_action(action, options)))
+        return json.loads(result.body.to_pybytes())
+
+    def _call_options(
+        self,
+        compression: str | None = None,
+        lane: str | None = None,
+        batch_bytes: int | None = None,
+        query_id: str | None = None,
+    ) -> flight.FlightCallOptions:
+        """Get call options requesting result compression, lane and batch size.
+
+        The current trace context is propagated if OpenTelemetry is installed.
+        """
+        headers = trace_headers()
+        compression = compression or self.compression
+        if compression:
+            headers.append((COMPRESSION_HEADER.encode(), compression.encode()))
+        if lane:
+            headers.append((LANE_HEADER.encode(), lane.encode()))
+        batch_bytes = self.batch_bytes if batch_bytes is None else batch_bytes
+        if batch_bytes is not None:
+            headers.append((BATCH_BYTES_HEADER.encode(), str(batch_bytes).encode()))
+        if query_id:
+            headers.append((QUERY_ID_HEADER.encode(), query_id.encode()))
+        return flight.FlightCallOptions(headers=headers, timeout=self.timeout)
+
+    def stream_query(
+        self,
+        sql: str,
+        parallel: int = 1,
+        ordered: bool = True,
+        compression: str | None = None,
+        lane: str | None = None,
+        batch_bytes: int | None = None,
+        query_id: str | None = None,
+        spool: bool = False,
+    ) -> Generator[pa.RecordBatch, None, None]:
+        """Stream query results as record batches (memory efficient).
+
+        With `parallel` > 1, the endpoints of a query split by the server are
+        fetched concurrently on that many threads. Batches are yielded in
+        endpoint order if `ordered`, otherwise as soon as they arrive. Each
+        endpoint is read from the cluster node it was assigned to, and from
+        the planning server if that node is unavailable.
 
-    def stream_query(self, sql: str) -> Generator[pa.RecordBatch, None, None]:
-        """Stream query results as record batches (memory efficient)."""
+        `compression` (`lz4`, `zstd` or `none`) overrides the server's choice
+        of wire compression for this query. `lane` selects the server's
+        connection pool lane, e.g. to keep bulk exports from blocking
+        interactive queries. `batch_bytes` asks the server for batches of
+        about this size in bytes (0 for the row count the server reads).
+        `query_id` names the query so it can be stopped with `cancel`.
+
+        With `spool`, the server runs the query into segment files first (see
+        `spool`), and a segment interrupted by a connection error is fetched
+        again from where it stopped instead of failing the whole result.
+
+        Closing the generator early cancels the query on the server.
+        """
+        if spool:
+            info = self.spool(sql, lane=lane, query_id=query_id)
+        else:
+            info = self._get_info(sql)
+        options = self._call_options(compression, lane, batch_bytes, query_id)
+        yield from self._stream(info, options, parallel, ordered)
+
+    def spool(
+        self, sql: str, lane: str | None = None, query_id: str | None = None
+    ) -> flight.FlightInfo:
+        """Run a query into a spool on the server and get its segments.
+
+        The query runs once while this call waits, so the client `timeout`
+        must allow for it. Each endpoint of the returned info reads one
+        segment and can be fetched any number of times until it expires,
+        e.g. with `stream_segments` to continue an interrupted export.
+        """
+        return self._get_info(sql, spool=True, lane=lane, query_id=query_id)
+
+    def stream_segments(
+        self,
+        info: flight.FlightInfo,
+        start: int = 0,
+        parallel: int = 1,
+        ordered: bool = True,
+        compression: str | None = None,
+        batch_bytes: int | None = None,
+    ) -> Generator[pa.RecordBatch, None, None]:
+        """Stream the segments of a spooled query from index `start` on."""
+        info = flight.FlightInfo(
+            info.schema,
+            info.descriptor,
+            info.endpoints[start:],
+            info.total_records,
+            info.total_bytes,
+        )
+        options = self._call_options(compression, batch_bytes=batch_bytes)
+        yield from self._stream(info, options, parallel, ordered)
+
+    def _get_info(
+        self,
+        sql: str,
+        spool: bool = False,
+        lane: str | None = None,
+        query_id: str | None = None,
+    ) -> flight.FlightInfo:
+        """Plan a query on the server, retrying while it is unavailable.
+
+        A spooled query runs during planning, so it needs its lane and id.
+        """
         descriptor = flight.FlightDescriptor.for_command(sql.encode("utf-8"))
-        info = self._client.get_flight_info(descriptor)
+        headers = trace_headers()
+        if spool:
+            headers.append((SPOOL_HEADER.encode(), b"1"))
+            if lane:
+                headers.append((LANE_HEADER.encode(), lane.encode()))
+            if query_id:
+                headers.append((QUERY_ID_HEADER.encode(), query_id.encode()))
+        options = flight.FlightCallOptions(headers=headers, timeout=self.timeout)
+        attempt = 0
+        while True:
+            try:
+                return self._connection().get_flight_info(descriptor, options)
+            except RETRYABLE_ERRORS:
+                if attempt >= self.retries:
+                    raise
+                time.sleep(self.retry_backoff * 2**attempt)
+                attempt += 1
+
+    def _stream(
+        self,
+        info: flight.FlightInfo,
+        options: flight.FlightCallOptions,
+        parallel: int = 1,
+        ordered: bool = True,
+    ) -> Generator[pa.RecordBatch, None, None]:
+        """Yield the batches of all endpoints of a planned query."""
+        if parallel > 1 and len(info.endpoints) > 1:
+            yield from self._stream_parallel(info.endpoints, parallel, ordered, options)
+            return
 
         for endpoint in info.endpoints:
-            reader = self._client.do_get(endpoint.ticket)
-            for batch in reader:
-                yield batch.data
+            yield from self._read_endpoint(endpoint, options)
+
+    def _read_endpoint(
+        self,
+        endpoint: flight.FlightEndpoint,
+        options: flight.FlightCallOptions,
+        readers: list[flight.FlightStreamReader] | None = None,
+    ) -> Generator[pa.RecordBatch, None, None]:
+        """Yield the batches of an endpoint.
+
+        Endpoints with an expiration time may be requested again. If their
+        stream fails with a connection error, it is requested again and
+        continues after the last batch received. Opened readers are added
+        to `readers`. See `_open` for endpoints with several locations.
+        """
+        received = 0
+        attempt = 0
+        while True:
+            reader = None
+            done = False
+            try:
+                reader = self._open(endpoint, options)
+                if readers is not None:
+                    readers.append(reader)
+                for i, chunk in enumerate(reader):
+                    if i < received:
+                        continue
+                    received += 1
+                    attempt = 0
+                    yield chunk.data
+                done = True
+                return
+            except RETRYABLE_ERRORS:
+                if endpoint.expiration_time is None or attempt >= self.retries:
+                    raise
+            finally:
+                if not done and reader is not None:
+                    reader.cancel()
+            time.sleep(self.retry_backoff * 2**attempt)
+            attempt += 1
+
+    def _stream_parallel(
+        self,
+        endpoints: list[flight.FlightEndpoint],
+        parallel: int,
+        ordered: bool,
+        options: flight.FlightCallOptions,
+    ) -> Generator[pa.RecordBatch, None, None]:
+        """Fetch endpoints on a thread pool and yield their batches."""
+        stop = threading.Event()
+        readers: list[flight.FlightStreamReader] = []
+        if ordered:
+            queues: list[Queue[Any]] = [
+                Queue(maxsize=PREFETCH_BATCHES) for _ in endpoints
+            ]
+        else:
+            queues = [Queue(maxsize=PREFETCH_BATCHES * parallel)] * len(endpoints)
+
+        def fetch(i: int, endpoint: flight.FlightEndpoint) -> None:
+            try:
+                if stop.is_set():
+                    return
+                for batch in self._read_endpoint(endpoint, options, readers):
+                    if not _put(queues[i], batch, stop):
+                        return
+                _put(queues[i], _DONE, stop)
+            except Exception as e:
+                _put(queues[i], e, stop)
+
+        executor = ThreadPoolExecutor(max_workers=parallel)
+        try:
+            for i, endpoint in enumerate(endpoints):
+                executor.submit(fetch, i, endpoint)
+            remaining = len(endpoints)
+            i = 0
+            while remaining:
+                item = queues[i].get()
+                if item is _DONE:
+                    remaining -= 1
+                    i = i + 1 if ordered else i
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.cancel()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def query(
+        self,
+        sql: str,
+        parallel: int = 1,
+        compression: str | None = None,
+        lane: str | None = None,
+        query_id: str | None = None,
+        spool: bool = False,
+    ) -> pa.Table:
+        """Execute a SQL query and return results as Arrow table.
+
+        With a client cache, the result of an earlier call is returned as
+        long as the server reports the tables of the query unchanged.
+        """
+        versions = None
+        if self._cache is not None:
+            versions = self.versions(sql)
+            if versions:
+                cached = self._cache.load(sql, versions)
+                if cached is not None:
+                    return cached
+        if parallel <= 1 and not spool:
+            result = self.read_all(
+                sql, compression=compression, lane=lane, query_id=query_id
+            )
+        else:
+            if spool:
+                info = self.spool(sql, lane=lane, query_id=query_id)
+            else:
+                info = self._get_info(sql)
+            options = self._call_options(compression, lane, query_id=query_id)
+            batches = list(self._stream(info, options, parallel))
+            if batches:
+                result = pa.Table.from_batches(batches)
+            else:
+                result = info.schema.empty_table()
+        if self._cache is not None and versions:
+            # stored with the versions from before the download, so a table
+            # refreshed meanwhile only causes another download
+            self._cache.store(sql, versions, result)
+        return result
+
+    def read_all(
+        self,
+        sql: str,
+        compression: str | None = None,
+        lane: str | None = None,
+        query_id: str | None = None,
+    ) -> pa.Table:
+        """Execute a SQL query and read the results with the Flight reader.
 
-    def query(self, sql: str) -> pa.Table:
-        """Execute a SQL query and return results as Arrow table."""
-        batches = list(self.stream_query(sql))
-        if not batches:
-            return pa.table({})
-        return pa.Table.from_batches(batches)
+        The table is assembled by Arrow from the received buffers without
+        going through Python objects per batch.
+        """
+        info = self._get_info(sql)
+        options = self._call_options(compression, lane, query_id=query_id)
+        tables = [
+            self._open(endpoint, options).read_all() for endpoint in info.endpoints
+        ]
+        if not tables:
+            return info.schema.empty_table()
+        if len(tables) == 1:
+            return tables[0]
+        return pa.concat_tables(tables)
+
+    def export(
+        self,
+        sql: str,
+        sink: str | IO[bytes],
+        format: str | None = None,
+        parallel: int = 1,
+        compression: str | None = None,
+        lane: str | None = None,
+        batch_bytes: int | None = None,
+        query_id: str | None = None,
+        spool: bool = False,
+    ) -> int:
+        """Stream query results into a file, one batch at a time.
+
+        `sink` is a path or binary file object, `format` one of `parquet`,
+        `arrow`, `feather`, `csv`, `json` or `ndjson` (guessed from the path
+        if omitted). Returns the number of rows written. With `spool`, the
+        result is spooled on the server first as in `stream_query`.
+        """
+        if format is None:
+            if not isinstance(sink, str):
+                raise ValueError("Output format is required for file objects")
+            format = guess_format(sink)
+        check_format(format)
+        if spool:
+            info = self.spool(sql, lane=lane, query_id=query_id)
+        else:
+            info = self._get_info(sql)
+        options = self._call_options(compression, lane, batch_bytes, query_id)
+        batches = self._stream(info, options, parallel)
+        first = next(batches, None)
+        if first is None:
+            return write_batches(info.schema, [], sink, format)
+        return write_batches(
+            first.schema, itertools.chain([first], batches), sink, format
+        )
+
+    def lookup(
+        self,
+        table: str,
+        keys: pa.Table | pa.RecordBatch,
+        on: str | Sequence[str] | None = None,
+        columns: Sequence[str] | None = None,
+        compression: str | None = None,
+        lane: str | None = None,
+        query_id: str | None = None,
+    ) -> pa.Table:
+        """Get the rows of a table matching any row of `keys`.
+
+        The keys are streamed to the server and joined against the table on
+        the `on` columns (all columns of `keys` if omitted), reading only
+        the files whose statistics can hold the keys. `columns` selects the
+        columns returned, all by default.
+        """
+        if isinstance(keys, pa.RecordBatch):
+            keys = pa.Table.from_batches([keys])
+        if isinstance(on, str):
+            on = [on]
+        on = list(on or keys.column_names)
+        keys = keys.select(on)
+        lookup = Lookup(table, on, list(columns) if columns is not None else None)
+        descriptor = flight.FlightDescriptor.for_command(encode_lookup(lookup))
+        options = self._call_options(compression, lane, query_id=query_id)
+        writer, reader = self._connection().do_exchange(descriptor, options)
+        with writer:
+            writer.begin(keys.schema)
+            for batch in keys.to_batches(max_chunksize=LOOKUP_BATCH_ROWS):
+                writer.write_batch(batch)
+            writer.done_writing()
+            return reader.read_all()
+
+    def prepare(self, sql: str) -> PreparedStatement:
+        """Prepare a SELECT statement with `?` or `$n` parameters."""
+        statement = self._action("create_prepared_statement", sql.encode("utf-8"))
+        schema = pa.ipc.read_schema(pa.py_buffer(base64.b64decode(statement["schema"])))
+        return PreparedStatement(
+            self, statement["handle"], statement["parameters"], schema
+        )
 
     def list_tables(self) -> list[str]:
         """List available tables on the server."""
         tables = []
-        for info in self._client.list_flights():
+        options = flight.FlightCallOptions(timeout=self.timeout)
+        for info in self._connection().list_flights(options=options):
             if info.descriptor.path:
                 tables.append(info.descriptor.path[0].decode("utf-8"))
         return tables
 
+    def cache_stats(self) -> dict[str, Any]:
+        """Get hit/miss counters of the server result cache."""
+        stats: dict[str, Any] = self._action("cache_stats")
+        return stats
+
+    def pool_stats(self) -> dict[str, dict[str, Any]]:
+        """Get connection pool usage and wait times per lane of the server."""
+        stats: dict[str, dict[str, Any]] = self._action("pool_stats")
+        return stats
+
+    def scan_stats(self) -> dict[str, int]:
+        """Get the number of files scanned and skipped by the server."""
+        stats: dict[str, int] = self._action("scan_stats")
+        return stats
+
+    def scan_info(self, sql: str) -> dict[str, Any]:
+        """Plan a query and get the number of table files it reads and skips."""
+        info = self._get_info(sql)
+        scan: dict[str, Any] = json.loads(info.app_metadata or b"{}")
+        return scan
+
+    def versions(self, sql: str) -> dict[str, int] | None:
+        """Get the versions of the tables a query reads, None if not cacheable.
+
+        Queries reading no table or calling volatile functions like random()
+        have no versions, as nothing tells when their result changes.
+        """
+        versions: dict[str, int] | None = self._action("versions", sql.encode("utf-8"))[
+            "versions"
+        ]
+        return versions
+
+    def client_cache_stats(self) -> dict[str, int]:
+        """Get hit/miss counters of the client result cache."""
+        return self._cache.stats() if self._cache is not None else {}
+
+    def health(self) -> dict[str, Any]:
+        """Get whether the server has loaded all tables, and load errors."""
+        health: dict[str, Any] = self._action("health")
+        return health
+
+    def refresh(self, table: str | None = None) -> dict[str, int]:
+        """Make the server load new versions of one or all tables."""
+        versions: dict[str, int] = self._action(
+            "refresh", (table or "").encode("utf-8")
+        )
+        return versions
+
+    def cancel(self, query_id: str) -> int:
+        """Cancel running queries started with the given `query_id`.
+
+        Returns the number of queries interrupted on the server.
+        """
+        cancelled: int = self._action("cancel", query_id.encode("utf-8"))["cancelled"]
+        return cancelled
+
     def close(self) -> None:
-        """Close the client connection."""
-        self._client.close()
+        """Close the client connections."""
+        for client in [*self._clients, *self._nodes.values()]:
+            client.close()
 
     def __enter__(self):
         return self
@@ -0,0 +1,123 @@
+"""Query results cached by the client while their tables stay unchanged.
+
+A result is stored together with the versions of the Delta tables its query
+reads. Before a cached result is used, the client asks the server for the
+current versions, which only parses the query, and downloads the result
+again once any of the tables has moved on.
+"""
+
+import hashlib
+import json
+import os
+import secrets
+from dataclasses import dataclass
+
+import pyarrow as pa
+
+from flydelta.cache import LRUCache, normalize_sql
+from flydelta.files import remove_file
+
+# Custom metadata of cached result files, so they can be indexed on startup
+SQL_KEY = b"flydelta.sql"
+VERSIONS_KEY = b"flydelta.versions"
+RESULT_SUFFIX = ".arrow"
+_TEMP_PREFIX = ".write-"
+
+
+@dataclass
+class CachedResult:
+    """A query result in memory or in a file, and the versions it was read at."""
+
+    versions: dict[str, int]
+    table: pa.Table | None = None
+    path: str | None = None
+
+
+class ClientCache(LRUCache[str, CachedResult]):
+    """Query results keyed on their normalized SQL, bounded by their size.
+
+    Results are kept in memory, or as Arrow IPC files in `directory` that are
+    read back memory mapped. Files left by an earlier run are indexed on
+    startup, least recently accessed first.
+    """
+
+    def __init__(
+        self, max_bytes: int, directory: str | None = None, ttl: float | None = None
+    ):
+        super().__init__(max_bytes, ttl)
+        self.directory = directory
+        if directory is None:
+            return
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(directory):
+            if entry.name.startswith(_TEMP_PREFIX):
+                remove_file(entry.path)
+                continue
+            if not entry.name.endswith(RESULT_SUFFIX):
+                continue
+            try:
+                metadata = pa.ipc.open_file(pa.memory_map(entry.path)).metadata
+                sql = metadata[SQL_KEY].decode("utf-8")
+                versions = json.loads(metadata[VERSIONS_KEY])
+            except (OSError, pa.ArrowInvalid, TypeError, KeyError, ValueError):
+                remove_file(entry.path)
+                continue
+            stat = entry.stat()
+            files.append((stat.st_atime, entry.path, sql, versions, stat.st_size))
+        for _, path, sql, versions, size in sorted(files):
+            if not self.put(sql, CachedResult(versions, path=path), size):
+                remove_file(path)
+
+    def _remove(self, key: str) -> None:
+        path = self._entries[key].value.path
+        super()._remove(key)
+        if path is not None:
+            remove_file(path)
+
+    def load(self, sql: str, versions: dict[str, int]) -> pa.Table | None:
+        """Get the result of a query if it was read at the current `versions`."""
+        key = normalize_sql(sql)
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None or entry.value.versions != versions:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            cached = entry.value
+        if cached.table is not None:
+            return cached.table
+        try:
+            return pa.ipc.open_file(pa.memory_map(cached.path)).read_all()
+        except (OSError, pa.ArrowInvalid):
+            self.pop(key)
+            return None
+
+    def store(self, sql: str, versions: dict[str, int], table: pa.Table) -> bool:
+        """Cache the result of a query read at `versions`.
+
+        Returns False if it doesn't fit into the cache.
+        """
+        key = normalize_sql(sql)
+        if self.directory is None:
+            return self.put(key, CachedResult(versions, table=table), table.nbytes)
+        if table.nbytes > self.max_bytes:
+            return False
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        # a new name per result, so replacing an entry can't delete its file
+        name = f"{digest}-{secrets.token_hex(4)}{RESULT_SUFFIX}"
+        path = os.path.join(self.directory, name)
+        temp = os.path.join(self.directory, _TEMP_PREFIX + name)
+        metadata = {SQL_KEY: key.encode("utf-8"), VERSIONS_KEY: json.dumps(versions)}
+        try:
+            with pa.ipc.new_file(temp, table.schema, metadata=metadata) as writer:
+                writer.write_table(table)
+            os.replace(temp, path)
+        except OSError:
+            remove_file(temp)
+            return False
+        if not self.put(key, CachedResult(versions, path=path), os.path.getsize(path)):
+            remove_file(path)
+            return False
+        return True
@@ -0,0 +1,124 @@
+"""Spreading the scan work of a query over several flydelta servers.
+
+Nodes serving the same Delta tables are configured as peers of each other.
+Table files are assigned to nodes by rendezvous hashing, so a file is read
+by the same node for every query and warms that node's caches only. The
+part of a query a peer executes travels in a self-contained ticket.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from typing import Hashable, Iterable, Sequence
+
+import pyarrow.dataset as ds
+
+# Tickets executing part of a query planned on another node
+PART_PREFIX = b"part:"
+
+
+@dataclass
+class Part:
+    """A query over some files of a table version, readable by any node."""
+
+    query: str
+    # Temporary view the query reads, holding the files of the table
+    view: str
+    table: str
+    version: int
+    files: list[str]
+
+
+def encode_part(part: Part) -> bytes:
+    """Build the ticket executing a part on any node."""
+    return PART_PREFIX + json.dumps(asdict(part)).encode("utf-8")
+
+
+def decode_part(ticket: bytes) -> Part:
+    """Get the part of a query from its ticket."""
+    return Part(**json.loads(ticket[len(PART_PREFIX) :]))
+
+
+def owner(key: str, nodes: Sequence[str]) -> str:
+    """Pick the node responsible for a key by rendezvous hashing.
+
+    Adding or removing a node only moves the keys of that node.
+    """
+
+    def weight(node: str) -> bytes:
+        return hashlib.blake2b(f"{node}\0{key}".encode("utf-8")).digest()
+
+    return max(nodes, key=weight)
+
+
+def assign_files(
+    dataset: ds.FileSystemDataset,
+    nodes: Sequence[str],
+    partitions: dict[str, Hashable] | None = None,
+) -> dict[str, ds.FileSystemDataset]:
+    """Split a dataset into the files owned by each node.
+
+    Files of the same partition (a mapping of file path to partition values)
+    go to the same node. Nodes owning no files are left out.
+    """
+    partitions = partitions or {}
+    owned: dict[str, list[ds.Fragment]] = defaultdict(list)
+    for fragment in dataset.get_fragments():
+        key = partitions.get(fragment.path, fragment.path)
+        owned[owner(repr(key), nodes)].append(fragment)
+    return {
+        node: ds.FileSystemDataset(
+            fragments,
+            schema=dataset.schema,
+            format=dataset.format,
+            filesystem=dataset.filesystem,
+        )
+        for node, fragments in sorted(owned.items())
+    }
+
+
+def read_peers(path: str) -> list[str]:
+    """Read peer locations from a file, one per line, `#` starts a comment."""
+    peers = []
+    with open(path) as lines:
+        for line in lines:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                peers.append(line)
+    return peers
+
+
+class PeerFile:
+    """Peer locations listed in a file, read again whenever it changes.
+
+    The last list read is kept while the file is missing or unreadable.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mtime: float | None = None
+        self._peers: list[str] = []
+        self._lock = threading.Lock()
+
+    def peers(self) -> list[str]:
+        with self._lock:
+            try:
+                mtime = os.stat(self.path).st_mtime
+                if mtime != self._mtime:
+                    self._peers = read_peers(self.path)
+                    self._mtime = mtime
+            except OSError:
+                pass
+            return list(self._peers)
+
+
+def cluster_nodes(location: str, peers: Iterable[str]) -> list[str]:
+    """Get all nodes of a cluster including this one, empty without peers."""
+    nodes = set(peers)
+    if not nodes.difference([location]):
+        return []
+    nodes.add(location)
+    return sorted(nodes)
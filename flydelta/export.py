@@ -0,0 +1,112 @@
+"""Write streamed query results to files batch by batch."""
+
+import csv as std_csv
+import io
+import json
+import os
+from typing import IO, Any, Iterable
+
+import pyarrow as pa
+import pyarrow.csv as csv
+import pyarrow.parquet as pq
+
+FORMATS = ("parquet", "arrow", "feather", "csv", "json", "ndjson")
+
+EXTENSIONS = {
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "feather",
+    ".ipc": "arrow",
+    ".csv": "csv",
+    ".json": "json",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+}
+
+
+def guess_format(path: str) -> str:
+    """Get the output format from a file extension."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in EXTENSIONS:
+        raise ValueError(f"Can't guess output format of `{path}`")
+    return EXTENSIONS[ext]
+
+
+def check_format(format: str) -> None:
+    if format not in FORMATS:
+        raise ValueError(f"Unknown output format: {format}")
+
+
+def _dumps(row: dict[str, Any]) -> str:
+    return json.dumps(row, separators=(",", ":"), default=str)
+
+
+def _write_csv(
+    schema: pa.Schema, batches: Iterable[pa.RecordBatch], stream: IO[bytes]
+) -> int:
+    # Arrow quotes all column names, write a minimally quoted header instead
+    header = io.StringIO()
+    std_csv.writer(header, lineterminator="\n").writerow(schema.names)
+    stream.write(header.getvalue().encode("utf-8"))
+    rows = 0
+    options = csv.WriteOptions(include_header=False)
+    with csv.CSVWriter(stream, schema, write_options=options) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    return rows
+
+
+def _write_json(
+    batches: Iterable[pa.RecordBatch], stream: IO[bytes], lines: bool
+) -> int:
+    # A JSON array of records, or one record per line
+    rows = 0
+    if not lines:
+        stream.write(b"[")
+    for batch in batches:
+        records = [_dumps(row) for row in batch.to_pylist()]
+        if lines:
+            chunk = "".join(record + "\n" for record in records)
+        else:
+            chunk = ("," if rows and records else "") + ",".join(records)
+        stream.write(chunk.encode("utf-8"))
+        rows += batch.num_rows
+    if not lines:
+        stream.write(b"]\n")
+    return rows
+
+
+def write_batches(
+    schema: pa.Schema,
+    batches: Iterable[pa.RecordBatch],
+    sink: str | IO[bytes],
+    format: str,
+) -> int:
+    """Write record batches to a file path or binary file object.
+
+    Only one batch is held in memory at a time. Returns the number of rows.
+    """
+    check_format(format)
+    rows = 0
+    if format == "parquet":
+        with pq.ParquetWriter(sink, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+                rows += batch.num_rows
+    elif format in ("arrow", "feather"):
+        with pa.ipc.new_file(sink, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+                rows += batch.num_rows
+    else:
+        stream = open(sink, "wb") if isinstance(sink, str) else sink
+        try:
+            if format == "csv":
+                rows = _write_csv(schema, batches, stream)
+            else:
+                rows = _write_json(batches, stream, lines=format == "ndjson")
+        finally:
+            if isinstance(sink, str):
+                stream.close()
+    return rows
@@ -0,0 +1,174 @@
+"""Read-through cache of remote table files on local disk.
+
+Delta data files are never modified once written, so a cached copy stays
+valid for as long as the file is referenced. Files removed by a vacuum are
+simply never read again and age out of the cache.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+
+import pyarrow as pa
+import pyarrow.fs as pafs
+
+from flydelta.cache import LRUCache
+from flydelta.files import remove_file
+
+# Bytes copied at a time when downloading a file into the cache
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+_TEMP_PREFIX = ".download-"
+
+
+class FileCache(LRUCache[str, str]):
+    """Whole files in a local directory, bounded by their total size.
+
+    Values are the local paths of cached files, which are deleted when they
+    are evicted. Files left in the directory by an earlier run are indexed
+    on startup, least recently accessed first.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        super().__init__(max_bytes)
+        self.directory = directory
+        self._loading: dict[str, threading.Lock] = {}
+        self._loading_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(directory):
+            if not entry.is_file():
+                continue
+            if entry.name.startswith(_TEMP_PREFIX):
+                remove_file(entry.path)
+                continue
+            stat = entry.stat()
+            files.append((stat.st_atime, entry.name, entry.path, stat.st_size))
+        for _, name, path, size in sorted(files):
+            if not self.put(name, path, size):
+                remove_file(path)
+
+    def _remove(self, key: str) -> None:
+        path = self._entries[key].value
+        super()._remove(key)
+        remove_file(path)
+
+    def fetch(self, key: str, source: pafs.FileSystem, path: str) -> str | None:
+        """Get the local copy of a file, downloading it on a miss.
+
+        Concurrent misses of the same file download it once. Returns None if
+        the file is larger than the whole cache.
+        """
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        local = self.get(name)
+        if local is not None:
+            return local
+        with self._loading_lock:
+            lock = self._loading.setdefault(name, threading.Lock())
+        with lock:
+            try:
+                local = self.peek(name)
+                if local is not None:
+                    return local
+                return self._download(name, source, path)
+            finally:
+                with self._loading_lock:
+                    self._loading.pop(name, None)
+
+    def _download(self, name: str, source: pafs.FileSystem, path: str) -> str | None:
+        fd, temp = tempfile.mkstemp(prefix=_TEMP_PREFIX, dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as sink, source.open_input_stream(path) as f:
+                while True:
+                    chunk = f.read(COPY_BUFFER_SIZE)
+                    if not chunk:
+                        break
+                    sink.write(chunk)
+            local = os.path.join(self.directory, name)
+            os.replace(temp, local)
+        except BaseException:
+            remove_file(temp)
+            raise
+        if not self.put(name, local, os.path.getsize(local)):
+            remove_file(local)
+            return None
+        return local
+
+
+class CachedFileSystemHandler(pafs.FileSystemHandler):
+    """Filesystem reading files through a `FileCache`, for `PyFileSystem`.
+
+    Reads are served from local copies keyed on `prefix` and the path, all
+    other operations go to the wrapped filesystem.
+    """
+
+    def __init__(self, fs: pafs.FileSystem, cache: FileCache, prefix: str):
+        self.fs = fs
+        self.cache = cache
+        self.prefix = prefix.rstrip("/")
+
+    def _open(self, path: str) -> pa.NativeFile | None:
+        """Map the cached copy of a file, None if it couldn't be cached or is gone."""
+        local = self.cache.fetch(f"{self.prefix}/{path}", self.fs, path)
+        if local is None:
+            return None
+        try:
+            return pa.memory_map(local)
+        except FileNotFoundError:
+            return None
+
+    def open_input_file(self, path: str) -> pa.NativeFile:
+        cached = self._open(path)
+        return cached if cached is not None else self.fs.open_input_file(path)
+
+    def open_input_stream(self, path: str) -> pa.NativeFile:
+        cached = self._open(path)
+        return cached if cached is not None else self.fs.open_input_stream(path)
+
+    def get_type_name(self) -> str:
+        return f"cached+{self.fs.type_name}"
+
+    def normalize_path(self, path: str) -> str:
+        normalized: str = self.fs.normalize_path(path)
+        return normalized
+
+    def get_file_info(self, paths: list[str]) -> list[pafs.FileInfo]:
+        infos: list[pafs.FileInfo] = self.fs.get_file_info(paths)
+        return infos
+
+    def get_file_info_selector(
+        self, selector: pafs.FileSelector
+    ) -> list[pafs.FileInfo]:
+        infos: list[pafs.FileInfo] = self.fs.get_file_info(selector)
+        return infos
+
+    def create_dir(self, path: str, recursive: bool) -> None:
+        self.fs.create_dir(path, recursive=recursive)
+
+    def delete_dir(self, path: str) -> None:
+        self.fs.delete_dir(path)
+
+    def delete_dir_contents(self, path: str, missing_dir_ok: bool = False) -> None:
+        self.fs.delete_dir_contents(path, missing_dir_ok=missing_dir_ok)
+
+    def delete_root_dir_contents(self) -> None:
+        self.fs.delete_dir_contents("/", accept_root_dir=True)
+
+    def delete_file(self, path: str) -> None:
+        self.fs.delete_file(path)
+
+    def move(self, src: str, dest: str) -> None:
+        self.fs.move(src, dest)
+
+    def copy_file(self, src: str, dest: str) -> None:
+        self.fs.copy_file(src, dest)
+
+    def open_output_stream(
+        self, path: str, metadata: dict[str, str] | None
+    ) -> pa.NativeFile:
+        return self.fs.open_output_stream(path, metadata=metadata)
+
+    def open_append_stream(
+        self, path: str, metadata: dict[str, str] | None
+    ) -> pa.NativeFile:
+        return self.fs.open_append_stream(path, metadata=metadata)
@@ -0,0 +1,11 @@
+"""Helpers for the local files written by caches and spools."""
+
+import os
+
+
+def remove_file(path: str) -> None:
+    """Delete a file, ignoring errors if it is already gone or in use."""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
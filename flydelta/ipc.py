@@ -0,0 +1,125 @@
+"""Arrow IPC write options for streaming query results."""
+
+import threading
+from typing import Callable, Generator, Iterable
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+CODECS = ("lz4", "zstd")
+
+# Request header to choose the compression of a result stream
+COMPRESSION_HEADER = "x-flydelta-compression"
+
+# Request header to choose the target size of result batches in bytes
+BATCH_BYTES_HEADER = "x-flydelta-batch-bytes"
+
+# Request header naming a query so it can be cancelled with the cancel action
+QUERY_ID_HEADER = "x-flydelta-query-id"
+
+
+def write_options(
+    compression: str | None = None, level: int | None = None
+) -> pa.ipc.IpcWriteOptions:
+    """Get IPC write options with optional buffer compression.
+
+    `compression` is one of `lz4`, `zstd` or `none`.
+    """
+    if compression is None or compression == "none":
+        return pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+    if compression not in CODECS:
+        raise ValueError(f"Unknown compression: {compression}")
+    return pa.ipc.IpcWriteOptions(
+        compression=pa.Codec(compression, level), emit_dictionary_deltas=True
+    )
+
+
+def dictionary_encoder(
+    batch: pa.RecordBatch, max_ratio: float
+) -> tuple[pa.Schema, Callable[[pa.RecordBatch], pa.RecordBatch]]:
+    """Pick low-cardinality string columns of a sample batch for encoding.
+
+    Columns with at most `max_ratio` distinct values per row are dictionary
+    encoded. Returns the resulting schema and a function encoding a batch.
+    """
+    columns = []
+    for i, field in enumerate(batch.schema):
+        if not (pa.types.is_string(field.type) or pa.types.is_large_string(field.type)):
+            continue
+        if batch.num_rows and pc.count_distinct(batch.column(i)).as_py() <= (
+            max_ratio * batch.num_rows
+        ):
+            columns.append(i)
+
+    schema = batch.schema
+    for i in columns:
+        field = schema.field(i)
+        schema = schema.set(i, field.with_type(pa.dictionary(pa.int32(), field.type)))
+
+    def encode(batch: pa.RecordBatch) -> pa.RecordBatch:
+        if not columns:
+            return batch
+        arrays = list(batch.columns)
+        for i in columns:
+            arrays[i] = pc.dictionary_encode(arrays[i])
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    return schema, encode
+
+
+class SharedEncoding:
+    """Dictionary encoding picked once for all streams of one result.
+
+    The first stream to start picks the columns from its first batch, or
+    none if it has no rows, so all endpoints of a query share one schema.
+    """
+
+    def __init__(self, max_ratio: float):
+        self.max_ratio = max_ratio
+        self._picked: (
+            tuple[pa.Schema, Callable[[pa.RecordBatch], pa.RecordBatch]] | None
+        ) = None
+        self._lock = threading.Lock()
+
+    def pick(
+        self, batch: pa.RecordBatch
+    ) -> tuple[pa.Schema, Callable[[pa.RecordBatch], pa.RecordBatch]]:
+        """Get the schema and encoding of all streams, picked on first use."""
+        with self._lock:
+            if self._picked is None:
+                self._picked = dictionary_encoder(batch, self.max_ratio)
+            return self._picked
+
+
+def _concat(batches: list[pa.RecordBatch]) -> pa.RecordBatch:
+    return batches[0] if len(batches) == 1 else pa.concat_batches(batches)
+
+
+def rebatch(
+    batches: Iterable[pa.RecordBatch], target_bytes: int
+) -> Generator[pa.RecordBatch, None, None]:
+    """Coalesce small batches and split large ones to about `target_bytes`.
+
+    Large batches are sliced without copying, small ones are concatenated
+    until the target is reached. Row order is kept.
+    """
+    pending: list[pa.RecordBatch] = []
+    size = 0
+    for batch in batches:
+        if batch.nbytes > target_bytes and batch.num_rows > 1:
+            rows = max(1, batch.num_rows * target_bytes // batch.nbytes)
+            offsets = range(0, batch.num_rows, rows)
+            if pending:
+                yield _concat(pending)
+                pending, size = [], 0
+            for offset in offsets[:-1]:
+                yield batch.slice(offset, rows)
+            # the remainder may be coalesced with the next batches
+            batch = batch.slice(offsets[-1])
+        pending.append(batch)
+        size += batch.nbytes
+        if size >= target_bytes:
+            yield _concat(pending)
+            pending, size = [], 0
+    if pending:
+        yield _concat(pending)
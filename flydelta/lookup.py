@@ -0,0 +1,26 @@
+"""Looking up the rows of a table by keys the client streams to the server."""
+
+import json
+from dataclasses import asdict, dataclass
+
+# Exchanges looking up rows by keys, followed by the JSON lookup
+LOOKUP_PREFIX = b"lookup:"
+
+
+@dataclass
+class Lookup:
+    """Rows of a table joined on key columns, optionally some columns only."""
+
+    table: str
+    on: list[str]
+    columns: list[str] | None = None
+
+
+def encode_lookup(lookup: Lookup) -> bytes:
+    """Build the do_exchange command of a lookup."""
+    return LOOKUP_PREFIX + json.dumps(asdict(lookup)).encode("utf-8")
+
+
+def decode_lookup(command: bytes) -> Lookup:
+    """Get the lookup from a do_exchange command."""
+    return Lookup(**json.loads(command[len(LOOKUP_PREFIX) :]))
@@ -0,0 +1,290 @@
+"""Server metrics in the Prometheus text format, without extra dependencies.
+
+Collectors registered on a `Registry` update gauges from the server state
+right before each scrape, e.g. the pool usage and table versions.
+"""
+
+import bisect
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable
+
+# Seconds, from sub-millisecond cache hits to long exports
+DEFAULT_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """A named metric with values per combination of label values."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"Metric `{self.name}` has labels {self.labels}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _series(
+        self, suffix: str, key: LabelValues, value: float, extra: str = ""
+    ) -> str:
+        pairs = [f'{n}="{_escape(v)}"' for n, v in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        labels = "{" + ",".join(pairs) + "}" if pairs else ""
+        return f"{self.name}{suffix}{labels} {_format(value)}"
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [self._series("", key, value) for key, value in values]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: counts per bucket (and +Inf), sum
+        self._values: dict[LabelValues, tuple[list[int], float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], 0))
+            return sum(counts)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = sorted((k, (list(c), s)) for k, (c, s) in self._values.items())
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_format(bound)}"'
+                lines.append(self._series("_bucket", key, cumulative, le))
+            lines.append(self._series("_sum", key, total))
+            lines.append(self._series("_count", key, cumulative))
+        return lines
+
+
+class Registry:
+    """A set of metrics rendered together."""
+
+    def __init__(self) -> None:
+        self.metrics: list[Metric] = []
+        self._collectors: list[Callable[[], None]] = []
+
+    def add(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, collect: Callable[[], None]) -> None:
+        """Register a function updating gauges before the metrics are rendered."""
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        for collect in self._collectors:
+            collect()
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+class ServerMetrics(Registry):
+    """Metrics of the query path of a flydelta server."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.pool_wait = Histogram(
+            "flydelta_pool_wait_seconds",
+            "Time waiting for a pooled connection",
+            ["lane"],
+        )
+        self.schema_probe = Histogram(
+            "flydelta_schema_probe_seconds", "Time resolving the schema of a query"
+        )
+        self.first_batch = Histogram(
+            "flydelta_first_batch_seconds",
+            "Time from the request to the first result batch",
+        )
+        self.stream = Histogram(
+            "flydelta_stream_seconds", "Time from the request to the end of a stream"
+        )
+        self.rows = Counter(
+            "flydelta_rows_total", "Rows streamed by queries of a table", ["table"]
+        )
+        self.batches = Counter(
+            "flydelta_batches_total",
+            "Batches streamed by queries of a table",
+            ["table"],
+        )
+        self.bytes = Counter(
+            "flydelta_bytes_total",
+            "Uncompressed bytes streamed by queries of a table",
+            ["table"],
+        )
+        self.requests = Counter(
+            "flydelta_requests_total", "Flight requests by method", ["method"]
+        )
+        self.errors = Counter(
+            "flydelta_errors_total", "Failed Flight requests by method", ["method"]
+        )
+        self.spills = Counter(
+            "flydelta_spills_total", "Results spilled to disk for slow clients"
+        )
+        self.streams = Gauge("flydelta_streams_in_flight", "Result streams being sent")
+        self.pool_connections = Gauge(
+            "flydelta_pool_connections",
+            "Pooled connections by lane and state",
+            ["lane", "state"],
+        )
+        self.pool_waiting = Gauge(
+            "flydelta_pool_waiting", "Queries waiting for a connection", ["lane"]
+        )
+        self.table_version = Gauge(
+            "flydelta_table_version", "Delta version served per table", ["table"]
+        )
+        self.disk_cache = Gauge(
+            "flydelta_disk_cache", "Local file cache counters and size", ["stat"]
+        )
+        self.pinned_bytes = Gauge(
+            "flydelta_pinned_bytes", "Memory of tables pinned in memory", ["table"]
+        )
+        for metric in (
+            self.pool_wait,
+            self.schema_probe,
+            self.first_batch,
+            self.stream,
+            self.rows,
+            self.batches,
+            self.bytes,
+            self.requests,
+            self.errors,
+            self.spills,
+            self.streams,
+            self.pool_connections,
+            self.pool_waiting,
+            self.table_version,
+            self.disk_cache,
+            self.pinned_bytes,
+        ):
+            self.add(metric)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry: Registry
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+def start_http_server(
+    registry: Registry, port: int, host: str = "0.0.0.0"
+) -> ThreadingHTTPServer:
+    """Serve the metrics of a registry on `/metrics` in a background thread."""
+    handler = type("MetricsHandler", (_Handler,), {"registry": registry})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
@@ -0,0 +1,473 @@
+"""Query analysis on DuckDB's serialized SQL syntax tree.
+
+The functions here work on the JSON produced by `json_serialize_sql` and
+don't depend on DuckDB itself.
+"""
+
+import copy
+import datetime
+import decimal
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable
+
+import pyarrow.dataset as ds
+
+# Functions returning different results on every call
+VOLATILE_FUNCTIONS = frozenset(
+    {
+        "random",
+        "setseed",
+        "uuid",
+        "gen_random_uuid",
+        "uuidv4",
+        "uuidv7",
+        "nextval",
+        "now",
+        "today",
+        "get_current_time",
+        "get_current_timestamp",
+        "transaction_timestamp",
+        "current_localtime",
+        "current_localtimestamp",
+    }
+)
+# Keywords for the current time, parsed as column references
+VOLATILE_KEYWORDS = frozenset(
+    {"current_date", "current_time", "current_timestamp", "localtime", "localtimestamp"}
+)
+
+
+def select_node(ast: dict[str, Any]) -> dict[str, Any] | None:
+    """Get the SELECT node of a single-statement query."""
+    if ast.get("error") or len(ast.get("statements", [])) != 1:
+        return None
+    node: dict[str, Any] = ast["statements"][0]["node"]
+    if node.get("type") != "SELECT_NODE":
+        return None
+    return node
+
+
+def scan_table(ast: dict[str, Any]) -> str | None:
+    """Get the table name if the query is a simple scan over one base table.
+
+    A simple scan selects plain columns with an optional WHERE clause, so its
+    result doesn't change when the table is read in independent pieces.
+    """
+    node = select_node(ast)
+    if node is None:
+        return None
+    if node["modifiers"] or node["cte_map"]["map"]:
+        return None
+    if node["group_expressions"] or node["having"] or node.get("qualify"):
+        return None
+    if node.get("sample") or node.get("aggregate_handling") != "STANDARD_HANDLING":
+        return None
+    for expr in node["select_list"]:
+        if expr["class"] not in ("COLUMN_REF", "STAR") or expr.get("columns"):
+            return None
+    table = node["from_table"]
+    if table["type"] != "BASE_TABLE" or table["schema_name"] or table["at_clause"]:
+        return None
+    if node["where_clause"] is not None and _has_subquery(node["where_clause"]):
+        return None
+    name: str = table["table_name"]
+    return name
+
+
+def from_table(ast: dict[str, Any]) -> str | None:
+    """Get the table name if a query reads from one base table without joins."""
+    node = select_node(ast)
+    if node is None or node["cte_map"]["map"]:
+        return None
+    table = node["from_table"]
+    if table["type"] != "BASE_TABLE" or table["schema_name"] or table["at_clause"]:
+        return None
+    name: str = table["table_name"]
+    return name
+
+
+# Aggregates whose results over parts of a table combine into the result
+# over the whole table, and the aggregate combining them
+MERGEABLE_AGGREGATES = {
+    "sum": "sum",
+    "count": "sum",
+    "count_star": "sum",
+    "min": "min",
+    "max": "max",
+}
+
+
+def rollup_merges(ast: dict[str, Any]) -> list[str] | None:
+    """Get how results of an aggregation over parts of a table combine.
+
+    Returns `key` for each grouping column of the select list and the
+    combining aggregate for each aggregate. None unless the query groups one
+    base table by plain columns it selects, and otherwise only selects SUM,
+    COUNT, MIN and MAX aggregates.
+    """
+    node = select_node(ast)
+    if node is None or from_table(ast) is None:
+        return None
+    if node["modifiers"] or node["having"] or node.get("qualify"):
+        return None
+    if node.get("sample") or len(node["group_sets"]) > 1:
+        return None
+    if node["where_clause"] is not None and _has_subquery(node["where_clause"]):
+        return None
+    select = node["select_list"]
+    forced = node["aggregate_handling"] == "FORCE_AGGREGATES"
+    if not forced and node["aggregate_handling"] != "STANDARD_HANDLING":
+        return None
+
+    groups = set()
+    for expr in node["group_expressions"]:
+        if expr["class"] == "CONSTANT":
+            # GROUP BY 1 refers to the first column of the select list
+            index = expr["value"].get("value")
+            if not isinstance(index, int) or not 0 < index <= len(select):
+                return None
+            expr = select[index - 1]
+        if expr["class"] != "COLUMN_REF":
+            return None
+        groups.add(expr["column_names"][-1])
+
+    merges = []
+    keys = set()
+    for expr in select:
+        if expr["class"] == "COLUMN_REF":
+            keys.add(expr["column_names"][-1])
+            merges.append("key")
+            continue
+        if expr["class"] != "FUNCTION" or expr["distinct"] or expr["schema"]:
+            return None
+        if expr["order_bys"]["orders"] or _has_subquery(expr):
+            return None
+        merge = MERGEABLE_AGGREGATES.get(expr["function_name"].lower())
+        if merge is None:
+            return None
+        merges.append(merge)
+    if not forced and keys != groups:
+        return None
+    return merges
+
+
+@dataclass(frozen=True)
+class Predicate:
+    """A comparison of a column with constants, as found in a WHERE clause.
+
+    `op` is one of `=`, `<`, `<=`, `>`, `>=`, `in`, `is_null` or
+    `is_not_null`. `value` is a list of values for `in`.
+    """
+
+    column: str
+    op: str
+    value: Any = None
+
+
+COMPARISONS = {
+    "COMPARE_EQUAL": "=",
+    "COMPARE_LESSTHAN": "<",
+    "COMPARE_LESSTHANOREQUALTO": "<=",
+    "COMPARE_GREATERTHAN": ">",
+    "COMPARE_GREATERTHANOREQUALTO": ">=",
+}
+
+FLIPPED = {"=": "=", "<": ">", "<=": ">=", ">": "<", ">=": "<="}
+
+INTEGER_TYPES = (
+    "TINYINT",
+    "SMALLINT",
+    "INTEGER",
+    "BIGINT",
+    "UTINYINT",
+    "USMALLINT",
+    "UINTEGER",
+    "UBIGINT",
+)
+
+_UNKNOWN = object()
+
+
+def _constant(expr: dict[str, Any]) -> Any:
+    """Get the Python value of a constant expression, `_UNKNOWN` otherwise."""
+    if expr["class"] == "CAST":
+        value = _constant(expr["child"])
+        if value is _UNKNOWN or value is None:
+            return _UNKNOWN
+        kind = expr["cast_type"]["id"]
+        try:
+            if kind in INTEGER_TYPES and isinstance(value, int):
+                return value
+            if kind == "DATE" and isinstance(value, str):
+                return datetime.date.fromisoformat(value)
+            if kind == "TIMESTAMP" and isinstance(value, str):
+                return datetime.datetime.fromisoformat(value)
+            if kind == "BOOLEAN" and isinstance(value, str):
+                return {"t": True, "true": True, "f": False, "false": False}[
+                    value.lower()
+                ]
+        except (KeyError, ValueError):
+            return _UNKNOWN
+        return _UNKNOWN
+    if expr["class"] != "CONSTANT":
+        return _UNKNOWN
+    constant = expr["value"]
+    if constant["is_null"]:
+        return None
+    kind, value = constant["type"]["id"], constant["value"]
+    if kind in INTEGER_TYPES and isinstance(value, int):
+        return value
+    if kind in ("DOUBLE", "FLOAT") and isinstance(value, (int, float)):
+        return float(value)
+    if kind == "DECIMAL" and isinstance(value, int):
+        scale = constant["type"]["type_info"]["scale"]
+        return decimal.Decimal(value).scaleb(-scale)
+    if kind == "VARCHAR" and isinstance(value, str):
+        return value
+    if kind == "BOOLEAN" and isinstance(value, bool):
+        return value
+    return _UNKNOWN
+
+
+def _column(expr: dict[str, Any], names: set[str]) -> str | None:
+    """Get the column name of a reference to a column of the table `names`."""
+    if expr["class"] != "COLUMN_REF":
+        return None
+    parts = expr["column_names"]
+    if len(parts) == 1:
+        column: str = parts[0]
+        return column
+    if len(parts) == 2 and parts[0] in names:
+        column = parts[1]
+        return column
+    return None
+
+
+def _predicates(expr: dict[str, Any], names: set[str]) -> list[Predicate]:
+    if expr["class"] == "CONJUNCTION" and expr["type"] == "CONJUNCTION_AND":
+        return [p for child in expr["children"] for p in _predicates(child, names)]
+
+    if expr["class"] == "COMPARISON" and expr["type"] in COMPARISONS:
+        op = COMPARISONS[expr["type"]]
+        left, right = expr["left"], expr["right"]
+        if _column(left, names) is None:
+            left, right, op = right, left, FLIPPED[op]
+        column, value = _column(left, names), _constant(right)
+        if column is None or value is _UNKNOWN or value is None:
+            return []
+        return [Predicate(column, op, value)]
+
+    if expr["class"] == "BETWEEN":
+        return _predicates(
+            {
+                "class": "CONJUNCTION",
+                "type": "CONJUNCTION_AND",
+                "children": [
+                    {
+                        "class": "COMPARISON",
+                        "type": "COMPARE_GREATERTHANOREQUALTO",
+                        "left": expr["input"],
+                        "right": expr["lower"],
+                    },
+                    {
+                        "class": "COMPARISON",
+                        "type": "COMPARE_LESSTHANOREQUALTO",
+                        "left": expr["input"],
+                        "right": expr["upper"],
+                    },
+                ],
+            },
+            names,
+        )
+
+    if expr["class"] == "OPERATOR" and expr["children"]:
+        column = _column(expr["children"][0], names)
+        if column is None:
+            return []
+        if expr["type"] == "OPERATOR_IS_NULL":
+            return [Predicate(column, "is_null")]
+        if expr["type"] == "OPERATOR_IS_NOT_NULL":
+            return [Predicate(column, "is_not_null")]
+        if expr["type"] == "COMPARE_IN":
+            values = [_constant(child) for child in expr["children"][1:]]
+            if any(value is _UNKNOWN for value in values):
+                return []
+            return [Predicate(column, "in", [v for v in values if v is not None])]
+
+    return []
+
+
+def where_predicates(ast: dict[str, Any]) -> list[Predicate]:
+    """Get the column predicates all rows of a single-table query must match.
+
+    Only comparisons with constants in the top-level AND conjunction of the
+    WHERE clause are returned, anything else is ignored.
+    """
+    name = from_table(ast)
+    node = select_node(ast)
+    if name is None or node is None or node["where_clause"] is None:
+        return []
+    names = {name, node["from_table"]["alias"]}
+    return _predicates(node["where_clause"], names)
+
+
+def _has_subquery(expr: Any) -> bool:
+    if isinstance(expr, dict):
+        if expr.get("class") == "SUBQUERY":
+            return True
+        return any(_has_subquery(value) for value in expr.values())
+    if isinstance(expr, list):
+        return any(_has_subquery(value) for value in expr)
+    return False
+
+
+def is_volatile(expr: Any) -> bool:
+    """Check if a query calls functions whose result changes between calls."""
+    if isinstance(expr, dict):
+        if expr.get("class") == "FUNCTION":
+            if expr["function_name"].lower() in VOLATILE_FUNCTIONS:
+                return True
+        elif expr.get("class") == "COLUMN_REF":
+            names = expr["column_names"]
+            if len(names) == 1 and names[0].lower() in VOLATILE_KEYWORDS:
+                return True
+        return any(is_volatile(value) for value in expr.values())
+    if isinstance(expr, list):
+        return any(is_volatile(value) for value in expr)
+    return False
+
+
+def parameter_count(ast: dict[str, Any]) -> int:
+    """Count the distinct prepared statement parameters of a query."""
+    identifiers: set[str] = set()
+
+    def visit(expr: Any) -> None:
+        if isinstance(expr, dict):
+            if expr.get("class") == "PARAMETER":
+                identifiers.add(expr["identifier"])
+            for value in expr.values():
+                visit(value)
+        elif isinstance(expr, list):
+            for value in expr:
+                visit(value)
+
+    visit(ast)
+    return len(identifiers)
+
+
+def replace_table(ast: dict[str, Any], name: str, replacement: str) -> dict[str, Any]:
+    """Get a copy of a simple scan reading from another relation.
+
+    The original name is kept as alias so qualified column references work.
+    """
+    ast = copy.deepcopy(ast)
+    node = select_node(ast)
+    if node is None or node["from_table"]["table_name"] != name:
+        raise ValueError(f"Query does not scan table `{name}`")
+    table = node["from_table"]
+    table["table_name"] = replacement
+    table["alias"] = table["alias"] or name
+    return ast
+
+
+def _snapshot(at_clause: dict[str, Any]) -> int | datetime.datetime:
+    """Get the version or timestamp of an `AT (VERSION => ...)` clause."""
+    expr = at_clause["expr"]
+    value = _constant(expr)
+    if value is _UNKNOWN and expr["class"] == "CAST":
+        # e.g. TIMESTAMPTZ, taken as given in ISO format
+        value = _constant(expr["child"])
+    unit = at_clause["unit"]
+    if unit == "VERSION" and isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if unit == "TIMESTAMP":
+        if isinstance(value, str):
+            try:
+                value = datetime.datetime.fromisoformat(value)
+            except ValueError:
+                pass
+        elif isinstance(value, datetime.date):
+            value = datetime.datetime.combine(value, datetime.time())
+        if isinstance(value, datetime.datetime):
+            return value
+    raise ValueError(f"Unsupported AT clause: {unit} => {value!r}")
+
+
+def _reads_snapshot(expr: dict[str, Any], tables: set[str]) -> bool:
+    if expr.get("type") != "BASE_TABLE" or not expr.get("at_clause"):
+        return False
+    return not expr["schema_name"] and expr["table_name"] in tables
+
+
+def replace_snapshots(
+    ast: dict[str, Any],
+    tables: set[str],
+    replacement: Callable[[str, int | datetime.datetime], str],
+) -> dict[str, Any] | None:
+    """Get a copy of a query reading other relations instead of `AT` clauses.
+
+    Every reference to one of `tables` with an `AT (VERSION => n)` or
+    `AT (TIMESTAMP => ts)` clause is replaced by the relation returned by
+    `replacement` for the table name and the version or timestamp. The
+    original name is kept as alias. Returns None if there are no such clauses.
+    """
+    ast = copy.deepcopy(ast)
+    replaced = False
+
+    def visit(expr: Any) -> None:
+        nonlocal replaced
+        if isinstance(expr, dict):
+            if _reads_snapshot(expr, tables):
+                name = expr["table_name"]
+                expr["table_name"] = replacement(name, _snapshot(expr["at_clause"]))
+                expr["alias"] = expr["alias"] or name
+                expr["at_clause"] = None
+                replaced = True
+            for value in expr.values():
+                visit(value)
+        elif isinstance(expr, list):
+            for value in expr:
+                visit(value)
+
+    visit(ast)
+    return ast if replaced else None
+
+
+def split_dataset(
+    dataset: ds.FileSystemDataset,
+    parts: int,
+    sizes: dict[str, int] | None = None,
+    partitions: dict[str, Hashable] | None = None,
+) -> list[ds.FileSystemDataset]:
+    """Split a dataset into at most `parts` datasets of similar size.
+
+    Files of the same partition (as given by `partitions`, a mapping of file
+    path to partition values) are kept together, otherwise files are
+    distributed individually. File sizes are used to balance the parts.
+    """
+    sizes = sizes or {}
+    partitions = partitions or {}
+    groups: dict[Hashable, list[ds.Fragment]] = defaultdict(list)
+    for fragment in dataset.get_fragments():
+        groups[partitions.get(fragment.path, fragment.path)].append(fragment)
+
+    def group_size(fragments: list[ds.Fragment]) -> int:
+        return sum(sizes.get(f.path, 1) for f in fragments)
+
+    bins: list[list[ds.Fragment]] = [[] for _ in range(min(parts, len(groups)))]
+    totals = [0] * len(bins)
+    for fragments in sorted(groups.values(), key=group_size, reverse=True):
+        i = totals.index(min(totals))
+        bins[i].extend(fragments)
+        totals[i] += group_size(fragments)
+
+    return [
+        ds.FileSystemDataset(
+            fragments,
+            schema=dataset.schema,
+            format=dataset.format,
+            filesystem=dataset.filesystem,
+        )
+        for fragments in bins
+    ]
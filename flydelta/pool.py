@@ -0,0 +1,234 @@
+"""Connection pool with separate lanes, admission control and metrics."""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Generator, Generic, TypeVar
+
+T = TypeVar("T")
+
+DEFAULT_LANE = "interactive"
+
+# Request header to choose the pool lane of a query
+LANE_HEADER = "x-flydelta-lane"
+
+
+class PoolError(Exception):
+    """No connection could be checked out, the request may be retried."""
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+class PoolFull(PoolError):
+    pass
+
+
+@dataclass
+class _Lane(Generic[T]):
+    name: str
+    min_size: int
+    max_size: int
+    idle: deque[tuple[T, float]] = field(default_factory=deque)
+    cond: threading.Condition = field(default_factory=threading.Condition)
+    size: int = 0
+    waiting: int = 0
+    checkouts: int = 0
+    timeouts: int = 0
+    rejections: int = 0
+    wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "size": self.size,
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "idle": len(self.idle),
+            "in_use": self.size - len(self.idle),
+            "waiting": self.waiting,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "rejections": self.rejections,
+            "wait_seconds": self.wait_seconds,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
+
+
+class ConnectionPool(Generic[T]):
+    """Thread-safe pool of connections split into independent lanes.
+
+    Each lane grows lazily from `min_size` to its `max_size` connections and
+    closes connections above `min_size` that were idle for `idle_timeout`
+    seconds. A checkout waits at most `timeout` seconds, and at most
+    `max_waiting` callers may wait per lane, others are rejected right away.
+
+    Args:
+        factory: Creates a new connection
+        lanes: Maximum number of connections per lane name
+        min_size: Connections per lane created upfront and kept when idle
+        timeout: Default checkout timeout in seconds (None waits forever)
+        max_waiting: Maximum number of callers waiting per lane
+        idle_timeout: Seconds after which surplus idle connections are closed
+        close: Closes a connection that is removed from the pool
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], T],
+        lanes: dict[str, int],
+        min_size: int = 1,
+        timeout: float | None = None,
+        max_waiting: int | None = None,
+        idle_timeout: float | None = 300,
+        close: Callable[[T], None] | None = None,
+    ):
+        self.timeout = timeout
+        self.max_waiting = max_waiting
+        self.idle_timeout = idle_timeout
+        self._factory = factory
+        self._close = close
+        self._lanes: dict[str, _Lane[T]] = {
+            name: _Lane(name, min(min_size, size), size) for name, size in lanes.items()
+        }
+        self._lane_of: dict[int, str] = {}
+        self._closed = False
+        for lane in self._lanes.values():
+            for _ in range(lane.min_size):
+                conn = self._create(lane)
+                lane.idle.append((conn, time.monotonic()))
+
+    @property
+    def lanes(self) -> list[str]:
+        return list(self._lanes)
+
+    def _create(self, lane: _Lane[T]) -> T:
+        conn = self._factory()
+        self._lane_of[id(conn)] = lane.name
+        lane.size += 1
+        return conn
+
+    def get(self, lane: str | None = None, timeout: float | None = None) -> T:
+        """Check out a connection, waiting for one to become available.
+
+        Raises PoolFull if too many callers are waiting already and
+        PoolTimeout if no connection became available in time.
+        """
+        if self._closed:
+            raise PoolError("The connection pool is closed")
+        name = lane or DEFAULT_LANE
+        if name not in self._lanes:
+            raise ValueError(f"Unknown pool lane: {name}")
+        pool_lane = self._lanes[name]
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+
+        with pool_lane.cond:
+            if not pool_lane.idle and pool_lane.size >= pool_lane.max_size:
+                max_waiting = self.max_waiting
+                if max_waiting is not None and pool_lane.waiting >= max_waiting:
+                    pool_lane.rejections += 1
+                    raise PoolFull(f"Too many queries waiting in lane `{name}`")
+                pool_lane.waiting += 1
+                try:
+                    available = pool_lane.cond.wait_for(
+                        lambda: pool_lane.idle or pool_lane.size < pool_lane.max_size,
+                        timeout,
+                    )
+                finally:
+                    pool_lane.waiting -= 1
+                if not available:
+                    pool_lane.timeouts += 1
+                    raise PoolTimeout(f"No connection available in lane `{name}`")
+
+            waited = time.monotonic() - start
+            pool_lane.checkouts += 1
+            pool_lane.wait_seconds += waited
+            pool_lane.max_wait_seconds = max(pool_lane.max_wait_seconds, waited)
+            if pool_lane.idle:
+                # most recently used first, so surplus connections go idle
+                return pool_lane.idle.pop()[0]
+            pool_lane.size += 1
+
+        try:
+            conn = self._factory()
+        except Exception:
+            with pool_lane.cond:
+                pool_lane.size -= 1
+                pool_lane.cond.notify()
+            raise
+        self._lane_of[id(conn)] = name
+        return conn
+
+    def put(self, conn: T) -> None:
+        """Return a connection to its lane, or close it if the pool is closed."""
+        lane = self._lanes[self._lane_of[id(conn)]]
+        now = time.monotonic()
+        with lane.cond:
+            if self._closed:
+                lane.size -= 1
+                expired = [conn]
+            else:
+                lane.idle.append((conn, now))
+                lane.cond.notify()
+                expired = self._expire(lane, now)
+        for conn in expired:
+            self._discard(conn)
+
+    def expire(self) -> None:
+        """Close surplus connections of all lanes that were idle for too long."""
+        now = time.monotonic()
+        for lane in self._lanes.values():
+            with lane.cond:
+                expired = self._expire(lane, now)
+            for conn in expired:
+                self._discard(conn)
+
+    def _expire(self, lane: _Lane[T], now: float) -> list[T]:
+        """Remove surplus connections that were idle for too long."""
+        expired: list[T] = []
+        if self.idle_timeout is None:
+            return expired
+        deadline = now - self.idle_timeout
+        while lane.size > lane.min_size and lane.idle and lane.idle[0][1] < deadline:
+            expired.append(lane.idle.popleft()[0])
+            lane.size -= 1
+        return expired
+
+    def _discard(self, conn: T) -> None:
+        self._lane_of.pop(id(conn), None)
+        if self._close is not None:
+            self._close(conn)
+
+    @contextmanager
+    def checkout(
+        self, lane: str | None = None, timeout: float | None = None
+    ) -> Generator[T, None, None]:
+        """Check out a connection for the duration of a block."""
+        conn = self.get(lane, timeout)
+        try:
+            yield conn
+        finally:
+            self.put(conn)
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """Get size, usage and wait time counters per lane."""
+        stats = {}
+        for name, lane in self._lanes.items():
+            with lane.cond:
+                stats[name] = lane.stats()
+        return stats
+
+    def close(self) -> None:
+        """Close all idle connections, and others once they are returned."""
+        self._closed = True
+        for lane in self._lanes.values():
+            with lane.cond:
+                conns = [conn for conn, _ in lane.idle]
+                lane.size -= len(conns)
+                lane.idle.clear()
+            for conn in conns:
+                self._discard(conn)
@@ -0,0 +1,192 @@
+"""Read query results ahead on a producer thread, spilling for slow clients."""
+
+import os
+import queue
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Iterable
+
+import pyarrow as pa
+
+from flydelta.files import remove_file
+
+_DONE = object()
+
+
+class _Spilled:
+    def __init__(self, path: str):
+        self.path = path
+
+
+class _Producer:
+    """Reads batches from a source into a bounded queue on its own thread.
+
+    It holds no reference to the consuming stream, so an abandoned stream is
+    garbage collected and stops the producer.
+    """
+
+    def __init__(
+        self,
+        source: Iterable[pa.RecordBatch],
+        schema: pa.Schema,
+        depth: int,
+        spill_after: float | None,
+        spill_dir: str | None,
+        on_spill: Callable[[], None] | None,
+    ):
+        self.queue: queue.Queue[Any] = queue.Queue(maxsize=max(1, depth))
+        self.stopped = threading.Event()
+        self._source = source
+        self._schema = schema
+        self._spill_after = spill_after
+        self._spill_dir = spill_dir
+        self._on_spill = on_spill
+
+    def _put(self, item: Any, spill: bool = True) -> str:
+        """Put an item into the queue.
+
+        Returns `put`, `stopped` if the consumer has gone or `spill` if the
+        queue stayed full for too long.
+        """
+        start = time.monotonic()
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return "put"
+            except queue.Full:
+                if not spill or self._spill_after is None:
+                    continue
+                if time.monotonic() - start >= self._spill_after:
+                    return "spill"
+        return "stopped"
+
+    def run(self) -> None:
+        try:
+            batches = iter(self._source)
+            for batch in batches:
+                result = self._put(batch)
+                if result == "stopped":
+                    return
+                if result == "spill":
+                    self._spill(batch, batches)
+                    return
+            self._put(_DONE, spill=False)
+        except Exception as e:
+            self._put(e, spill=False)
+        finally:
+            self._close_source()
+
+    def _spill(self, batch: pa.RecordBatch, batches: Iterable[pa.RecordBatch]) -> None:
+        """Write the remaining batches to a file and hand it to the consumer."""
+        fd, path = tempfile.mkstemp(
+            prefix="flydelta-", suffix=".arrows", dir=self._spill_dir
+        )
+        os.close(fd)
+        try:
+            with pa.OSFile(path, "wb") as sink:
+                with pa.ipc.new_stream(sink, self._schema) as writer:
+                    writer.write_batch(batch)
+                    for batch in batches:
+                        if self.stopped.is_set():
+                            raise InterruptedError
+                        writer.write_batch(batch)
+        except BaseException:
+            remove_file(path)
+            raise
+        self._close_source()
+        if self._on_spill is not None:
+            self._on_spill()
+        if self._put(_Spilled(path), spill=False) == "stopped" or self.stopped.is_set():
+            # the consumer has gone, possibly after the file was queued
+            remove_file(path)
+
+    def _close_source(self) -> None:
+        close = getattr(self._source, "close", None)
+        if close is not None:
+            close()
+
+
+class PrefetchStream:
+    """Iterator over batches read ahead from a source on a producer thread.
+
+    Up to `depth` batches are buffered, so the query keeps running while
+    batches are sent. If the buffer stays full for `spill_after` seconds
+    because the client doesn't read, the rest of the result is written to an
+    Arrow IPC file in `spill_dir` and the source is closed, which releases
+    its pooled connection. The spilled batches are then read from the file.
+
+    Args:
+        source: Batches with an optional `close` method releasing resources
+        schema: Schema of the batches
+        depth: Maximum number of batches buffered in memory
+        spill_after: Seconds a full buffer waits before spilling (None never)
+        spill_dir: Directory for spill files (default temporary directory)
+        on_spill: Called when a result is spilled
+    """
+
+    def __init__(
+        self,
+        source: Iterable[pa.RecordBatch],
+        schema: pa.Schema,
+        depth: int,
+        spill_after: float | None = None,
+        spill_dir: str | None = None,
+        on_spill: Callable[[], None] | None = None,
+    ):
+        self.schema = schema
+        self.spilled = False
+        self._producer = _Producer(
+            source, schema, depth, spill_after, spill_dir, on_spill
+        )
+        self._reader: pa.RecordBatchStreamReader | None = None
+        self._path: str | None = None
+        self._finished = False
+        threading.Thread(target=self._producer.run, daemon=True).start()
+
+    def __iter__(self) -> "PrefetchStream":
+        return self
+
+    def __next__(self) -> pa.RecordBatch:
+        if self._finished:
+            raise StopIteration
+        if self._reader is not None:
+            try:
+                return self._reader.read_next_batch()
+            except StopIteration:
+                self.close()
+                raise
+        item = self._producer.queue.get()
+        if item is _DONE:
+            self.close()
+            raise StopIteration
+        if isinstance(item, Exception):
+            self.close()
+            raise item
+        if isinstance(item, _Spilled):
+            self.spilled = True
+            self._path = item.path
+            self._reader = pa.ipc.open_stream(pa.memory_map(item.path))
+            return next(self)
+        batch: pa.RecordBatch = item
+        return batch
+
+    def close(self) -> None:
+        """Stop the producer and remove a spill file."""
+        self._finished = True
+        self._producer.stopped.set()
+        self._reader = None
+        if self._path is not None:
+            path, self._path = self._path, None
+            remove_file(path)
+        # a spilled result the consumer didn't get to
+        while True:
+            try:
+                item = self._producer.queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, _Spilled):
+                remove_file(item.path)
+
+    def __del__(self) -> None:
+        self.close()
@@ -0,0 +1,181 @@
+"""Skip Delta table files using partition values and per-file statistics.
+
+A file is only skipped if its partition values or the min/max/null count
+statistics of the Delta log prove that none of its rows match a predicate.
+Missing statistics or values that can't be compared keep the file.
+"""
+
+import datetime
+import decimal
+from typing import Any, Iterable
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from flydelta.planner import Predicate
+
+# Distinct lookup keys matched one by one, more are pruned by their range
+LOOKUP_IN_VALUES = 100
+
+
+def _kind(value: Any) -> type:
+    """Get the group of types a value can be compared with."""
+    if isinstance(value, bool):
+        return bool
+    if isinstance(value, (int, float, decimal.Decimal)):
+        return decimal.Decimal
+    if isinstance(value, datetime.datetime):
+        return datetime.datetime
+    return type(value)
+
+
+def _coerce(value: Any, like: Any) -> Any:
+    """Convert a SQL constant to the type of a statistics value if needed.
+
+    Raises TypeError if the constant can't be compared with the value.
+    """
+    if isinstance(like, datetime.datetime):
+        if isinstance(value, str):
+            value = datetime.datetime.fromisoformat(value)
+        elif isinstance(value, datetime.date) and not isinstance(
+            value, datetime.datetime
+        ):
+            value = datetime.datetime.combine(value, datetime.time())
+    elif isinstance(like, datetime.date) and isinstance(value, str):
+        value = datetime.date.fromisoformat(value)
+    elif _kind(like) is decimal.Decimal and isinstance(value, str):
+        # e.g. '2020' compared with an integer partition column
+        try:
+            value = decimal.Decimal(value.strip())
+        except decimal.InvalidOperation:
+            raise TypeError(f"Can't compare {value!r} with {like!r}")
+    if _kind(value) is not _kind(like):
+        raise TypeError(f"Can't compare {value!r} with {like!r}")
+    if isinstance(like, datetime.datetime) and (value.tzinfo is None) != (
+        like.tzinfo is None
+    ):
+        # the time zone of a naive timestamp depends on the DuckDB session
+        raise TypeError(f"Can't compare {value!r} with {like!r}")
+    return value
+
+
+def _compare(op: str, left: Any, right: Any) -> bool:
+    right = _coerce(right, left)
+    if op == "=":
+        return bool(left == right)
+    if op == "<":
+        return bool(left < right)
+    if op == "<=":
+        return bool(left <= right)
+    if op == ">":
+        return bool(left > right)
+    return bool(left >= right)
+
+
+def _partition_matches(predicate: Predicate, value: Any) -> bool:
+    """Check if rows with the given partition value can match a predicate."""
+    if predicate.op == "is_null":
+        return value is None
+    if predicate.op == "is_not_null":
+        return value is not None
+    if value is None:
+        return False
+    if predicate.op == "in":
+        return any(_compare("=", value, v) for v in predicate.value)
+    return _compare(predicate.op, value, predicate.value)
+
+
+def _stats_match(predicate: Predicate, file: dict[str, Any]) -> bool:
+    """Check if a file can contain rows matching a predicate by its stats."""
+    rows = file.get("num_records")
+    nulls = file.get(f"null_count.{predicate.column}")
+    low = file.get(f"min.{predicate.column}")
+    high = file.get(f"max.{predicate.column}")
+    if predicate.op == "is_null":
+        return nulls is None or nulls > 0
+    all_null = rows is not None and nulls is not None and nulls >= rows
+    if predicate.op == "is_not_null":
+        return not all_null
+    if all_null:
+        # comparisons are never true for NULL values
+        return False
+    if low is None or high is None:
+        return True
+    if isinstance(high, datetime.datetime):
+        # Delta truncates timestamp statistics to milliseconds
+        high += datetime.timedelta(milliseconds=1)
+    if predicate.op == "in":
+        return any(
+            _compare("<=", low, v) and _compare(">=", high, v) for v in predicate.value
+        )
+    if predicate.op == "=":
+        return _compare("<=", low, predicate.value) and _compare(
+            ">=", high, predicate.value
+        )
+    if predicate.op in ("<", "<="):
+        return _compare(predicate.op, low, predicate.value)
+    return _compare(predicate.op, high, predicate.value)
+
+
+def _matches(
+    predicates: Iterable[Predicate], file: dict[str, Any], partitions: set[str]
+) -> bool:
+    for predicate in predicates:
+        try:
+            if predicate.column in partitions:
+                value = file[f"partition.{predicate.column}"]
+                if not _partition_matches(predicate, value):
+                    return False
+            elif not _stats_match(predicate, file):
+                return False
+        except (TypeError, ValueError, KeyError):
+            continue
+    return True
+
+
+def skipped_files(
+    actions: pa.Table, predicates: list[Predicate], partition_columns: list[str]
+) -> set[str]:
+    """Get the paths of files without rows matching all predicates.
+
+    `actions` is the flattened add actions table of a Delta table, with the
+    `partition.<column>`, `min.<column>`, `max.<column>` and
+    `null_count.<column>` columns of the predicate columns.
+    """
+    if not predicates:
+        return set()
+    columns = {"path", "num_records"}
+    for predicate in predicates:
+        for prefix in ("partition", "min", "max", "null_count"):
+            columns.add(f"{prefix}.{predicate.column}")
+    actions = actions.select([c for c in actions.column_names if c in columns])
+    partitions = set(partition_columns)
+    return {
+        file["path"]
+        for file in actions.to_pylist()
+        if not _matches(predicates, file, partitions)
+    }
+
+
+def lookup_predicates(
+    keys: pa.Table, columns: list[str], in_values: int = LOOKUP_IN_VALUES
+) -> list[Predicate]:
+    """Get predicates all rows joined on the key `columns` of `keys` match.
+
+    Few distinct keys become an `in` list, more a range. NULL keys never
+    match a join and are ignored.
+    """
+    predicates = []
+    for column in columns:
+        try:
+            values = pc.unique(keys.column(column).drop_null())
+            if len(values) <= in_values:
+                predicates.append(Predicate(column, "in", values.to_pylist()))
+                continue
+            bounds = pc.min_max(values)
+        except pa.ArrowNotImplementedError:
+            # keys of types without ordering are only joined
+            continue
+        predicates.append(Predicate(column, ">=", bounds["min"].as_py()))
+        predicates.append(Predicate(column, "<=", bounds["max"].as_py()))
+    return predicates
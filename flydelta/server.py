@@ -3,11 +3,74 @@
 Requires server dependencies: pip install flydelta[server]
 """
 
-from queue import Queue
-from typing import TYPE_CHECKING, Any, Generator
+import base64
+import datetime
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import TYPE_CHECKING, Any, Callable, Generator, Iterable
+from urllib.parse import unquote
 
 import pyarrow as pa
+import pyarrow.dataset as ds
 import pyarrow.flight as flight
+from pyarrow.fs import PyFileSystem
+
+from flydelta.cache import LRUCache, ResultCache, ResultKey, normalize_sql
+from flydelta.cluster import (
+    PART_PREFIX,
+    Part,
+    PeerFile,
+    assign_files,
+    cluster_nodes,
+    decode_part,
+    encode_part,
+)
+from flydelta.filecache import CachedFileSystemHandler, FileCache
+from flydelta.ipc import (
+    BATCH_BYTES_HEADER,
+    COMPRESSION_HEADER,
+    QUERY_ID_HEADER,
+    SharedEncoding,
+    dictionary_encoder,
+    rebatch,
+    write_options,
+)
+from flydelta.lookup import LOOKUP_PREFIX, Lookup, decode_lookup
+from flydelta.metrics import ServerMetrics, start_http_server
+from flydelta.planner import (
+    Predicate,
+    from_table,
+    is_volatile,
+    parameter_count,
+    replace_snapshots,
+    replace_table,
+    rollup_merges,
+    scan_table,
+    select_node,
+    split_dataset,
+    where_predicates,
+)
+from flydelta.pool import DEFAULT_LANE, LANE_HEADER, ConnectionPool, PoolError
+from flydelta.prefetch import PrefetchStream
+from flydelta.pruning import lookup_predicates, skipped_files
+from flydelta.spool import SPOOL_HEADER, SPOOL_PREFIX, Spool, SpoolStore
+from flydelta.spool import decode_ticket as decode_spool_ticket
+from flydelta.statement import (
+    STATEMENT_PREFIX,
+    decode_ticket,
+    sql_identifier,
+    sql_literal,
+)
+from flydelta.tracing import fail_span, start_span
 
 try:
     import duckdb
@@ -20,6 +83,8 @@ except ImportError:
         import duckdb
         from deltalake import DeltaTable
 
+log = logging.getLogger(__name__)
+
 
 def _check_server_deps() -> None:
     """Raise ImportError if server dependencies are not installed."""
@@ -30,6 +95,175 @@ def _check_server_deps() -> None:
         )
 
 
+# Tickets handed out by get_flight_info refer to a server-side plan
+PLAN_PREFIX = b"plan:"
+# Rough memory held by each file of a plan's datasets besides its path
+PLAN_FILE_BYTES = 512
+
+# Relation holding the keys of a lookup
+LOOKUP_KEYS = "__flydelta_keys"
+
+# Rows fetched from DuckDB at a time for results sized in bytes, one vector
+BYTES_FETCH_ROWS = 2048
+
+# Seconds between checks for cancelled and overrunning queries
+WATCH_INTERVAL = 0.1
+
+# Queries that may read older table versions with AT (VERSION => ...)
+AT_CLAUSE = re.compile(r"\bAT\s*\(", re.IGNORECASE)
+
+
+@dataclass
+class _Plan:
+    """Server-side state of a query planned by get_flight_info."""
+
+    query: str
+    schema: pa.Schema
+    tables: set[str] | None
+    # Datasets registered under a temporary name for this plan only
+    views: dict[str, ds.Dataset] = field(default_factory=dict)
+    # Files of the queried table read and skipped by pruning
+    scan: dict[str, Any] | None = None
+    # Cluster node executing the plan from a part ticket, None for this node
+    location: str | None = None
+    part: Part | None = None
+    # Dictionary encoding picked per stream (True), never (False) or shared
+    # by the endpoints of a split query
+    dictionary: SharedEncoding | bool = True
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the plan, counted by the plan cache."""
+        size: int = len(self.query) + self.schema.serialize().size
+        for view in self.views.values():
+            if isinstance(view, ds.FileSystemDataset):
+                size += sum(len(path) + PLAN_FILE_BYTES for path in view.files)
+        return size
+
+
+@dataclass
+class _Statement:
+    """A statement prepared on the pooled connections on first use."""
+
+    query: str
+    parameters: int
+    schema: pa.Schema
+    # Tables registered before execution, None for all
+    tables: set[str] | None = None
+
+
+@dataclass
+class _View:
+    """The current result of a materialized view and what it was read from."""
+
+    table: pa.Table
+    # Versions of the tables the view reads
+    versions: dict[str, int]
+    # Files of the table a single-table view reads
+    files: set[str] = field(default_factory=set)
+
+
+class NotReadyError(Exception):
+    """A table a query reads is still loading, the request may be retried."""
+
+
+@dataclass(eq=False)
+class _Query:
+    """A query being answered by do_get, tracked for cancellation and limits."""
+
+    id: str
+    context: flight.ServerCallContext
+    started: float = field(default_factory=time.monotonic)
+    conn: "duckdb.DuckDBPyConnection | None" = None
+    # why the query was interrupted, if it was
+    reason: str | None = None
+    # target size of result batches, fetched in small chunks and coalesced
+    batch_bytes: int | None = None
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def attach(self, conn: "duckdb.DuckDBPyConnection | None") -> None:
+        """Set the connection running the query, None once it is released."""
+        with self.lock:
+            self.conn = conn
+
+    def interrupt(self, reason: str) -> None:
+        """Stop the query on its connection."""
+        with self.lock:
+            self.reason = self.reason or reason
+            if self.conn is not None:
+                self.conn.interrupt()
+
+
+class _BatchStream:
+    """Iterator over the batches of a running query.
+
+    Holds a pooled connection and releases it once the batches are exhausted,
+    the stream is closed or the iterator is garbage collected.
+    """
+
+    def __init__(self, reader: pa.RecordBatchReader, release: Callable[[], None]):
+        self.schema = reader.schema
+        self._reader = reader
+        self._release: Callable[[], None] | None = release
+
+    def __iter__(self) -> "_BatchStream":
+        return self
+
+    def __next__(self) -> pa.RecordBatch:
+        if self._release is None:
+            raise StopIteration
+        try:
+            return self._reader.read_next_batch()
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        """Release the connection back to the pool."""
+        if self._release is not None:
+            release, self._release = self._release, None
+            release()
+
+    def __del__(self) -> None:
+        self.close()
+
+
+def _flight_error(exc: Exception, running: _Query | None = None) -> Exception:
+    """Map an error answering a request to the Flight error sent to the client.
+
+    Interrupted queries are cancelled, tables still loading or an exhausted
+    pool are unavailable so clients may retry, other errors fail the query.
+    """
+    error: Exception
+    if running is not None and running.reason is not None:
+        error = flight.FlightCancelledError(f"Query {running.id} {running.reason}")
+    elif isinstance(exc, (PoolError, NotReadyError)):
+        error = flight.FlightUnavailableError(str(exc))
+    elif isinstance(exc, flight.FlightError):
+        error = exc
+    else:
+        error = flight.FlightServerError(f"Query error: {exc}")
+    return error
+
+
+class _HeadersMiddleware(flight.ServerMiddleware):
+    """Keeps the request headers of a call accessible to the handlers."""
+
+    def __init__(self, headers: dict[str, list[str]]):
+        self.headers = headers
+
+    def get(self, name: str) -> str | None:
+        values = self.headers.get(name)
+        return values[0] if values else None
+
+
+class _HeadersMiddlewareFactory(flight.ServerMiddlewareFactory):
+    def start_call(
+        self, info: flight.CallInfo, headers: dict[str, list[str]]
+    ) -> _HeadersMiddleware:
+        return _HeadersMiddleware(headers)
+
+
 class Server(flight.FlightServerBase):
     """A Flight SQL server that queries Delta Lake tables via DuckDB."""
 
@@ -37,88 +271,1576 @@ class Server(flight.FlightServerBase):
         self,
         location: str = "grpc://0.0.0.0:8815",
         tables: dict[str, str] | None = None,
+        pinned: Iterable[str] = (),
+        pin_memory: int | None = None,
+        materialized_views: dict[str, str] | None = None,
+        disk_cache_dir: str | None = None,
+        disk_cache_size: int = 10 * 1024**3,
+        snapshot_cache_size: int = 16,
+        load_workers: int = 8,
+        background_load: bool = False,
+        metadata_cache: str | None = None,
         pool_size: int = 10,
         batch_size: int = 100_000,
+        batch_bytes: int | None = None,
+        prefetch: int = 0,
+        spill_after: float | None = None,
+        spill_dir: str | None = None,
+        spool_dir: str | None = None,
+        spool_size: int = 10 * 1024**3,
+        spool_ttl: float = 3600,
+        spool_segment_bytes: int = 64 * 1024 * 1024,
+        max_query_time: float | None = None,
+        max_rows: int | None = None,
+        query_memory_limit: str | None = None,
+        query_threads: int | None = None,
+        shared_database: bool = False,
+        memory_limit: str | None = None,
+        threads: int | None = None,
+        pool_min_size: int = 1,
+        pool_lanes: dict[str, int] | None = None,
+        pool_timeout: float | None = None,
+        pool_max_waiting: int | None = None,
+        pool_idle_timeout: float | None = 300,
+        cache_size: int = 0,
+        cache_ttl: float | None = None,
+        plan_ttl: float = 300,
+        plan_cache_size: int = 64 * 1024 * 1024,
+        statement_ttl: float | None = 3600,
+        max_statements: int = 1000,
+        max_endpoints: int = 1,
+        peers: Iterable[str] = (),
+        peers_file: str | None = None,
+        refresh_interval: float | None = None,
+        compression: str | None = None,
+        compression_level: int | None = None,
+        compression_threshold: int = 64 * 1024,
+        dictionary_ratio: float = 0,
+        metrics_port: int | None = None,
+        metrics_host: str = "0.0.0.0",
     ):
         _check_server_deps()
-        super().__init__(location)
+        pinned = set(pinned)
+        unknown = pinned.difference(tables or {})
+        if unknown:
+            raise ValueError(f"Unknown pinned tables: {', '.join(sorted(unknown))}")
+        clashing = set(materialized_views or {}).intersection(tables or {})
+        if clashing:
+            raise ValueError(
+                f"Materialized views named like tables: {', '.join(sorted(clashing))}"
+            )
+        if shared_database and (query_memory_limit or query_threads):
+            raise ValueError(
+                "Queries share the memory and threads of a shared database, "
+                "use memory_limit and threads instead"
+            )
+        if not shared_database and (memory_limit or threads):
+            raise ValueError("memory_limit and threads require a shared database")
+        super().__init__(location, middleware={"headers": _HeadersMiddlewareFactory()})
         self.location = location
         self.tables: dict[str, str] = tables or {}
         self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+
+        # Results are read ahead on a producer thread if `prefetch` > 0, and
+        # spilled to disk if the client stops reading for `spill_after` seconds
+        self.prefetch = prefetch
+        self.spill_after = spill_after
+        self.spill_dir = spill_dir
 
-        # Load delta tables and cache schemas on boot
+        # Results requested with the spool header are run once into segment
+        # files in `spool_dir`, each served by its own ticket until `spool_ttl`
+        self.spool_ttl = spool_ttl
+        self._spools: SpoolStore | None = None
+        if spool_dir is not None:
+            self._spools = SpoolStore(
+                spool_dir, spool_size, ttl=spool_ttl, segment_bytes=spool_segment_bytes
+            )
+
+        # Limits per query. Every pooled connection is a separate DuckDB
+        # database, so its memory and thread settings apply per query.
+        self.max_query_time = max_query_time
+        self.max_rows = max_rows
+        self.query_memory_limit = query_memory_limit
+        self.query_threads = query_threads
+
+        self.max_endpoints = max_endpoints
+
+        # Other servers of a cluster over the same tables, given as a list or
+        # a file read again when it changes. Table scans are spread over all
+        # nodes by the files they read.
+        self.peers = list(peers)
+        self._peer_file = PeerFile(peers_file) if peers_file is not None else None
+
+        # IPC options for result streams. Clients may pick a codec per query.
+        write_options(compression, compression_level)
+        self.compression = compression
+        self.compression_level = compression_level
+        self.compression_threshold = compression_threshold
+        self.dictionary_ratio = dictionary_ratio
+
+        # Optional local copies of table files, read through on first access
+        self._file_cache: FileCache | None = None
+        if disk_cache_dir is not None:
+            self._file_cache = FileCache(disk_cache_dir, disk_cache_size)
+
+        # Delta tables are loaded on a thread pool, in the background if
+        # `background_load` so the port opens right away. Schemas and versions
+        # of an earlier run are read from `metadata_cache` meanwhile.
         self._delta_tables: dict[str, DeltaTable] = {}
         self._schemas: dict[str, pa.Schema] = {}
-        for name, uri in self.tables.items():
-            dt = DeltaTable(uri)
+        self._datasets: dict[str, ds.FileSystemDataset] = {}
+        self._versions: dict[str, int] = {}
+        self._refresh_lock = threading.Lock()
+        self.load_workers = load_workers
+        self.metadata_cache = metadata_cache
+        self._load_errors: dict[str, str] = {}
+        self._ready = threading.Event()
+        self._read_metadata_cache()
+
+        # Small hot tables are read into memory once per version and shared
+        # by all connections, as long as they fit into `pin_memory` bytes
+        self.pinned = pinned
+        self.pin_memory = pin_memory
+        self._pinned: dict[str, pa.Table] = {}
+
+        # Views computed into in-memory tables once the tables they read are
+        # loaded, and again when those tables change. Aggregations of a table
+        # that only had files added are updated from the added files.
+        self.materialized_views: dict[str, str] = materialized_views or {}
+        self._materialized: dict[str, _View] = {}
+
+        # Older versions read with AT clauses, by table and version. Entries
+        # count as one byte, so the cache holds up to `snapshot_cache_size`.
+        self._snapshots: LRUCache[tuple[str, int], ds.FileSystemDataset] = LRUCache(
+            snapshot_cache_size
+        )
+        # Versions of timestamps before the latest commit, which can't change
+        self._snapshot_versions: LRUCache[tuple[str, datetime.datetime], int] = (
+            LRUCache(snapshot_cache_size)
+        )
+
+        # Flattened add actions with file statistics, by table and version
+        self._actions: dict[str, tuple[int, pa.Table]] = {}
+        self._scan_stats = {"queries": 0, "files_scanned": 0, "files_skipped": 0}
+        self._scan_stats_lock = threading.Lock()
+
+        # With `shared_database`, pooled connections are cursors of a single
+        # DuckDB database with one buffer manager, memory limit and thread
+        # pool. Otherwise every connection is a database of its own.
+        self._database: duckdb.DuckDBPyConnection | None = None
+        if shared_database:
+            self._database = duckdb.connect(":memory:")
+            if memory_limit is not None:
+                self._database.execute(f"SET memory_limit = '{memory_limit}'")
+            if threads is not None:
+                self._database.execute(f"SET threads = {int(threads)}")
+
+        # Create connection pool. Tables are registered on a connection when a
+        # query first reads them, and the registered versions are tracked per
+        # connection to swap datasets on checkout.
+        self._registered: dict[int, dict[str, int]] = {}
+
+        # Prepared statements by handle, prepared lazily per connection.
+        # Entries count as one byte, so up to `max_statements` are kept, and
+        # they expire when unused for `statement_ttl` seconds. Statements
+        # that are gone are deallocated on the next checkout of a connection.
+        self.statement_ttl = statement_ttl
+        self._statements: LRUCache[str, _Statement] = LRUCache(
+            max_statements, ttl=statement_ttl
+        )
+        self._prepared: dict[int, set[str]] = {}
+
+        self._pool: ConnectionPool[duckdb.DuckDBPyConnection] = ConnectionPool(
+            self._connect,
+            lanes={DEFAULT_LANE: pool_size, **(pool_lanes or {})},
+            min_size=pool_min_size,
+            timeout=pool_timeout,
+            max_waiting=pool_max_waiting,
+            idle_timeout=pool_idle_timeout,
+            close=self._disconnect,
+        )
+
+        # Dedicated database for parsing queries outside of the pool, with a
+        # cursor per thread so requests are parsed concurrently
+        self._parser_db = duckdb.connect(":memory:")
+        self._parser_lock = threading.Lock()
+        self._parsers = threading.local()
+
+        # Optional cache of finished results, keyed on SQL and table versions
+        self._cache: ResultCache | None = None
+        if cache_size > 0:
+            self._cache = ResultCache(cache_size, ttl=cache_ttl)
+
+        # Plans created by get_flight_info, referenced by opaque tickets
+        self._plans: LRUCache[bytes, _Plan] = LRUCache(plan_cache_size, ttl=plan_ttl)
+
+        # Query path metrics, optionally served for Prometheus scrapes
+        self.metrics = ServerMetrics()
+        self.metrics.collector(self._collect_metrics)
+        self._metrics_server = None
+        if metrics_port is not None:
+            self._metrics_server = start_http_server(
+                self.metrics, metrics_port, metrics_host
+            )
+
+        # Running queries, interrupted when cancelled or over their time limit
+        self._queries: set[_Query] = set()
+        self._queries_lock = threading.Lock()
+
+        self._stopped = threading.Event()
+        if background_load:
+            threading.Thread(
+                target=self._load_tables, args=(True,), daemon=True
+            ).start()
+        else:
+            self._load_tables()
+
+        # Poll tables for new versions in the background
+        threading.Thread(target=self._watch, daemon=True).start()
+        if refresh_interval:
+            threading.Thread(
+                target=self._poll, args=(refresh_interval,), daemon=True
+            ).start()
+
+    def _read_metadata_cache(self) -> None:
+        """Use the schemas saved by an earlier run until tables are loaded."""
+        if self.metadata_cache is None:
+            return
+        try:
+            with open(self.metadata_cache) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for name, entry in saved.items():
+            if self.tables.get(name) != entry.get("uri"):
+                continue
+            schema = base64.b64decode(entry["schema"])
+            self._schemas[name] = pa.ipc.read_schema(pa.py_buffer(schema))
+
+    def _write_metadata_cache(self) -> None:
+        """Save the schemas and versions of all loaded tables."""
+        if self.metadata_cache is None:
+            return
+        saved = {}
+        for name, version in list(self._versions.items()):
+            if name not in self.tables:
+                continue
+            schema = self._schemas[name].serialize().to_pybytes()
+            saved[name] = {
+                "uri": self.tables[name],
+                "version": version,
+                "schema": base64.b64encode(schema).decode("ascii"),
+            }
+        temp = f"{self.metadata_cache}.tmp"
+        with open(temp, "w") as f:
+            json.dump(saved, f)
+        os.replace(temp, self.metadata_cache)
+
+    def _load_tables(self, background: bool = False) -> None:
+        """Load all tables concurrently and mark the server as ready.
+
+        Errors are raised when loading in the foreground and kept per table
+        when loading in the background.
+        """
+        names = list(self.tables)
+        workers = max(1, min(self.load_workers, len(names)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {name: executor.submit(self._load_table, name) for name in names}
+        for name, future in futures.items():
+            error = future.exception()
+            if error is None:
+                continue
+            if not background:
+                raise error
+            log.warning("Error loading table %s: %s", name, error)
+            self._load_errors[name] = str(error)
+        with self._refresh_lock:
+            self._materialize_views(raise_errors=not background)
+        self._write_metadata_cache()
+        self._ready.set()
+
+    def _load_table(self, name: str) -> None:
+        """Load the latest version of a table and its dataset."""
+        dt = DeltaTable(self.tables[name])
+        schema = pa.schema(dt.schema().to_arrow())
+        dataset = self._dataset(name, dt)
+        with self._refresh_lock:
             self._delta_tables[name] = dt
-            self._schemas[name] = pa.schema(dt.schema().to_arrow())
+            self._schemas[name] = schema
+            self._datasets[name] = dataset
+            if name in self.pinned:
+                self._pin(name)
+            self._versions[name] = dt.version()
+
+    @property
+    def ready(self) -> bool:
+        """Whether all tables have been loaded."""
+        return self._ready.is_set()
 
-        # Create connection pool with tables pre-registered
-        self._pool: Queue[duckdb.DuckDBPyConnection] = Queue(maxsize=pool_size)
-        for _ in range(pool_size):
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        """Wait until all tables are loaded, return False on timeout."""
+        return self._ready.wait(timeout)
+
+    def health(self) -> dict[str, Any]:
+        """Get the readiness and table loading state."""
+        return {
+            "ready": self.ready,
+            "tables": len(self.tables),
+            "loaded": sum(name in self._versions for name in self.tables),
+            "errors": dict(self._load_errors),
+        }
+
+    def _connect(self) -> "duckdb.DuckDBPyConnection":
+        """Create a pooled connection, tables are registered on first use.
+
+        Registered tables are views local to a connection, also to a cursor
+        of the shared database. They refer to the same dataset objects.
+        """
+        if self._database is not None:
+            conn = self._database.cursor()
+        else:
             conn = duckdb.connect(":memory:")
-            for name, dt in self._delta_tables.items():
-                conn.register(name, dt.to_pyarrow_dataset())
+            if self.query_memory_limit is not None:
+                conn.execute(f"SET memory_limit = '{self.query_memory_limit}'")
+            if self.query_threads is not None:
+                conn.execute(f"SET threads = {int(self.query_threads)}")
+        self._registered[id(conn)] = {}
+        self._prepared[id(conn)] = set()
+        return conn
+
+    def _disconnect(self, conn: "duckdb.DuckDBPyConnection") -> None:
+        """Close a connection removed from the pool."""
+        self._registered.pop(id(conn), None)
+        self._prepared.pop(id(conn), None)
+        conn.close()
+
+    def _sync(
+        self, conn: "duckdb.DuckDBPyConnection", tables: Iterable[str] | None = None
+    ) -> None:
+        """Register current versions of tables on a connection that isn't in use.
+
+        Only the given tables a query reads are registered, all loaded tables
+        if None.
+        """
+        registered = self._registered[id(conn)]
+        if tables is not None:
+            # drop outdated versions the query doesn't read, so their
+            # datasets and pinned tables can be freed
+            for name, version in list(registered.items()):
+                if name not in tables and self._versions.get(name) != version:
+                    conn.unregister(name)
+                    del registered[name]
+        names: Iterable[str] = list(self._versions) if tables is None else tables
+        for name in names:
+            current = self._versions.get(name)
+            if current is None:
+                raise NotReadyError(self._not_ready(name))
+            if registered.get(name) != current:
+                conn.register(name, self._relation(name))
+                registered[name] = current
+        prepared = self._prepared[id(conn)]
+        for handle in [h for h in prepared if h not in self._statements]:
+            conn.execute(f"DEALLOCATE flydelta_{handle}")
+            prepared.discard(handle)
+
+    def _not_ready(self, name: str) -> str:
+        error = self._load_errors.get(name)
+        if error is not None:
+            return f"Table {name} failed to load: {error}"
+        return f"Table {name} is still loading"
+
+    def _checkout(
+        self,
+        lane: str | None = None,
+        running: _Query | None = None,
+        tables: Iterable[str] | None = None,
+    ) -> "duckdb.DuckDBPyConnection":
+        """Get a connection from the pool with up-to-date `tables` (or all)."""
+        start = time.monotonic()
+        conn = self._pool.get(lane)
+        self.metrics.pool_wait.observe(
+            time.monotonic() - start, lane=lane or DEFAULT_LANE
+        )
+        try:
+            self._sync(conn, tables)
+        except Exception:
             self._pool.put(conn)
+            raise
+        if running is not None:
+            running.attach(conn)
+        return conn
 
-    def _get_schema(self, query: str) -> pa.Schema:
-        """Get schema for a query without fetching data."""
-        conn = self._pool.get()
+    def _release(
+        self, conn: "duckdb.DuckDBPyConnection", running: _Query | None = None
+    ) -> None:
+        """Return a connection to the pool."""
+        if running is not None:
+            running.attach(None)
+        self._pool.put(conn)
+
+    def _watch(self) -> None:
+        """Interrupt queries cancelled by their client or over the time limit.
+
+        Expired spools and surplus idle connections are cleaned up as well,
+        as an idle server gets no other chance to do so.
+        """
+        while not self._stopped.wait(WATCH_INTERVAL):
+            if self._spools is not None:
+                self._spools.expire()
+            self._pool.expire()
+            with self._queries_lock:
+                queries = list(self._queries)
+            now = time.monotonic()
+            for running in queries:
+                if running.reason is not None:
+                    # again, the connection may have been between statements
+                    running.interrupt(running.reason)
+                elif running.context.is_cancelled():
+                    running.interrupt("was cancelled by the client")
+                elif self._overrunning(running, now):
+                    running.interrupt(
+                        f"exceeded the time limit of {self.max_query_time}s"
+                    )
+
+    def _overrunning(self, running: _Query, now: float) -> bool:
+        """Check if a query runs longer than allowed."""
+        if self.max_query_time is None:
+            return False
+        return now - running.started > self.max_query_time
+
+    def cancel(self, query_id: str) -> int:
+        """Interrupt all running queries with the given id."""
+        with self._queries_lock:
+            queries = [q for q in self._queries if q.id == query_id]
+        for running in queries:
+            running.interrupt("was cancelled")
+        return len(queries)
+
+    def refresh(self, name: str | None = None) -> dict[str, int]:
+        """Load new versions of one or all tables.
+
+        Only new log entries are read. Pooled connections pick up the new
+        datasets on their next checkout, so running queries finish on the
+        snapshot they started with. Returns the current table versions.
+        """
+        names = [name] if name else list(self._delta_tables)
+        changed = False
+        with self._refresh_lock:
+            for table in names:
+                if table not in self.tables:
+                    raise KeyError(table)
+                if table not in self._delta_tables:
+                    raise NotReadyError(self._not_ready(table))
+                dt = self._delta_tables[table]
+                dt.update_incremental()
+                if dt.version() == self._versions[table]:
+                    continue
+                self._schemas[table] = pa.schema(dt.schema().to_arrow())
+                self._datasets[table] = self._dataset(table)
+                if table in self.pinned:
+                    self._pin(table)
+                self._versions[table] = dt.version()
+                if self._cache is not None:
+                    self._cache.invalidate(table)
+                changed = True
+            if changed:
+                self._materialize_views()
+                self._write_metadata_cache()
+        return {table: self._versions[table] for table in names}
+
+    def _relation(self, name: str) -> pa.Table | ds.Dataset:
+        """Get the data registered for a table or materialized view."""
+        view = self._materialized.get(name)
+        if view is not None:
+            return view.table
+        return self._pinned.get(name, self._datasets[name])
+
+    def _materialize_views(self, raise_errors: bool = False) -> None:
+        """Bring all materialized views up to date with their tables.
+
+        A view that fails keeps its last result and the error is reported
+        by the health action, unless `raise_errors`.
+        """
+        for name in self.materialized_views:
+            try:
+                self._materialize(name)
+            except Exception as e:
+                if raise_errors:
+                    raise
+                log.exception("Error materializing view %s", name)
+                self._load_errors[name] = str(e)
+            else:
+                self._load_errors.pop(name, None)
+
+    def _materialize(self, name: str) -> None:
+        """Compute a materialized view if the tables it reads have changed.
+
+        If the view is a SUM, COUNT, MIN or MAX aggregation of one table and
+        files were only added to it, the aggregation runs over the added
+        files and is merged into the previous result.
+        """
+        query = self.materialized_views[name]
+        tables = self._referenced_tables(query)
+        nested = tables.intersection(self.materialized_views)
+        if nested:
+            raise ValueError(
+                f"View {name} reads other views: {', '.join(sorted(nested))}"
+            )
+        for table in tables:
+            if table not in self._versions:
+                raise NotReadyError(self._not_ready(table))
+        versions = {table: self._versions[table] for table in tables}
+        previous = self._materialized.get(name)
+        if previous is not None and previous.versions == versions:
+            return
+
+        ast = self._parse(query)
+        dataset: ds.FileSystemDataset | None = None
+        files: dict[str, ds.Fragment] = {}
+        if len(tables) == 1 and from_table(ast) is not None:
+            dataset = self._datasets[next(iter(tables))]
+            files = {f.path: f for f in dataset.get_fragments()}
+        result = None
+        merges = rollup_merges(ast)
+        if previous is not None and dataset is not None and merges is not None:
+            if previous.files and previous.files.issubset(files):
+                added = [f for path, f in files.items() if path not in previous.files]
+                result = self._merge_view(
+                    name, ast, merges, previous.table, dataset, added
+                )
+        if result is None:
+            stream = self._stream_batches(query)
+            result = pa.Table.from_batches(list(stream), stream.schema)
+
+        self._materialized[name] = _View(result, versions, set(files))
+        self._schemas[name] = result.schema
+        self._versions[name] = self._versions.get(name, -1) + 1
+        if self._cache is not None:
+            self._cache.invalidate(name)
+
+    def _merge_view(
+        self,
+        name: str,
+        ast: dict[str, Any],
+        merges: list[str],
+        previous: pa.Table,
+        dataset: ds.FileSystemDataset,
+        added: list[ds.Fragment],
+    ) -> pa.Table | None:
+        """Aggregate the files added to a table into the previous result.
+
+        Returns None if the results can't be merged.
+        """
+        columns = previous.column_names
+        if len(set(columns)) != len(columns):
+            return None
+        if not added:
+            return previous
+        dataset = ds.FileSystemDataset(
+            added,
+            schema=dataset.schema,
+            format=dataset.format,
+            filesystem=dataset.filesystem,
+        )
+        source = f"__flydelta_{name}_added"
+        base = f"__flydelta_{name}_previous"
+        query = self._deparse(replace_table(ast, from_table(ast) or "", source))
+        select, keys = [], []
+        for column, merge in zip(columns, merges):
+            column = sql_identifier(column)
+            if merge == "key":
+                select.append(column)
+                keys.append(column)
+            else:
+                select.append(f"{merge}({column}) AS {column}")
+        merged = (
+            f"SELECT {', '.join(select)} "
+            f"FROM (SELECT * FROM {base} UNION ALL ({query})) AS merged"
+        )
+        if keys:
+            merged += f" GROUP BY {', '.join(keys)}"
+        stream = self._stream_batches(merged, {base: previous, source: dataset})
+        result = pa.Table.from_batches(list(stream), stream.schema)
         try:
+            # e.g. DuckDB sums counts into 128 bit integers
+            return result.cast(previous.schema)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            return None
+
+    def _dataset(
+        self, name: str, dt: "DeltaTable | None" = None
+    ) -> ds.FileSystemDataset:
+        """Get the dataset of the current or the given version of a table."""
+        if dt is None:
+            dt = self._delta_tables[name]
+        dataset = dt.to_pyarrow_dataset()
+        if self._file_cache is None:
+            return dataset
+        handler = CachedFileSystemHandler(
+            dataset.filesystem, self._file_cache, self.tables[name]
+        )
+        return dt.to_pyarrow_dataset(filesystem=PyFileSystem(handler))
+
+    def _snapshot(
+        self, name: str, at: int | datetime.datetime
+    ) -> tuple[int, ds.FileSystemDataset]:
+        """Get the version and dataset of a table at a version or timestamp.
+
+        Loaded versions are kept in an LRU cache, so repeated reads of the
+        same version don't replay the transaction log.
+        """
+        version = at if isinstance(at, int) else self._snapshot_versions.get((name, at))
+        if version is not None:
+            if version == self._versions[name]:
+                return version, self._datasets[name]
+            dataset = self._snapshots.get((name, version))
+            if dataset is not None:
+                return version, dataset
+            dt = DeltaTable(self.tables[name], version=version)
+        else:
+            dt = DeltaTable(self.tables[name])
+            dt.load_as_version(at)
+        version = dt.version()
+        dataset = self._dataset(name, dt)
+        self._snapshots.put((name, version), dataset, 1)
+        if isinstance(at, datetime.datetime) and version < self._versions[name]:
+            self._snapshot_versions.put((name, at), version, 1)
+        return version, dataset
+
+    def _snapshot_views(self, query: str) -> tuple[str, dict[str, ds.Dataset]]:
+        """Rewrite `AT` clauses of a query into views of older table versions."""
+        if not AT_CLAUSE.search(query):
+            return query, {}
+        views: dict[str, ds.Dataset] = {}
+
+        def replacement(name: str, at: int | datetime.datetime) -> str:
+            version, dataset = self._snapshot(name, at)
+            view = f"__flydelta_{name}_v{version}"
+            views[view] = dataset
+            return view
+
+        ast = replace_snapshots(
+            self._parse(query), set(self._delta_tables), replacement
+        )
+        if ast is None:
+            return query, {}
+        return self._deparse(ast), views
+
+    def _pin(self, name: str) -> None:
+        """Read the current dataset of a pinned table into memory.
+
+        A table that doesn't fit into the memory budget next to the other
+        pinned tables is read from its files instead.
+        """
+        self._pinned.pop(name, None)
+        table = self._datasets[name].to_table()
+        if self.pin_memory is not None:
+            used = sum(pinned.nbytes for pinned in self._pinned.values())
+            if used + table.nbytes > self.pin_memory:
+                log.warning(
+                    "Not pinning %s: %d bytes exceed the remaining pin memory "
+                    "of %d bytes",
+                    name,
+                    table.nbytes,
+                    self.pin_memory - used,
+                )
+                return
+        self._pinned[name] = table
+
+    def _poll(self, interval: float) -> None:
+        """Refresh all tables every `interval` seconds until shutdown."""
+        while not self._stopped.wait(interval):
+            try:
+                self.refresh()
+            except Exception:
+                log.exception("Refresh error")
+
+    def shutdown(self) -> None:
+        """Stop running queries and background threads, shut down the server."""
+        with self._queries_lock:
+            queries = list(self._queries)
+        for running in queries:
+            running.interrupt("was stopped by a server shutdown")
+        super().shutdown()
+        self._stopped.set()
+        self._pool.close()
+        if self._database is not None:
+            self._database.close()
+        if self._metrics_server is not None:
+            self._metrics_server.shutdown()
+            self._metrics_server.server_close()
+
+    def _collect_metrics(self) -> None:
+        """Update the pool and table version gauges."""
+        for lane, stats in self._pool.stats().items():
+            self.metrics.pool_connections.set(
+                stats["in_use"], lane=lane, state="in_use"
+            )
+            self.metrics.pool_connections.set(stats["idle"], lane=lane, state="idle")
+            self.metrics.pool_waiting.set(stats["waiting"], lane=lane)
+        self.metrics.table_version.clear()
+        for name, version in list(self._versions.items()):
+            self.metrics.table_version.set(version, table=name)
+        if self._file_cache is not None:
+            for stat, value in self._file_cache.stats().items():
+                self.metrics.disk_cache.set(value, stat=stat)
+        self.metrics.pinned_bytes.clear()
+        for name, table in list(self._pinned.items()):
+            self.metrics.pinned_bytes.set(table.nbytes, table=name)
+
+    def _parser(self) -> "duckdb.DuckDBPyConnection":
+        """Get the parser cursor of the current thread."""
+        parser: duckdb.DuckDBPyConnection | None = getattr(
+            self._parsers, "cursor", None
+        )
+        if parser is None:
+            with self._parser_lock:
+                parser = self._parser_db.cursor()
+            self._parsers.cursor = parser
+        return parser
+
+    def _referenced_tables(self, query: str) -> set[str]:
+        """Get the configured tables a query refers to."""
+        names = self._parser().get_table_names(query)
+        # table names are case insensitive in DuckDB
+        configured = {
+            name.lower(): name for name in [*self.tables, *self.materialized_views]
+        }
+        return {configured[n.lower()] for n in names if n.lower() in configured}
+
+    def _query_tables(self, query: str) -> set[str] | None:
+        """Get the tables to register for a query, None for all of them."""
+        try:
+            return self._referenced_tables(query)
+        except duckdb.Error:
+            return None
+
+    def _parse(self, query: str) -> dict[str, Any]:
+        """Parse a query into DuckDB's JSON syntax tree."""
+        result = self._parser().execute("SELECT json_serialize_sql(?)", [query])
+        ast: dict[str, Any] = json.loads(result.fetchall()[0][0])
+        return ast
+
+    def _deparse(self, ast: dict[str, Any]) -> str:
+        """Turn a JSON syntax tree back into SQL."""
+        result = self._parser().execute(
+            "SELECT json_deserialize_sql(?::JSON)", [json.dumps(ast)]
+        )
+        query: str = result.fetchall()[0][0]
+        return query
+
+    def _cache_key(
+        self, query: str, tables: set[str] | None = None
+    ) -> ResultKey | None:
+        """Build the result cache key for a query, None if not cacheable.
+
+        Queries that read no table or call volatile functions like random()
+        or now() are never cached, as nothing would invalidate them.
+        """
+        if self._cache is None:
+            return None
+        versions = self._cacheable_versions(query, tables)
+        if versions is None:
+            return None
+        return ResultKey(normalize_sql(query), tuple(sorted(versions.items())))
+
+    def _cacheable_versions(
+        self, query: str, tables: set[str] | None = None
+    ) -> dict[str, int] | None:
+        """Get the versions to key a cached result on, None if not cacheable."""
+        versions = self._table_versions(query, tables)
+        if not versions or self._volatile(query):
+            return None
+        return versions
+
+    def _volatile(self, query: str) -> bool:
+        """Check if the result of a query can change without a new version."""
+        try:
+            return is_volatile(self._parse(query))
+        except duckdb.Error:
+            return True
+
+    def _table_versions(
+        self, query: str, tables: set[str] | None = None
+    ) -> dict[str, int] | None:
+        """Get the loaded versions of the tables a query reads, None if unknown."""
+        if tables is None:
+            try:
+                tables = self._referenced_tables(query)
+            except duckdb.Error:
+                return None
+        if not all(name in self._versions for name in tables):
+            return None
+        return {name: self._versions[name] for name in tables}
+
+    def _get_schema(
+        self,
+        query: str,
+        views: dict[str, ds.Dataset] | None = None,
+        tables: set[str] | None = None,
+    ) -> pa.Schema:
+        """Get schema for a query without fetching data.
+
+        `tables` read by the query are parsed from it unless given.
+        """
+        views = views or {}
+        if tables is None:
+            tables = self._query_tables(query)
+        conn = self._checkout(tables=tables)
+        start = time.monotonic()
+        try:
+            for name, dataset in views.items():
+                conn.register(name, dataset)
             result = conn.execute(f"SELECT * FROM ({query}) LIMIT 0")
-            return result.fetch_arrow_table().schema
+            return result.to_arrow_table().schema
         finally:
+            for name in views:
+                conn.unregister(name)
             self._pool.put(conn)
+            self.metrics.schema_probe.observe(time.monotonic() - start)
+
+    def _stream_batches(
+        self,
+        query: str,
+        views: dict[str, ds.Dataset] | None = None,
+        lane: str | None = None,
+        running: _Query | None = None,
+        tables: set[str] | None = None,
+    ) -> _BatchStream:
+        """Execute a query and stream results as record batches.
+
+        The schema is taken from the result reader, so no extra probe is needed.
+        Temporary `views` are registered for the query and dropped afterwards,
+        `tables` read by the query are parsed from it unless given.
+        """
+        views = views or {}
+        if tables is None:
+            tables = self._query_tables(query)
+        conn = self._checkout(lane, running, tables)
+
+        def release() -> None:
+            for name in views:
+                conn.unregister(name)
+            self._release(conn, running)
 
-    def _stream_batches(self, query: str) -> Generator[pa.RecordBatch, None, None]:
-        """Stream query results as record batches."""
-        conn = self._pool.get()
         try:
-            reader = conn.execute(query).fetch_record_batch(self.batch_size)
-            for batch in reader:
-                yield batch
+            for name, dataset in views.items():
+                conn.register(name, dataset)
+            reader = conn.execute(query).to_arrow_reader(self._fetch_rows(running))
+        except Exception:
+            release()
+            raise
+        return _BatchStream(reader, release)
+
+    def _fetch_rows(self, running: _Query | None) -> int:
+        """Get the number of rows to fetch from DuckDB at a time.
+
+        Results sized in bytes are fetched in small chunks which are then
+        coalesced, so no oversized batch of wide rows is ever materialized.
+        """
+        if running is not None and running.batch_bytes:
+            return min(self.batch_size, BYTES_FETCH_ROWS)
+        return self.batch_size
+
+    def _plan(self, query: str) -> _Plan:
+        """Resolve the schema and referenced tables of a query.
+
+        Tables read at older versions are replaced by views of snapshots.
+        """
+        query, views = self._snapshot_views(query)
+        try:
+            tables: set[str] | None = self._referenced_tables(query)
+        except duckdb.Error:
+            tables = None
+        key = self._cache_key(query, tables)
+        if key is not None and self._cache is not None:
+            cached = self._cache.peek(key)
+            if cached is not None:
+                return _Plan(query, cached.schema, tables, views)
+        return _Plan(query, self._get_schema(query, views, tables), tables, views)
+
+    def _file_actions(self, name: str) -> pa.Table:
+        """Get the add actions of the current version of a table."""
+        version = self._versions[name]
+        cached = self._actions.get(name)
+        if cached is None or cached[0] != version:
+            actions = pa.table(self._delta_tables[name].get_add_actions(flatten=True))
+            # the paths of add actions are escaped once more than the paths
+            # of the dataset fragments, e.g. `city=New%2520York/...`
+            paths = [unquote(path) for path in actions.column("path").to_pylist()]
+            actions = actions.set_column(
+                actions.schema.get_field_index("path"), "path", pa.array(paths)
+            )
+            cached = (version, actions)
+            self._actions[name] = cached
+        return cached[1]
+
+    def _prune(
+        self, name: str, predicates: list[Predicate]
+    ) -> tuple[ds.FileSystemDataset, dict[str, Any]]:
+        """Leave out the files of a table without rows matching `predicates`.
+
+        Returns the dataset of the remaining files and the number of files
+        scanned and skipped, which are added to the scan stats.
+        """
+        dataset = self._datasets[name]
+        partition_columns = self._delta_tables[name].metadata().partition_columns
+        fragments = list(dataset.get_fragments())
+        skipped = skipped_files(self._file_actions(name), predicates, partition_columns)
+        remaining = [f for f in fragments if f.path not in skipped]
+        skipped_count = len(fragments) - len(remaining)
+        fragments = remaining
+        if skipped_count:
+            dataset = ds.FileSystemDataset(
+                fragments,
+                schema=dataset.schema,
+                format=dataset.format,
+                filesystem=dataset.filesystem,
+            )
+        scan = {
+            "table": name,
+            "files_scanned": len(fragments),
+            "files_skipped": skipped_count,
+        }
+        with self._scan_stats_lock:
+            self._scan_stats["queries"] += 1
+            self._scan_stats["files_scanned"] += len(fragments)
+            self._scan_stats["files_skipped"] += skipped_count
+        return dataset, scan
+
+    def _nodes(self) -> list[str]:
+        """Get the locations of all cluster nodes, empty without peers."""
+        peers = list(self.peers)
+        if self._peer_file is not None:
+            peers.extend(self._peer_file.peers())
+        return cluster_nodes(self.location, peers)
+
+    def _split_plan(self, plan: _Plan) -> list[_Plan]:
+        """Prune the files a query reads and split simple table scans.
+
+        Files of a single-table query whose partition values or statistics
+        rule out the WHERE clause are left out of a temporary view the query
+        is rewritten to read. Simple scans are further split into plans over
+        parts of the remaining files. In a cluster, the files of a simple
+        scan are first divided among the nodes owning them.
+        """
+        try:
+            ast = self._parse(plan.query)
+        except duckdb.Error:
+            return [plan]
+        name = from_table(ast)
+        if name not in self._datasets or name in self._pinned:
+            return [plan]
+
+        version = self._versions[name]
+        actions = self._file_actions(name)
+        partition_columns = self._delta_tables[name].metadata().partition_columns
+        dataset, scan = self._prune(name, where_predicates(ast))
+        skipped = scan["files_skipped"]
+
+        parts: list[ds.FileSystemDataset] = [dataset]
+        locations: list[str | None] = [None]
+        nodes = self._nodes() if scan_table(ast) == name else []
+        if nodes or (self.max_endpoints > 1 and scan_table(ast) == name):
+            paths = actions.column("path").to_pylist()
+            sizes = dict(zip(paths, actions.column("size_bytes").to_pylist()))
+            partitions = {}
+            columns = [f"partition.{c}" for c in partition_columns]
+            if columns:
+                values = zip(*(actions.column(c).to_pylist() for c in columns))
+                partitions = dict(zip(paths, values))
+            owned = assign_files(dataset, nodes, partitions) if nodes else {}
+            if not owned:
+                owned = {self.location: dataset}
+            parts, locations = [], []
+            for node, files in owned.items():
+                split = split_dataset(files, self.max_endpoints, sizes, partitions)
+                parts.extend(split)
+                locations.extend([node] * len(split))
+        remote = [loc is not None and loc != self.location for loc in locations]
+        if not skipped and len(parts) <= 1 and not any(remote):
+            return [replace(plan, scan=scan)]
+
+        # endpoints streamed by other nodes can't share the dictionary encoding
+        dictionary: SharedEncoding | bool = False
+        if self.dictionary_ratio > 0 and not any(remote):
+            dictionary = SharedEncoding(self.dictionary_ratio)
+        plans = []
+        for i, part in enumerate(parts or [dataset]):
+            files = [fragment.path for fragment in part.get_fragments()]
+            # the files of a part change with the cluster, and with them the
+            # query text the result cache is keyed on
+            digest = hashlib.sha256("\n".join(files).encode("utf-8")).hexdigest()
+            view = f"__flydelta_{name}_{i}_{digest[:16]}"
+            query = self._deparse(replace_table(ast, name, view))
+            split_plan = _Plan(
+                query,
+                plan.schema,
+                plan.tables,
+                {view: part},
+                scan,
+                dictionary=dictionary,
+            )
+            if parts and remote[i]:
+                split_plan.location = locations[i]
+                split_plan.part = Part(query, view, name, version, files)
+            plans.append(split_plan)
+        return plans
+
+    def prepare(self, query: str) -> str:
+        """Create a prepared statement and return its handle."""
+        ast = self._parse(query)
+        if select_node(ast) is None:
+            raise ValueError("Only single SELECT statements can be prepared")
+        parameters = parameter_count(ast)
+        tables = self._query_tables(query)
+        conn = self._checkout(tables=tables)
+        try:
+            result = conn.execute(
+                f"SELECT * FROM ({query}) LIMIT 0", [None] * parameters
+            )
+            schema = result.to_arrow_table().schema
         finally:
             self._pool.put(conn)
+        handle = secrets.token_hex(16)
+        statement = _Statement(query, parameters, schema, tables)
+        self._statements.put(handle, statement, 1)
+        return handle
+
+    def _execute_statement(
+        self,
+        handle: str,
+        params: pa.RecordBatch | None,
+        lane: str | None = None,
+        running: _Query | None = None,
+    ) -> _BatchStream:
+        """Execute a prepared statement for each row of the parameters."""
+        statement = self._statements.get(handle)
+        if statement is None:
+            raise ValueError("Unknown or closed prepared statement")
+        if self.statement_ttl:
+            # statements in use don't expire
+            self._statements.put(handle, statement, 1)
+        if statement.parameters and params is None:
+            raise ValueError(f"Statement expects {statement.parameters} parameters")
+        if params is not None and params.num_columns != statement.parameters:
+            raise ValueError(
+                f"Statement expects {statement.parameters} parameters, "
+                f"got {params.num_columns}"
+            )
+
+        conn = self._checkout(lane, running, statement.tables)
+        try:
+            prepared = self._prepared[id(conn)]
+            if handle not in prepared:
+                conn.execute(f"PREPARE flydelta_{handle} AS {statement.query}")
+                prepared.add(handle)
+            rows: list[tuple[Any, ...]] = [()]
+            if params is not None:
+                rows = list(zip(*(c.to_pylist() for c in params.columns)))
+            calls = [
+                (
+                    f"EXECUTE flydelta_{handle}({', '.join(map(sql_literal, row))})"
+                    if row
+                    else f"EXECUTE flydelta_{handle}"
+                )
+                for row in rows
+            ]
+            rows_per_batch = self._fetch_rows(running)
+            if len(calls) == 1:
+                reader = conn.execute(calls[0]).to_arrow_reader(rows_per_batch)
+            else:
+                tables = [conn.execute(call).to_arrow_table() for call in calls]
+                if tables:
+                    table = pa.concat_tables(tables)
+                else:
+                    table = statement.schema.empty_table()
+                reader = table.to_reader(rows_per_batch)
+        except Exception:
+            self._release(conn, running)
+            raise
+        return _BatchStream(reader, lambda: self._release(conn, running))
+
+    def _resolve_ticket(self, ticket: flight.Ticket) -> _Plan | str:
+        """Look up the plan for a ticket, plain SQL tickets are passed through."""
+        if ticket.ticket.startswith(PLAN_PREFIX):
+            plan = self._plans.get(ticket.ticket)
+            if plan is None:
+                raise flight.FlightServerError("Unknown or expired ticket")
+            return plan
+        query: str = ticket.ticket.decode("utf-8")
+        return query
 
     def do_get(
         self, context: flight.ServerCallContext, ticket: flight.Ticket
-    ) -> flight.GeneratorStream:
+    ) -> flight.FlightDataStream:
         """Execute a query and stream results."""
-        query = ticket.ticket.decode("utf-8")
+        start = time.monotonic()
+        self.metrics.requests.inc(method="do_get")
+        span = start_span("flydelta.do_get", self._headers(context))
+        query_id = self._header(context, QUERY_ID_HEADER) or secrets.token_hex(8)
+        running = _Query(query_id, context)
+        with self._queries_lock:
+            self._queries.add(running)
+        instrumented = False
+        dictionary: SharedEncoding | bool = True
+        try:
+            running.batch_bytes = self._batch_bytes(context)
+            if ticket.ticket.startswith(STATEMENT_PREFIX):
+                schema, batches, tables = self._get_statement(context, ticket, running)
+            elif ticket.ticket.startswith(SPOOL_PREFIX):
+                # segments are encoded when the result is spooled
+                schema, batches, tables = self._get_segment(ticket)
+                dictionary = False
+            elif ticket.ticket.startswith(PART_PREFIX):
+                # other parts of the query are streamed by other nodes
+                schema, batches, tables = self._get_part(context, ticket, running)
+                dictionary = False
+            else:
+                plan = self._resolve_ticket(ticket)
+                if isinstance(plan, _Plan):
+                    dictionary = plan.dictionary
+                schema, batches, tables = self._get_query(context, plan, running)
+            batches = self._limit(batches, running)
+            if running.batch_bytes:
+                batches = rebatch(batches, running.batch_bytes)
+            batches = self._instrument(batches, tables, start, span)
+            instrumented = True
+            return self._respond(context, schema, batches, dictionary)
+        except Exception as e:
+            # errors while streaming are accounted by the instrumented stream
+            if not instrumented:
+                self._unregister(running)
+                self.metrics.errors.inc(method="do_get")
+                fail_span(span, e)
+            raise _flight_error(e, running)
+
+    def do_exchange(
+        self,
+        context: flight.ServerCallContext,
+        descriptor: flight.FlightDescriptor,
+        reader: flight.MetadataRecordBatchReader,
+        writer: flight.MetadataRecordBatchWriter,
+    ) -> None:
+        """Look up the rows of a table matching keys streamed by the client."""
+        start = time.monotonic()
+        self.metrics.requests.inc(method="do_exchange")
+        span = start_span("flydelta.do_exchange", self._headers(context))
+        query_id = self._header(context, QUERY_ID_HEADER) or secrets.token_hex(8)
+        running = _Query(query_id, context)
+        with self._queries_lock:
+            self._queries.add(running)
+        stream: _BatchStream | None = None
+        instrumented = False
+        try:
+            if not descriptor.command.startswith(LOOKUP_PREFIX):
+                raise flight.FlightServerError("Unknown exchange")
+            lookup = decode_lookup(descriptor.command)
+            running.batch_bytes = self._batch_bytes(context)
+            keys = reader.read_all()
+            lane = self._header(context, LANE_HEADER)
+            stream = self._lookup(lookup, keys, lane, running)
+            batches: Iterable[pa.RecordBatch] = self._limit(stream, running)
+            if running.batch_bytes:
+                batches = rebatch(batches, running.batch_bytes)
+            compression = self._header(context, COMPRESSION_HEADER) or self.compression
+            level = self.compression_level if compression == self.compression else None
+            writer.begin(stream.schema, options=write_options(compression, level))
+            batches = self._instrument(
+                batches, {lookup.table}, start, span, method="do_exchange"
+            )
+            instrumented = True
+            for batch in batches:
+                writer.write_batch(batch)
+        except Exception as e:
+            if not instrumented:
+                self._unregister(running)
+                self.metrics.errors.inc(method="do_exchange")
+                fail_span(span, e)
+            raise _flight_error(e, running)
+        finally:
+            if stream is not None:
+                stream.close()
+
+    def _unregister(self, running: _Query) -> None:
+        """Stop tracking a query that has finished."""
+        with self._queries_lock:
+            self._queries.discard(running)
+
+    def _limit(
+        self, batches: Iterable[pa.RecordBatch], running: _Query
+    ) -> Generator[pa.RecordBatch, None, None]:
+        """Stop a stream that was interrupted or returns too many rows."""
+        rows = 0
+        try:
+            for batch in batches:
+                if running.reason is not None:
+                    break
+                rows += batch.num_rows
+                if self.max_rows is not None and rows > self.max_rows:
+                    raise flight.FlightServerError(
+                        f"Query {running.id} exceeded the limit of "
+                        f"{self.max_rows} rows"
+                    )
+                yield batch
+        except (duckdb.Error, OSError):
+            # an interrupted query fails in DuckDB
+            if running.reason is None:
+                raise
+        finally:
+            self._unregister(running)
+            close = getattr(batches, "close", None)
+            if close is not None:
+                close()
+        if running.reason is not None:
+            raise flight.FlightCancelledError(f"Query {running.id} {running.reason}")
+
+    def _batch_bytes(self, context: flight.ServerCallContext) -> int | None:
+        """Get the target size of result batches, requested or configured."""
+        value = self._header(context, BATCH_BYTES_HEADER)
+        if value is None:
+            return self.batch_bytes
+        if not value.isdigit():
+            raise ValueError(f"Invalid batch size in bytes: {value}")
+        return int(value)
+
+    def _get_query(
+        self,
+        context: flight.ServerCallContext,
+        plan: _Plan | str,
+        running: _Query | None = None,
+    ) -> tuple[pa.Schema, Iterable[pa.RecordBatch], set[str]]:
+        """Get the result of a planned query or plain SQL ticket."""
+        if isinstance(plan, _Plan):
+            query, tables, views = plan.query, plan.tables, plan.views
+        else:
+            query, views = self._snapshot_views(plan)
+            tables = None
+        key = self._cache_key(query, tables)
+        if key is not None and self._cache is not None:
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached.schema, cached.to_batches(), key.tables
+        lane = self._header(context, LANE_HEADER)
+        stream = self._stream_batches(query, views, lane, running, tables)
+        batches = self._read_ahead(stream)
+        if key is not None and self._cache is not None:
+            batches = self._cache.collect(key, stream.schema, batches)
+        return stream.schema, batches, tables or set()
+
+    def _get_statement(
+        self,
+        context: flight.ServerCallContext,
+        ticket: flight.Ticket,
+        running: _Query | None = None,
+    ) -> tuple[pa.Schema, Iterable[pa.RecordBatch], set[str]]:
+        """Execute a prepared statement with the parameters in the ticket."""
+        handle, params = decode_ticket(ticket.ticket)
+        lane = self._header(context, LANE_HEADER)
+        stream = self._execute_statement(handle, params, lane, running)
+        return stream.schema, self._read_ahead(stream), set()
+
+    def _get_part(
+        self,
+        context: flight.ServerCallContext,
+        ticket: flight.Ticket,
+        running: _Query | None = None,
+    ) -> tuple[pa.Schema, Iterable[pa.RecordBatch], set[str]]:
+        """Execute part of a query planned by another node of the cluster.
+
+        The files of the part are looked up in the same table version the
+        query was planned on.
+        """
+        part = decode_part(ticket.ticket)
+        if part.table not in self.tables:
+            raise ValueError(f"Unknown table: {part.table}")
+        if part.table not in self._versions:
+            raise NotReadyError(self._not_ready(part.table))
+        _, dataset = self._snapshot(part.table, part.version)
+        files = set(part.files)
+        fragments = [f for f in dataset.get_fragments() if f.path in files]
+        if len(fragments) != len(files):
+            raise ValueError(
+                f"Files of {part.table} version {part.version} are missing"
+            )
+        view = ds.FileSystemDataset(
+            fragments,
+            schema=dataset.schema,
+            format=dataset.format,
+            filesystem=dataset.filesystem,
+        )
+        lane = self._header(context, LANE_HEADER)
+        stream = self._stream_batches(part.query, {part.view: view}, lane, running)
+        return stream.schema, self._read_ahead(stream), {part.table}
+
+    def _lookup(
+        self,
+        lookup: Lookup,
+        keys: pa.Table,
+        lane: str | None = None,
+        running: _Query | None = None,
+    ) -> _BatchStream:
+        """Join the rows of a table against a table of keys.
+
+        Files whose statistics rule out all keys are left out of the join.
+        """
+        name = lookup.table
+        on = lookup.on or keys.column_names
+        if name not in self.tables:
+            raise ValueError(f"Unknown table: {name}")
+        if name not in self._versions:
+            raise NotReadyError(self._not_ready(name))
+        schema = self._schemas[name]
+        missing = [c for c in on if c not in schema.names or c not in keys.column_names]
+        if missing:
+            raise ValueError(f"Unknown key columns: {', '.join(missing)}")
+
+        data: pa.Table | ds.Dataset
+        if name in self._pinned:
+            data = self._pinned[name]
+        else:
+            data, _ = self._prune(name, lookup_predicates(keys, on))
+        view = f"__flydelta_{name}_lookup"
+        select = ", ".join(f"t.{sql_identifier(c)}" for c in lookup.columns or [])
+        condition = " AND ".join(
+            f"t.{sql_identifier(c)} = k.{sql_identifier(c)}" for c in on
+        )
+        query = (
+            f"SELECT {select or 't.*'} FROM {sql_identifier(view)} AS t "
+            f"SEMI JOIN {LOOKUP_KEYS} AS k ON {condition}"
+        )
+        views = {view: data, LOOKUP_KEYS: keys.select(on)}
+        return self._stream_batches(query, views, lane, running)
+
+    def _get_segment(
+        self, ticket: flight.Ticket
+    ) -> tuple[pa.Schema, Iterable[pa.RecordBatch], set[str]]:
+        """Read a segment of a spooled result."""
+        spool_id, index = decode_spool_ticket(ticket.ticket)
+        if self._spools is None:
+            raise flight.FlightServerError("Unknown or expired ticket")
+        try:
+            reader = self._spools.read(spool_id, index)
+        except KeyError:
+            raise flight.FlightServerError("Unknown or expired ticket")
+        return reader.schema, reader, set()
+
+    def _spool(self, context: flight.ServerCallContext, plans: list[_Plan]) -> Spool:
+        """Run planned queries once and write their results into a spool."""
+        if self._spools is None:
+            raise ValueError("Spooling is not enabled on this server")
+        query_id = self._header(context, QUERY_ID_HEADER) or secrets.token_hex(8)
+        running = _Query(query_id, context)
+        with self._queries_lock:
+            self._queries.add(running)
+        lane = self._header(context, LANE_HEADER)
+
+        def batches() -> Generator[pa.RecordBatch, None, None]:
+            for part in plans:
+                stream = self._stream_batches(
+                    part.query, part.views, lane, running, part.tables
+                )
+                try:
+                    yield from stream
+                finally:
+                    stream.close()
+
+        try:
+            schema = plans[0].schema
+            spooled: Iterable[pa.RecordBatch] = self._limit(batches(), running)
+            if self.dictionary_ratio > 0:
+                # encoded once for all segments, which are served as written
+                spooled = iter(spooled)
+                first = next(spooled, None)
+                if first is not None:
+                    schema, encode = dictionary_encoder(first, self.dictionary_ratio)
+                    spooled = map(encode, itertools.chain([first], spooled))
+            return self._spools.write(schema, spooled)
+        finally:
+            self._unregister(running)
+
+    def _read_ahead(self, stream: _BatchStream) -> Iterable[pa.RecordBatch]:
+        """Run a query stream on a producer thread if prefetching is enabled."""
+        if self.prefetch <= 0:
+            return stream
+        return PrefetchStream(
+            stream,
+            stream.schema,
+            self.prefetch,
+            spill_after=self.spill_after,
+            spill_dir=self.spill_dir,
+            on_spill=self.metrics.spills.inc,
+        )
+
+    def _instrument(
+        self,
+        batches: Iterable[pa.RecordBatch],
+        tables: set[str],
+        start: float,
+        span: Any,
+        method: str = "do_get",
+    ) -> Generator[pa.RecordBatch, None, None]:
+        """Count the rows, batches and bytes of a stream and time its phases."""
+        labels = sorted(tables) or [""]
+        rows = 0
+        error: Exception | None = None
+        self.metrics.streams.inc()
         try:
-            schema = self._get_schema(query)
-            return flight.GeneratorStream(schema, self._stream_batches(query))
+            for i, batch in enumerate(batches):
+                if i == 0:
+                    self.metrics.first_batch.observe(time.monotonic() - start)
+                rows += batch.num_rows
+                for table in labels:
+                    self.metrics.rows.inc(batch.num_rows, table=table)
+                    self.metrics.batches.inc(table=table)
+                    self.metrics.bytes.inc(batch.nbytes, table=table)
+                yield batch
         except Exception as e:
-            raise flight.FlightServerError(f"Query error: {e}")
+            error = e
+            raise
+        finally:
+            self.metrics.streams.dec()
+            self.metrics.stream.observe(time.monotonic() - start)
+            span.set_attribute("flydelta.rows", rows)
+            if error is None:
+                span.end()
+            else:
+                self.metrics.errors.inc(method=method)
+                fail_span(span, error)
+
+    def _headers(self, context: flight.ServerCallContext) -> dict[str, list[str]]:
+        """Get all request headers of the current call."""
+        headers = context.get_middleware("headers")
+        return headers.headers if headers is not None else {}
+
+    def _header(self, context: flight.ServerCallContext, name: str) -> str | None:
+        """Get a request header of the current call."""
+        headers = context.get_middleware("headers")
+        return headers.get(name) if headers is not None else None
+
+    def _respond(
+        self,
+        context: flight.ServerCallContext,
+        schema: pa.Schema,
+        batches: Iterable[pa.RecordBatch],
+        dictionary: SharedEncoding | bool = True,
+    ) -> flight.RecordBatchStream:
+        """Wrap result batches into a stream with the configured IPC options.
+
+        The first batch decides whether compression is worth it and which
+        string columns are dictionary encoded, unless the encoding is shared
+        with the other endpoints of the query.
+        """
+        compression = self._header(context, COMPRESSION_HEADER) or self.compression
+        if dictionary is True and self.dictionary_ratio > 0:
+            dictionary = SharedEncoding(self.dictionary_ratio)
+
+        batches = iter(batches)
+        first = next(batches, None)
+        if first is None:
+            if isinstance(dictionary, SharedEncoding):
+                empty = pa.RecordBatch.from_pylist([], schema=schema)
+                schema, _ = dictionary.pick(empty)
+            return flight.RecordBatchStream(schema.empty_table())
+        batches = itertools.chain([first], batches)
+        if first.nbytes < self.compression_threshold:
+            compression = None
+        level = self.compression_level if compression == self.compression else None
+        options = write_options(compression, level)
+
+        if isinstance(dictionary, SharedEncoding):
+            schema, encode = dictionary.pick(first)
+            batches = map(encode, batches)
+        reader = pa.RecordBatchReader.from_batches(schema, batches)
+        return flight.RecordBatchStream(reader, options=options)
 
     def get_flight_info(
         self,
         context: flight.ServerCallContext,
         descriptor: flight.FlightDescriptor,
     ) -> flight.FlightInfo:
-        """Get information about a query."""
+        """Plan a query and return tickets referring to the plan.
+
+        Simple scans over a table are split into several endpoints that can
+        be fetched in parallel if `max_endpoints` is greater than 1.
+
+        With the spool header, the query runs right away into segment files
+        and every segment is an endpoint, which clients may fetch again
+        until it expires.
+        """
         query = descriptor.command.decode("utf-8")
+        self.metrics.requests.inc(method="get_flight_info")
+        span = start_span("flydelta.get_flight_info", self._headers(context))
 
+        spool = None
         try:
-            schema = self._get_schema(query)
+            plan = self._plan(query)
+            plans = self._split_plan(plan)
+            if self._header(context, SPOOL_HEADER) is not None:
+                spool = self._spool(context, plans)
         except Exception as e:
-            raise flight.FlightServerError(f"Query error: {e}")
+            self.metrics.errors.inc(method="get_flight_info")
+            fail_span(span, e)
+            raise _flight_error(e)
+        span.set_attribute("flydelta.endpoints", len(plans))
+        span.end()
+
+        scan = plans[0].scan or {}
+        if spool is not None:
+            return flight.FlightInfo(
+                schema=spool.schema,
+                descriptor=descriptor,
+                endpoints=self._spool_endpoints(spool),
+                total_records=spool.rows,
+                total_bytes=spool.nbytes,
+                app_metadata=json.dumps(scan).encode("utf-8"),
+            )
 
-        ticket = flight.Ticket(query.encode("utf-8"))
-        endpoints = [flight.FlightEndpoint(ticket, [self.location])]
+        endpoints = []
+        for part in plans:
+            if part.part is not None:
+                # this node can execute the part too if its owner is down
+                ticket = flight.Ticket(encode_part(part.part))
+                locations = [part.location, self.location]
+            else:
+                handle = PLAN_PREFIX + secrets.token_hex(16).encode("ascii")
+                self._plans.put(handle, part, part.nbytes)
+                ticket = flight.Ticket(handle)
+                locations = [self.location]
+            endpoints.append(flight.FlightEndpoint(ticket, locations))
 
         return flight.FlightInfo(
-            schema=schema,
+            schema=plan.schema,
             descriptor=descriptor,
             endpoints=endpoints,
             total_records=-1,
             total_bytes=-1,
+            app_metadata=json.dumps(scan).encode("utf-8"),
         )
 
+    def _spool_endpoints(self, spool: Spool) -> list[flight.FlightEndpoint]:
+        """Get endpoints reading the segments of a spool.
+
+        The expiration time tells clients that a segment can be requested
+        again, e.g. to resume after a connection error.
+        """
+        expires = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+            seconds=self.spool_ttl
+        )
+        expiration = pa.scalar(expires, type=pa.timestamp("us", tz="UTC"))
+        return [
+            flight.FlightEndpoint(
+                flight.Ticket(spool.ticket(i)),
+                [self.location],
+                expiration_time=expiration,
+            )
+            for i in range(len(spool.segments))
+        ]
+
     def list_flights(self, context: flight.ServerCallContext, criteria: bytes) -> Any:
         """List available tables."""
-        for name, schema in self._schemas.items():
+        for name, schema in list(self._schemas.items()):
             descriptor = flight.FlightDescriptor.for_path(name)
             yield flight.FlightInfo(
                 schema=schema,
@@ -128,21 +1850,82 @@ class Server(flight.FlightServerBase):
                 total_bytes=-1,
             )
 
+    def list_actions(self, context: flight.ServerCallContext) -> list[tuple[str, str]]:
+        """List available actions."""
+        return [
+            ("cache_stats", "Result cache hit/miss counters"),
+            ("pool_stats", "Connection pool usage and wait times per lane"),
+            ("scan_stats", "Files scanned and skipped by pruning"),
+            ("refresh", "Load new versions of all tables or the given table"),
+            ("versions", "Versions of the tables a query reads, if cacheable"),
+            ("create_prepared_statement", "Prepare a SELECT statement"),
+            ("close_prepared_statement", "Close a prepared statement"),
+            ("cancel", "Cancel running queries with the given id"),
+            ("health", "Readiness and table loading state"),
+        ]
+
+    def do_action(
+        self, context: flight.ServerCallContext, action: flight.Action
+    ) -> Generator[flight.Result, None, None]:
+        """Execute an action."""
+        if action.type == "cache_stats":
+            stats = self._cache.stats() if self._cache is not None else {}
+            yield flight.Result(json.dumps(stats).encode("utf-8"))
+        elif action.type == "pool_stats":
+            yield flight.Result(json.dumps(self._pool.stats()).encode("utf-8"))
+        elif action.type == "scan_stats":
+            with self._scan_stats_lock:
+                stats = dict(self._scan_stats)
+            yield flight.Result(json.dumps(stats).encode("utf-8"))
+        elif action.type == "versions":
+            query = action.body.to_pybytes().decode("utf-8")
+            versions = self._cacheable_versions(query)
+            yield flight.Result(json.dumps({"versions": versions}).encode("utf-8"))
+        elif action.type == "create_prepared_statement":
+            query = action.body.to_pybytes().decode("utf-8")
+            try:
+                handle = self.prepare(query)
+            except Exception as e:
+                raise _flight_error(e)
+            statement = self._statements.peek(handle)
+            if statement is None:
+                raise flight.FlightServerError("Prepared statement was evicted")
+            schema = base64.b64encode(statement.schema.serialize().to_pybytes())
+            result = {
+                "handle": handle,
+                "parameters": statement.parameters,
+                "schema": schema.decode("ascii"),
+            }
+            yield flight.Result(json.dumps(result).encode("utf-8"))
+        elif action.type == "close_prepared_statement":
+            handle = action.body.to_pybytes().decode("utf-8")
+            self._statements.pop(handle)
+        elif action.type == "cancel":
+            query_id = action.body.to_pybytes().decode("utf-8")
+            cancelled = self.cancel(query_id)
+            yield flight.Result(json.dumps({"cancelled": cancelled}).encode("utf-8"))
+        elif action.type == "health":
+            yield flight.Result(json.dumps(self.health()).encode("utf-8"))
+        elif action.type == "refresh":
+            name = action.body.to_pybytes().decode("utf-8") or None
+            try:
+                versions = self.refresh(name)
+            except KeyError:
+                raise flight.FlightServerError(f"Unknown table: {name}")
+            except NotReadyError as e:
+                raise flight.FlightUnavailableError(str(e))
+            yield flight.Result(json.dumps(versions).encode("utf-8"))
+        else:
+            raise flight.FlightServerError(f"Unknown action: {action.type}")
+
+
+def serve(host: str = "0.0.0.0", port: int = 8815, **options: Any) -> None:
+    """Start the flydelta server.
 
-def serve(
-    host: str = "0.0.0.0",
-    port: int = 8815,
-    tables: dict[str, str] | None = None,
-    pool_size: int = 10,
-    batch_size: int = 100_000,
-) -> None:
-    """Start the flydelta server."""
+    Other options are passed on to `Server`, metrics are served on `host`.
+    """
     location = f"grpc://{host}:{port}"
-    server = Server(
-        location=location,
-        tables=tables,
-        pool_size=pool_size,
-        batch_size=batch_size,
-    )
-    print(f"Starting flydelta on {location}")
+    options.setdefault("metrics_host", host)
+    server = Server(location=location, **options)
+    log.info("Starting flydelta on %s", location)
     server.serve()
@@ -0,0 +1,190 @@
+"""Query results spooled to local Arrow IPC segment files.
+
+A spooled result is computed once and then served segment by segment, so
+clients can fetch segments in parallel or fetch a segment again after a
+connection error without running the query again.
+"""
+
+import os
+import secrets
+from dataclasses import dataclass, field
+from typing import Iterable
+
+import pyarrow as pa
+
+from flydelta.cache import LRUCache
+from flydelta.files import remove_file
+
+# Tickets reading one segment of a spool: prefix, spool id, segment index
+SPOOL_PREFIX = b"spool:"
+# Header asking get_flight_info to spool the result
+SPOOL_HEADER = "x-flydelta-spool"
+SEGMENT_SUFFIX = ".arrows"
+
+
+class SpoolFullError(Exception):
+    """A result doesn't fit into the disk budget of the spool directory."""
+
+
+@dataclass
+class Segment:
+    """An Arrow IPC stream file holding part of a spooled result."""
+
+    path: str
+    rows: int = 0
+    nbytes: int = 0
+
+
+@dataclass
+class Spool:
+    """A query result written to segment files."""
+
+    id: str
+    schema: pa.Schema
+    segments: list[Segment] = field(default_factory=list)
+
+    @property
+    def rows(self) -> int:
+        return sum(segment.rows for segment in self.segments)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(segment.nbytes for segment in self.segments)
+
+    def ticket(self, index: int) -> bytes:
+        """Build the ticket reading the segment at `index`."""
+        return SPOOL_PREFIX + f"{self.id}:{index}".encode("ascii")
+
+    def remove(self) -> None:
+        for segment in self.segments:
+            remove_file(segment.path)
+
+
+def decode_ticket(ticket: bytes) -> tuple[str, int]:
+    """Get the spool id and segment index from a ticket."""
+    spool_id, _, index = ticket[len(SPOOL_PREFIX) :].decode("ascii").partition(":")
+    if not index.isdigit():
+        raise ValueError("Invalid spool ticket")
+    return spool_id, int(index)
+
+
+class SpoolStore(LRUCache[str, Spool]):
+    """Spooled results in a local directory, bounded by their total size.
+
+    Spools are deleted once they are older than `ttl` seconds or evicted to
+    make room for new ones. Segments left in the directory by an earlier run
+    can't be referenced anymore and are removed on startup.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        ttl: float | None = None,
+        segment_bytes: int = 64 * 1024 * 1024,
+    ):
+        super().__init__(max_bytes, ttl=ttl)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith(SEGMENT_SUFFIX):
+                remove_file(entry.path)
+
+    def _remove(self, key: str) -> None:
+        spool = self._entries[key].value
+        super()._remove(key)
+        spool.remove()
+
+    def expire(self) -> None:
+        """Delete spools whose time to live has passed."""
+        for key in self.keys():
+            self.peek(key)
+
+    def write(self, schema: pa.Schema, batches: Iterable[pa.RecordBatch]) -> Spool:
+        """Write a result into segments of about `segment_bytes` each.
+
+        Spools being written count towards the budget as they grow, so
+        concurrent results can't exceed it together. Raises SpoolFullError
+        as soon as the result doesn't fit anymore.
+        """
+        self.expire()
+        spool = Spool(secrets.token_hex(16), schema)
+        reserved = 0
+        try:
+            sink, writer = self._open(spool)
+            try:
+                for batch in batches:
+                    if sink.tell() >= self.segment_bytes:
+                        self._finish(spool, writer, sink)
+                        sink, writer = self._open(spool)
+                    writer.write_batch(batch)
+                    segment = spool.segments[-1]
+                    segment.rows += batch.num_rows
+                    segment.nbytes = sink.tell()
+                    reserved = self._reserve(spool.nbytes, reserved)
+                self._finish(spool, writer, sink)
+            finally:
+                sink.close()
+            reserved = self._reserve(spool.nbytes, reserved)
+        except BaseException:
+            self._release(reserved)
+            spool.remove()
+            raise
+        with self._lock:
+            # the reserved bytes become the size of the stored spool
+            self._nbytes -= reserved
+            self._insert(spool.id, spool, reserved)
+        return spool
+
+    def _reserve(self, nbytes: int, reserved: int) -> int:
+        """Grow the bytes reserved by a spool being written to `nbytes`.
+
+        Stored spools are evicted to make room, SpoolFullError is raised if
+        the spools being written alone exceed the budget.
+        """
+        with self._lock:
+            self._evict(nbytes - reserved)
+            if self._nbytes + nbytes - reserved > self.max_bytes:
+                raise self._full()
+            self._nbytes += nbytes - reserved
+        return nbytes
+
+    def _release(self, reserved: int) -> None:
+        with self._lock:
+            self._nbytes -= reserved
+
+    def _open(
+        self, spool: Spool
+    ) -> tuple[pa.NativeFile, pa.ipc.RecordBatchStreamWriter]:
+        """Start the next segment file of a spool."""
+        name = f"{spool.id}-{len(spool.segments)}{SEGMENT_SUFFIX}"
+        segment = Segment(os.path.join(self.directory, name))
+        spool.segments.append(segment)
+        sink = pa.OSFile(segment.path, "wb")
+        return sink, pa.ipc.new_stream(sink, spool.schema)
+
+    @staticmethod
+    def _finish(
+        spool: Spool, writer: pa.ipc.RecordBatchStreamWriter, sink: pa.NativeFile
+    ) -> None:
+        """Close the current segment file of a spool."""
+        writer.close()
+        spool.segments[-1].nbytes = sink.tell()
+        sink.close()
+
+    def _full(self) -> SpoolFullError:
+        return SpoolFullError(
+            f"Spooled results exceed the spool size of {self.max_bytes} bytes"
+        )
+
+    def read(self, spool_id: str, index: int) -> pa.ipc.RecordBatchStreamReader:
+        """Open a segment of a spool, KeyError if it is unknown or expired."""
+        spool = self.get(spool_id)
+        if spool is None or not 0 <= index < len(spool.segments):
+            raise KeyError(spool_id)
+        try:
+            return pa.ipc.open_stream(pa.memory_map(spool.segments[index].path))
+        except FileNotFoundError:
+            # evicted right after the lookup
+            raise KeyError(spool_id)
@@ -0,0 +1,81 @@
+"""Prepared statement tickets and parameter binding."""
+
+import datetime
+import decimal
+import math
+from typing import Any, Sequence
+
+import pyarrow as pa
+
+# Tickets executing a prepared statement: prefix, handle, IPC parameter stream
+STATEMENT_PREFIX = b"stmt:"
+HANDLE_LENGTH = 32
+
+
+def params_batch(rows: Sequence[Sequence[Any]]) -> pa.RecordBatch:
+    """Build a parameter batch with one column per parameter from rows."""
+    columns = list(zip(*rows))
+    return pa.record_batch(
+        [pa.array(column) for column in columns],
+        names=[f"p{i + 1}" for i in range(len(columns))],
+    )
+
+
+def encode_ticket(handle: str, params: pa.RecordBatch | None = None) -> bytes:
+    """Build the ticket executing a statement with the given parameters."""
+    ticket = STATEMENT_PREFIX + handle.encode("ascii")
+    if params is not None:
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, params.schema) as writer:
+            writer.write_batch(params)
+        ticket += sink.getvalue().to_pybytes()
+    return ticket
+
+
+def decode_ticket(ticket: bytes) -> tuple[str, pa.RecordBatch | None]:
+    """Get the statement handle and parameters from a ticket."""
+    start = len(STATEMENT_PREFIX)
+    handle = ticket[start : start + HANDLE_LENGTH].decode("ascii")
+    data = ticket[start + HANDLE_LENGTH :]
+    if not data:
+        return handle, None
+    table = pa.ipc.open_stream(data).read_all().combine_chunks()
+    batches = table.to_batches()
+    if not batches:
+        return handle, pa.RecordBatch.from_pylist([], schema=table.schema)
+    return handle, batches[0]
+
+
+def sql_literal(value: Any) -> str:
+    """Render a Python value as a DuckDB SQL literal."""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        if math.isnan(value) or math.isinf(value):
+            return f"'{value}'::DOUBLE"
+        return repr(value)
+    if isinstance(value, decimal.Decimal):
+        if not value.is_finite():
+            raise ValueError(f"Unsupported decimal parameter: {value}")
+        return str(value)
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, bytes):
+        return f"from_hex('{value.hex()}')"
+    if isinstance(value, datetime.datetime):
+        kind = "TIMESTAMPTZ" if value.tzinfo is not None else "TIMESTAMP"
+        return f"{kind} '{value.isoformat()}'"
+    if isinstance(value, datetime.date):
+        return f"DATE '{value.isoformat()}'"
+    if isinstance(value, datetime.time):
+        return f"TIME '{value.isoformat()}'"
+    raise TypeError(f"Unsupported parameter type: {type(value).__name__}")
+
+
+def sql_identifier(name: str) -> str:
+    """Quote a column or relation name for DuckDB."""
+    return '"' + name.replace('"', '""') + '"'
@@ -0,0 +1,60 @@
+"""Optional OpenTelemetry tracing, propagated through Flight request headers.
+
+Without `opentelemetry-api` installed all functions here do nothing. Spans
+are exported by whatever tracer provider the application configures, e.g.
+an OTLP exporter set up by `opentelemetry-instrument`.
+"""
+
+from typing import Any
+
+try:
+    from opentelemetry import propagate, trace
+    from opentelemetry.trace import Status, StatusCode
+
+    TRACING_AVAILABLE = True
+except ImportError:
+    TRACING_AVAILABLE = False
+
+
+class _NoopSpan:
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def record_exception(self, exception: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+def start_span(
+    name: str, headers: dict[str, list[str]] | None = None, **attributes: Any
+) -> Any:
+    """Start a span continuing the trace context of the request headers.
+
+    The span has to be ended explicitly, so it can outlive the handler that
+    returns a result stream.
+    """
+    if not TRACING_AVAILABLE:
+        return _NoopSpan()
+    carrier = {key: values[0] for key, values in (headers or {}).items() if values}
+    context = propagate.extract(carrier)
+    tracer = trace.get_tracer("flydelta")
+    return tracer.start_span(name, context=context, attributes=attributes)
+
+
+def fail_span(span: Any, exception: BaseException) -> None:
+    """Record an exception on a span and end it."""
+    span.record_exception(exception)
+    if TRACING_AVAILABLE:
+        span.set_status(Status(StatusCode.ERROR, str(exception)))
+    span.end()
+
+
+def trace_headers() -> list[tuple[bytes, bytes]]:
+    """Get the headers propagating the current trace context of the client."""
+    if not TRACING_AVAILABLE:
+        return []
+    carrier: dict[str, str] = {}
+    propagate.inject(carrier)
+    return [(key.encode(), value.encode()) for key, value in carrier.items()]
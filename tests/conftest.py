@@ -1,12 +1,11 @@
 import tempfile
-import threading
-import time
 
 import pyarrow as pa
 import pytest
 from deltalake import write_deltalake
 
-from flydelta import Client, Server
+from benchmarks.utils import running_server, start_server
+from flydelta import Client
 
 
 @pytest.fixture
@@ -42,38 +41,18 @@ def large_delta_table_path():
 @pytest.fixture
 def server(delta_table_path):
     """Start a server with a test table named 'users'."""
-    location = "grpc://127.0.0.1:18815"
-    server = Server(
-        location=location,
-        tables={"users": delta_table_path},
-    )
-
-    thread = threading.Thread(target=server.serve, daemon=True)
-    thread.start()
-    time.sleep(0.5)
-
-    yield location
-
-    server.shutdown()
+    with running_server(tables={"users": delta_table_path}) as location:
+        yield location
 
 
 @pytest.fixture
 def server_with_large_table(large_delta_table_path):
     """Start a server with a larger table for streaming tests."""
-    location = "grpc://127.0.0.1:18816"
-    server = Server(
-        location=location,
+    with running_server(
         tables={"large_table": large_delta_table_path},
         batch_size=1000,
-    )
-
-    thread = threading.Thread(target=server.serve, daemon=True)
-    thread.start()
-    time.sleep(0.5)
-
-    yield location
-
-    server.shutdown()
+    ) as location:
+        yield location
 
 
 @pytest.fixture
@@ -81,3 +60,57 @@ def client(server):
     """Create a client connected to the test server."""
     with Client(server) as client:
         yield client
+
+
+@pytest.fixture
+def server_with_cache(delta_table_path):
+    """Start a server with the result cache enabled."""
+    with running_server(
+        tables={"users": delta_table_path},
+        cache_size=10 * 1024 * 1024,
+    ) as location:
+        yield location
+
+
+@pytest.fixture
+def partitioned_delta_table_path():
+    """Create a partitioned Delta Lake table spread over several files."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for i in range(4):
+            table = pa.table(
+                {
+                    "id": list(range(i * 1000, (i + 1) * 1000)),
+                    "part": [f"p{j % 4}" for j in range(1000)],
+                }
+            )
+            write_deltalake(tmpdir, table, partition_by=["part"], mode="append")
+        yield tmpdir
+
+
+@pytest.fixture
+def server_with_endpoints(partitioned_delta_table_path):
+    """Start a server that splits table scans into several endpoints."""
+    with running_server(
+        tables={"events": partitioned_delta_table_path},
+        max_endpoints=4,
+    ) as location:
+        yield location
+
+
+@pytest.fixture
+def make_server():
+    """Start servers on free ports and shut them down after the test.
+
+    Yields a function taking the `Server` arguments, which returns the server
+    once its tables are loaded.
+    """
+    servers = []
+
+    def make(**kwargs):
+        server = start_server(**kwargs)
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.shutdown()
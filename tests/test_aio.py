@@ -0,0 +1,43 @@
+import asyncio
+
+import pyarrow.flight as flight
+import pytest
+
+from flydelta import AsyncClient
+
+
+def test_async_client_query(server):
+    """Test queries run concurrently without blocking the event loop."""
+
+    async def main():
+        async with AsyncClient(server, workers=4) as client:
+            results = await asyncio.gather(
+                *(client.query(f"SELECT * FROM users WHERE id > {i}") for i in range(4))
+            )
+            tables = await client.list_tables()
+            with pytest.raises(flight.FlightServerError):
+                await client.query("SELECT * FROM missing")
+        return [result.num_rows for result in results], tables
+
+    rows, tables = asyncio.run(main())
+    assert rows == [5, 4, 3, 2]
+    assert tables == ["users"]
+
+
+def test_async_client_stream_query(server_with_large_table):
+    """Test batches are iterated with async for and streams stop early."""
+
+    async def main():
+        async with AsyncClient(server_with_large_table, workers=2) as client:
+            rows = 0
+            async for batch in client.stream_query("SELECT * FROM large_table"):
+                rows += batch.num_rows
+            stream = client.stream_query("SELECT * FROM large_table")
+            await stream.__anext__()
+            await stream.aclose()
+            health = await client.health()
+        return rows, health
+
+    rows, health = asyncio.run(main())
+    assert rows == 10000
+    assert health["ready"]
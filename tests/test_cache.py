@@ -0,0 +1,61 @@
+import time
+
+import pyarrow as pa
+
+from flydelta.cache import LRUCache, ResultCache, ResultKey, normalize_sql
+
+
+def test_normalize_sql():
+    """Test whitespace is collapsed outside of string literals only."""
+    assert normalize_sql("  SELECT *\n  FROM users ; ") == "SELECT * FROM users"
+    assert normalize_sql("SELECT 'a  b'") == "SELECT 'a  b'"
+    assert normalize_sql("SELECT 'a  b'") != normalize_sql("SELECT 'a b'")
+
+
+def test_lru_cache_evicts_least_recently_used():
+    """Test entries are evicted in LRU order when over budget."""
+    cache: LRUCache[str, str] = LRUCache(max_bytes=10)
+    cache.put("a", "a", 4)
+    cache.put("b", "b", 4)
+    cache.get("a")
+    cache.put("c", "c", 4)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert cache.evictions == 1
+    assert cache.nbytes == 8
+    assert not cache.put("d", "d", 11)
+
+
+def test_lru_cache_ttl():
+    """Test entries expire after the ttl."""
+    cache: LRUCache[str, str] = LRUCache(max_bytes=10, ttl=0.01)
+    cache.put("a", "a", 1)
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+    assert cache.misses == 1
+
+
+def test_result_cache_collect_and_invalidate():
+    """Test results are cached after streaming and dropped per table."""
+    cache = ResultCache(max_bytes=1024 * 1024)
+    batch = pa.record_batch({"id": [1, 2, 3]})
+    key = ResultKey("SELECT * FROM users", (("users", 0),))
+
+    assert list(cache.collect(key, batch.schema, [batch, batch])) == [batch, batch]
+    assert cache.get(key).num_rows == 6
+
+    assert cache.invalidate("orders") == 0
+    assert cache.invalidate("users") == 1
+    assert key not in cache
+
+
+def test_result_cache_skips_oversized_results():
+    """Test results over the budget are streamed but not cached."""
+    batch = pa.record_batch({"id": list(range(100))})
+    cache = ResultCache(max_bytes=batch.nbytes)
+    key = ResultKey("SELECT * FROM t")
+
+    assert len(list(cache.collect(key, batch.schema, [batch, batch]))) == 2
+    assert key not in cache
@@ -1,11 +1,20 @@
+import inspect
+
+import pytest
 from typer.testing import CliRunner
 
 from flydelta import __version__
 from flydelta.cli import cli
+from flydelta.server import Server
 
 runner = CliRunner(env={"NO_COLOR": "1"})
 
 
+def port_of(location):
+    """Get the port of a server location as given to the CLI."""
+    return location.rsplit(":", 1)[1]
+
+
 def test_cli_version():
     """Test --version flag shows version."""
     result = runner.invoke(cli, ["--version"])
@@ -73,7 +82,7 @@ def test_cli_query_with_server(server):
             "-h",
             "127.0.0.1",
             "-p",
-            "18815",
+            port_of(server),
         ],
     )
 
@@ -92,7 +101,7 @@ def test_cli_query_json_output(server):
             "-h",
             "127.0.0.1",
             "-p",
-            "18815",
+            port_of(server),
             "-o",
             "json",
         ],
@@ -113,7 +122,7 @@ def test_cli_query_csv_output(server):
             "-h",
             "127.0.0.1",
             "-p",
-            "18815",
+            port_of(server),
             "-o",
             "csv",
         ],
@@ -134,7 +143,7 @@ def test_cli_query_invalid_output_format(server):
             "-h",
             "127.0.0.1",
             "-p",
-            "18815",
+            port_of(server),
             "-o",
             "invalid",
         ],
@@ -148,8 +157,92 @@ def test_cli_tables_with_server(server):
     """Test tables command against running server."""
     result = runner.invoke(
         cli,
-        ["tables", "-h", "127.0.0.1", "-p", "18815"],
+        ["tables", "-h", "127.0.0.1", "-p", port_of(server)],
     )
 
     assert result.exit_code == 0
     assert "users" in result.output
+
+
+def test_cli_serve_invalid_pool_lane_format():
+    """Test serve with invalid pool lane format."""
+    result = runner.invoke(cli, ["serve", "--pool-lane", "bulk"])
+
+    assert result.exit_code == 1
+    assert "Invalid pool lane format" in result.output
+
+
+@pytest.fixture
+def server_options(monkeypatch):
+    """Capture the options the serve command starts a server with."""
+    options = {}
+
+    class FakeServer:
+        def __init__(self, **kwargs):
+            options.update(kwargs)
+
+        def serve(self):
+            pass
+
+    monkeypatch.setattr("flydelta.server.Server", FakeServer)
+    return options
+
+
+def test_cli_serve_options(server_options):
+    """Test serve passes its options on to the server in bytes."""
+    result = runner.invoke(
+        cli,
+        ["serve", "-h", "127.0.0.1", "-p", "9000", "-t", "users=/data/users:pin"]
+        + ["--cache-size", "2", "--pool-lane", "bulk=4", "--peer", "grpc://b:1"],
+    )
+
+    assert result.exit_code == 0
+    inspect.signature(Server).bind(**server_options)
+    assert server_options["location"] == "grpc://127.0.0.1:9000"
+    assert server_options["metrics_host"] == "127.0.0.1"
+    assert server_options["tables"] == {"users": "/data/users"}
+    assert server_options["pinned"] == ["users"]
+    assert server_options["cache_size"] == 2 * 1024 * 1024
+    assert server_options["pool_lanes"] == {"bulk": 4}
+    assert server_options["peers"] == ["grpc://b:1"]
+    assert server_options["pool_idle_timeout"] == 300
+    assert server_options["statement_ttl"] == 3600
+
+
+def test_cli_serve_pool_idle_timeout_disabled(server_options):
+    """Test a pool idle timeout of 0 keeps idle connections open."""
+    result = runner.invoke(cli, ["serve", "--pool-idle-timeout", "0"])
+
+    assert result.exit_code == 0
+    assert server_options["pool_idle_timeout"] is None
+
+
+def test_cli_serve_statement_ttl_disabled(server_options):
+    """Test a statement ttl of 0 keeps unused prepared statements."""
+    result = runner.invoke(cli, ["serve", "--statement-ttl", "0"])
+
+    assert result.exit_code == 0
+    assert server_options["statement_ttl"] is None
+
+
+def test_cli_query_out_file(server, tmp_path):
+    """Test query command streaming into a file."""
+    path = str(tmp_path / "users.ndjson")
+    result = runner.invoke(
+        cli,
+        ["query", "SELECT * FROM users", "-h", "127.0.0.1", "-p", port_of(server)]
+        + ["--out", path],
+    )
+
+    assert result.exit_code == 0
+    assert "Wrote 5 rows" in result.output
+    with open(path) as f:
+        assert len(f.readlines()) == 5
+
+
+def test_cli_query_unknown_output_format():
+    """Test query command with an unknown output format."""
+    result = runner.invoke(cli, ["query", "SELECT 1", "-o", "xlsx"])
+
+    assert result.exit_code == 1
+    assert "Unknown output format" in result.output
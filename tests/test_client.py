@@ -1,4 +1,14 @@
+import subprocess
+import sys
+import textwrap
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import pyarrow as pa
+import pyarrow.flight as flight
+import pyarrow.parquet as pq
+import pytest
+from deltalake import write_deltalake
 
 from flydelta import Client
 
@@ -78,3 +88,192 @@ def test_client_ordering(client):
 
     assert df.iloc[0]["value"] == 50.0
     assert df.iloc[-1]["value"] == 10.0
+
+
+def test_client_stream_query_parallel(server_with_endpoints):
+    """Test fetching endpoints concurrently, ordered and unordered."""
+    with Client(server_with_endpoints) as client:
+        ordered = list(client.stream_query("SELECT * FROM events", parallel=4))
+        unordered = list(
+            client.stream_query("SELECT * FROM events", parallel=4, ordered=False)
+        )
+        sequential = list(client.stream_query("SELECT * FROM events"))
+
+        assert sum(b.num_rows for b in ordered) == 4000
+        assert sum(b.num_rows for b in unordered) == 4000
+        assert pa.Table.from_batches(ordered).equals(pa.Table.from_batches(sequential))
+
+
+def test_client_stream_query_parallel_stops_early(server_with_endpoints):
+    """Test closing a parallel stream early doesn't hang."""
+    with Client(server_with_endpoints) as client:
+        stream = client.stream_query("SELECT * FROM events", parallel=2)
+        assert next(stream).num_rows > 0
+        stream.close()
+
+        result = client.query("SELECT COUNT(*) AS n FROM events")
+        assert result.column("n")[0].as_py() == 4000
+
+
+def test_client_read_all(client):
+    """Test reading all results with the Flight reader."""
+    result = client.read_all("SELECT * FROM users WHERE id > 100")
+
+    assert result.num_rows == 0
+    assert result.column_names == ["id", "name", "value", "active"]
+
+
+def test_client_export(client, tmp_path):
+    """Test streaming results into a file."""
+    path = str(tmp_path / "users.parquet")
+    rows = client.export("SELECT * FROM users", path)
+
+    assert rows == 5
+    assert pq.read_table(path).equals(client.query("SELECT * FROM users"))
+
+
+def test_client_prepared_statement(client):
+    """Test executing a prepared statement with bound parameters."""
+    with client.prepare("SELECT id, name FROM users WHERE id > ? ORDER BY id") as stmt:
+        assert stmt.parameters == 1
+        assert stmt.schema.names == ["id", "name"]
+
+        assert stmt.execute([3]).column("id").to_pylist() == [4, 5]
+        assert stmt.execute([4]).column("name").to_pylist() == ["eve"]
+        result = stmt.executemany([[4], [10], [3]])
+        assert result.column("id").to_pylist() == [5, 4, 5]
+
+    with pytest.raises(flight.FlightServerError, match="Unknown or closed"):
+        stmt.execute([3])
+
+
+def test_client_prepared_statement_arrow_params(client):
+    """Test parameters given as an Arrow table."""
+    stmt = client.prepare("SELECT value FROM users WHERE name = $1")
+    params = pa.table({"name": ["bob", "nobody", "eve"]})
+
+    assert stmt.executemany(params).column("value").to_pylist() == [20.0, 50.0]
+    with pytest.raises(flight.FlightServerError, match="expects 1 parameters"):
+        stmt.executemany(pa.table({"a": [1], "b": [2]}))
+    stmt.close()
+
+
+def test_client_prepared_statement_empty_params(client):
+    """Test executing a statement for no rows gives an empty result."""
+    with client.prepare("SELECT id, name FROM users WHERE id > ?") as stmt:
+        for params in ([], pa.table({"id": pa.array([], pa.int64())})):
+            result = stmt.executemany(params)
+            assert result.num_rows == 0
+            assert result.schema == stmt.schema
+
+
+def test_client_connections(server):
+    """Test threads share a client with several connections."""
+    with Client(server, connections=3, max_message_size=64 * 1024 * 1024) as client:
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            results = list(
+                executor.map(
+                    lambda i: client.query(f"SELECT * FROM users WHERE id > {i}"),
+                    range(6),
+                )
+            )
+        assert [result.num_rows for result in results] == [5, 4, 3, 2, 1, 0]
+        assert len(client._clients) == 3
+
+
+def test_client_timeout(server):
+    """Test calls fail once the timeout expires."""
+    slow = "SELECT COUNT(*) FROM range(100000000) a, range(100000000) b"
+    with Client(server, timeout=0.2) as client:
+        with pytest.raises(flight.FlightTimedOutError):
+            client.query(slow)
+
+
+def test_client_retries_unavailable_server(delta_table_path, make_server):
+    """Test planning is retried while the server has no free connection."""
+    server = make_server(
+        tables={"users": delta_table_path},
+        pool_size=1,
+        pool_timeout=0.05,
+    )
+
+    conn = server._pool.get()
+    threading.Timer(0.3, server._pool.put, args=(conn,)).start()
+    with Client(server.location, retries=0) as client:
+        with pytest.raises(flight.FlightUnavailableError):
+            client.query("SELECT * FROM users")
+    with Client(server.location, retries=5, retry_backoff=0.05) as client:
+        assert client.query("SELECT * FROM users").num_rows == 5
+
+
+def test_client_lookup(client):
+    """Test rows are looked up by a table of keys."""
+    keys = pa.table({"id": [4, 2, 9, 2]})
+    result = client.lookup("users", keys)
+    assert sorted(result.column("id").to_pylist()) == [2, 4]
+    assert result.column_names == ["id", "name", "value", "active"]
+
+    keys = pa.record_batch({"name": ["eve", "bob"], "id": [5, 1]})
+    result = client.lookup("users", keys, on=["id", "name"], columns=["value"])
+    assert result.to_pydict() == {"value": [50.0]}
+
+    empty = pa.table({"id": pa.array([], pa.int64())})
+    assert client.lookup("users", empty).num_rows == 0
+    with pytest.raises(flight.FlightServerError, match="Unknown key columns"):
+        client.lookup("users", pa.table({"missing": [1]}))
+    with pytest.raises(flight.FlightServerError, match="Unknown table"):
+        client.lookup("missing", keys)
+
+
+def test_client_cache(delta_table_path, make_server):
+    """Test cached results are used until a table of the query changes."""
+    server = make_server(tables={"users": delta_table_path})
+
+    with Client(server.location, cache_size=1024**2) as client:
+        sql = "SELECT COUNT(*) AS n FROM users"
+        assert client.versions(sql) == {"users": 0}
+        assert client.query(sql).column("n")[0].as_py() == 5
+        assert client.query(sql).column("n")[0].as_py() == 5
+        assert client.client_cache_stats()["hits"] == 1
+
+        row = pa.table(
+            {"id": [6], "name": ["frank"], "value": [60.0], "active": [True]}
+        )
+        write_deltalake(delta_table_path, row, mode="append")
+        client.refresh("users")
+        assert client.versions(sql) == {"users": 1}
+        assert client.query(sql).column("n")[0].as_py() == 6
+        assert client.client_cache_stats()["misses"] == 2
+
+
+def test_client_cache_skips_uncacheable_queries(delta_table_path, make_server):
+    """Test queries without tables or with volatile functions bypass the cache."""
+    server = make_server(tables={"users": delta_table_path})
+
+    with Client(server.location, cache_size=1024**2) as client:
+        assert client.versions("SELECT 1") is None
+        assert client.versions("SELECT id, random() FROM users") is None
+        sql = "SELECT random() AS r"
+        first = client.query(sql).column("r")[0].as_py()
+        assert client.query(sql).column("r")[0].as_py() != first
+        client.query("SELECT id, now() FROM users")
+        stats = client.client_cache_stats()
+        assert stats["hits"] == 0 and stats["entries"] == 0
+
+
+def test_client_without_server_deps():
+    """Test the client can be imported without the server extra."""
+    code = textwrap.dedent("""
+        import sys
+
+        class Block:
+            def find_spec(self, name, path=None, target=None):
+                if name.split(".")[0] in ("duckdb", "deltalake"):
+                    raise ImportError(name)
+
+        sys.meta_path.insert(0, Block())
+        import flydelta
+        from flydelta import AsyncClient, Client
+        assert "Server" not in flydelta.__all__
+        """)
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,35 @@
+import pyarrow as pa
+
+from flydelta.clientcache import ClientCache
+
+TABLE = pa.table({"id": list(range(100)), "name": ["x"] * 100})
+
+
+def test_client_cache_checks_versions():
+    """Test results are only returned for the versions they were read at."""
+    cache = ClientCache(max_bytes=1024**2)
+    assert cache.store("SELECT * FROM users", {"users": 1}, TABLE)
+
+    assert cache.load("SELECT *  FROM users;", {"users": 1}) is TABLE
+    assert cache.load("SELECT * FROM users", {"users": 2}) is None
+    assert cache.load("SELECT * FROM events", {}) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert not cache.store("SELECT 1", {}, pa.table({"a": list(range(10**6))}))
+
+
+def test_client_cache_directory(tmp_path):
+    """Test cached results are written to files and indexed again on startup."""
+    cache = ClientCache(max_bytes=1024**2, directory=str(tmp_path))
+    cache.store("SELECT * FROM users", {"users": 1}, TABLE)
+    cache.store("SELECT * FROM users", {"users": 2}, TABLE.slice(0, 10))
+    assert len(list(tmp_path.iterdir())) == 1
+    (tmp_path / "foreign.arrow").write_bytes(b"not arrow")
+
+    cache = ClientCache(max_bytes=1024**2, directory=str(tmp_path))
+    assert cache.load("SELECT * FROM users", {"users": 1}) is None
+    assert cache.load("SELECT * FROM users", {"users": 2}).equals(TABLE.slice(0, 10))
+    assert len(list(tmp_path.iterdir())) == 1
+
+    small = ClientCache(max_bytes=100, directory=str(tmp_path))
+    assert len(small) == 0
+    assert list(tmp_path.iterdir()) == []
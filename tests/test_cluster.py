@@ -0,0 +1,72 @@
+import os
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from flydelta.cluster import (
+    Part,
+    PeerFile,
+    assign_files,
+    cluster_nodes,
+    decode_part,
+    encode_part,
+    owner,
+)
+
+NODES = [f"grpc://node{i}:8815" for i in range(4)]
+
+
+def test_owner_moves_only_keys_of_removed_node():
+    """Test removing a node only reassigns the keys it owned."""
+    keys = [f"part-{i}.parquet" for i in range(200)]
+    before = {key: owner(key, NODES) for key in keys}
+    after = {key: owner(key, NODES[:3]) for key in keys}
+
+    assert len(set(before.values())) == 4
+    moved = [key for key in keys if before[key] != after[key]]
+    assert moved and all(before[key] == NODES[3] for key in moved)
+
+
+def test_assign_files_keeps_partitions_together(tmp_path):
+    """Test files are divided among nodes with partitions kept together."""
+    for i in range(8):
+        pq.write_table(pa.table({"id": [i]}), tmp_path / f"{i}.parquet")
+    dataset = ds.dataset(str(tmp_path), format="parquet")
+    partitions = {f.path: f"p{i % 2}" for i, f in enumerate(dataset.get_fragments())}
+
+    owned = assign_files(dataset, NODES, partitions)
+    nodes = {}
+    for node, part in owned.items():
+        for fragment in part.get_fragments():
+            nodes.setdefault(partitions[fragment.path], set()).add(node)
+    assert nodes.keys() == {"p0", "p1"}
+    assert all(len(owners) == 1 for owners in nodes.values())
+    assert sum(part.count_rows() for part in owned.values()) == 8
+
+
+def test_part_ticket_roundtrip():
+    """Test parts of a query survive encoding into a ticket."""
+    part = Part("SELECT * FROM v", "v", "events", 3, ["a.parquet", "b.parquet"])
+    assert decode_part(encode_part(part)) == part
+
+
+def test_peer_file(tmp_path):
+    """Test peers are read from a file and again when it changes."""
+    path = tmp_path / "peers"
+    path.write_text("grpc://a:8815\n# comment\n\ngrpc://b:8815  # node b\n")
+    peers = PeerFile(str(path))
+    assert peers.peers() == ["grpc://a:8815", "grpc://b:8815"]
+
+    path.write_text("grpc://c:8815\n")
+    os.utime(path, (0, 0))
+    assert peers.peers() == ["grpc://c:8815"]
+    path.unlink()
+    assert peers.peers() == ["grpc://c:8815"]
+
+    assert cluster_nodes("grpc://a:8815", []) == []
+    assert cluster_nodes("grpc://a:8815", ["grpc://a:8815"]) == []
+    assert cluster_nodes("grpc://b:8815", ["grpc://a:8815"]) == [
+        "grpc://a:8815",
+        "grpc://b:8815",
+    ]
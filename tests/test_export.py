@@ -0,0 +1,53 @@
+import io
+import json
+
+import pyarrow as pa
+import pyarrow.csv as csv
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import pytest
+
+from flydelta.export import guess_format, write_batches
+
+BATCH = pa.record_batch({"id": [1, 2], "name": ["alice", "bob, jr"]})
+
+
+def test_guess_format():
+    """Test output formats are guessed from file extensions."""
+    assert guess_format("out.parquet") == "parquet"
+    assert guess_format("out.JSONL") == "ndjson"
+    with pytest.raises(ValueError):
+        guess_format("out.xlsx")
+
+
+@pytest.mark.parametrize(
+    "format,read",
+    [
+        ("parquet", pq.read_table),
+        ("arrow", feather.read_table),
+        ("csv", csv.read_csv),
+    ],
+)
+def test_write_batches(tmp_path, format, read):
+    """Test batches are written to files readable by pyarrow."""
+    path = str(tmp_path / f"out.{format}")
+    rows = write_batches(BATCH.schema, [BATCH, BATCH], path, format)
+
+    assert rows == 4
+    assert read(path).column("name").to_pylist() == ["alice", "bob, jr"] * 2
+
+
+def test_write_batches_json():
+    """Test JSON arrays and newline delimited JSON."""
+    sink = io.BytesIO()
+    write_batches(BATCH.schema, [BATCH, BATCH], sink, "json")
+    assert len(json.loads(sink.getvalue())) == 4
+
+    sink = io.BytesIO()
+    write_batches(BATCH.schema, [BATCH, BATCH], sink, "ndjson")
+    lines = sink.getvalue().decode().splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [1, 2, 1, 2]
+
+    sink = io.BytesIO()
+    write_batches(BATCH.schema, [], sink, "json")
+    assert json.loads(sink.getvalue()) == []
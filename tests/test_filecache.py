@@ -0,0 +1,71 @@
+import os
+
+import pyarrow as pa
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from flydelta.filecache import CachedFileSystemHandler, FileCache
+
+
+def write_files(path, sizes):
+    for i, size in enumerate(sizes):
+        with open(os.path.join(path, f"{i}.bin"), "wb") as f:
+            f.write(bytes(size))
+
+
+def test_file_cache_evicts_files(tmp_path):
+    """Test files are downloaded once and evicted from disk in LRU order."""
+    source, cache_dir = tmp_path / "source", tmp_path / "cache"
+    source.mkdir()
+    write_files(source, [40, 40, 40, 200])
+    fs = pafs.LocalFileSystem()
+    cache = FileCache(str(cache_dir), max_bytes=100)
+
+    first = cache.fetch("t/0.bin", fs, str(source / "0.bin"))
+    assert cache.fetch("t/0.bin", fs, str(source / "0.bin")) == first
+    cache.fetch("t/1.bin", fs, str(source / "1.bin"))
+    cache.fetch("t/0.bin", fs, str(source / "0.bin"))
+    cache.fetch("t/2.bin", fs, str(source / "2.bin"))
+
+    assert os.path.exists(first)
+    assert len(os.listdir(cache_dir)) == 2
+    assert cache.stats()["hits"] == 2
+    assert cache.evictions == 1
+    # larger than the whole cache
+    assert cache.fetch("t/3.bin", fs, str(source / "3.bin")) is None
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_file_cache_survives_restart(tmp_path):
+    """Test files cached by an earlier run are found again."""
+    source = tmp_path / "source"
+    source.mkdir()
+    write_files(source, [40])
+    fs = pafs.LocalFileSystem()
+    FileCache(str(tmp_path / "cache"), 100).fetch("t/0", fs, str(source / "0.bin"))
+    (tmp_path / "cache" / ".download-stale").write_bytes(b"x")
+
+    cache = FileCache(str(tmp_path / "cache"), 100)
+    assert len(cache) == 1
+    assert cache.nbytes == 40
+    assert os.listdir(tmp_path / "cache") == [next(iter(cache.keys()))]
+    assert FileCache(str(tmp_path / "cache"), 10).nbytes == 0
+
+
+def test_cached_filesystem(tmp_path):
+    """Test Parquet files are read through the cache."""
+    pq.write_table(pa.table({"a": [1, 2, 3]}), tmp_path / "data.parquet")
+    cache = FileCache(str(tmp_path / "cache"), 1024 * 1024)
+    handler = CachedFileSystemHandler(
+        pafs.SubTreeFileSystem(str(tmp_path), pafs.LocalFileSystem()),
+        cache,
+        "file:///table",
+    )
+    fs = pafs.PyFileSystem(handler)
+
+    assert pq.read_table("data.parquet", filesystem=fs)["a"].to_pylist() == [1, 2, 3]
+    os.remove(tmp_path / "data.parquet")
+    # served from the local copy
+    with fs.open_input_file("data.parquet") as f:
+        assert pq.ParquetFile(f).read().num_rows == 3
+    assert cache.stats()["hits"] >= 1
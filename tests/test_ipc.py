@@ -0,0 +1,45 @@
+import pyarrow as pa
+import pytest
+
+from flydelta.ipc import dictionary_encoder, rebatch, write_options
+
+
+def test_write_options():
+    """Test compression codecs are configured on the IPC options."""
+    assert write_options().compression is None
+    assert write_options("none").compression is None
+    assert write_options("zstd", 3).compression == "zstd"
+    assert write_options("lz4").compression == "lz4"
+    with pytest.raises(ValueError):
+        write_options("gzip")
+
+
+def test_dictionary_encoder():
+    """Test only low-cardinality string columns are dictionary encoded."""
+    batch = pa.record_batch(
+        {
+            "id": list(range(6)),
+            "status": ["a", "b", "a", "a", "b", "a"],
+            "name": ["a", "b", "c", "d", "e", "f"],
+        }
+    )
+    schema, encode = dictionary_encoder(batch, 0.5)
+
+    assert schema.field("status").type == pa.dictionary(pa.int32(), pa.string())
+    assert schema.field("name").type == pa.string()
+    encoded = encode(batch.slice(0, 3))
+    assert encoded.schema == schema
+    assert encoded.column("status").to_pylist() == ["a", "b", "a"]
+
+
+def test_rebatch():
+    """Test batches are coalesced and split to a target size in bytes."""
+    batch = pa.record_batch({"id": pa.array(range(10), pa.int64())})
+    small = [batch.slice(i, 1) for i in range(10)]
+
+    assert [b.num_rows for b in rebatch(small, 24)] == [3, 3, 3, 1]
+    assert [b.num_rows for b in rebatch([batch], 16)] == [2, 2, 2, 2, 2]
+    assert [b.num_rows for b in rebatch([batch], 24)] == [3, 3, 3, 1]
+    assert [b.num_rows for b in rebatch([batch], 1000)] == [10]
+    result = pa.Table.from_batches(rebatch([batch, *small, batch], 24))
+    assert result.column("id").to_pylist() == list(range(10)) * 3
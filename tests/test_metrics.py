@@ -0,0 +1,37 @@
+import pytest
+
+from flydelta.metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_render():
+    """Test metrics are rendered in the Prometheus text format."""
+    registry = Registry()
+    counter = registry.add(Counter("rows_total", "Rows", ["table"]))
+    gauge = registry.add(Gauge("in_flight", "Streams"))
+    histogram = registry.add(Histogram("wait_seconds", "Wait", buckets=[0.1, 1]))
+    registry.collector(lambda: gauge.set(3))
+
+    counter.inc(5, table="users")
+    counter.inc(2, table='a"b')
+    histogram.observe(0.1)
+    histogram.observe(0.5)
+    histogram.observe(2.5)
+
+    assert registry.render().splitlines() == [
+        "# HELP rows_total Rows",
+        "# TYPE rows_total counter",
+        'rows_total{table="a\\"b"} 2',
+        'rows_total{table="users"} 5',
+        "# HELP in_flight Streams",
+        "# TYPE in_flight gauge",
+        "in_flight 3",
+        "# HELP wait_seconds Wait",
+        "# TYPE wait_seconds histogram",
+        'wait_seconds_bucket{le="0.1"} 1',
+        'wait_seconds_bucket{le="1"} 2',
+        'wait_seconds_bucket{le="+Inf"} 3',
+        "wait_seconds_sum 3.1",
+        "wait_seconds_count 3",
+    ]
+    with pytest.raises(ValueError):
+        counter.inc(1)
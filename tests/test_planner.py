@@ -0,0 +1,152 @@
+import datetime
+import decimal
+import json
+
+import duckdb
+import pytest
+
+from flydelta.planner import (
+    Predicate,
+    is_volatile,
+    parameter_count,
+    replace_snapshots,
+    replace_table,
+    rollup_merges,
+    scan_table,
+    where_predicates,
+)
+
+
+def parse(sql):
+    row = duckdb.connect().execute("SELECT json_serialize_sql(?)", [sql]).fetchone()
+    return json.loads(row[0])
+
+
+@pytest.mark.parametrize(
+    "sql,table",
+    [
+        ("SELECT * FROM users", "users"),
+        ("SELECT id, name FROM users WHERE id > 3", "users"),
+        ("SELECT COUNT(*) FROM users", None),
+        ("SELECT id + 1 FROM users", None),
+        ("SELECT * FROM users ORDER BY id", None),
+        ("SELECT DISTINCT id FROM users", None),
+        ("SELECT * FROM users LIMIT 5", None),
+        ("SELECT * FROM users JOIN orders USING (id)", None),
+        ("SELECT * FROM users WHERE id IN (SELECT id FROM orders)", None),
+        ("SELECT 1; SELECT 2", None),
+    ],
+)
+def test_scan_table(sql, table):
+    """Test detection of simple single-table scans."""
+    assert scan_table(parse(sql)) == table
+
+
+@pytest.mark.parametrize(
+    "sql,merges",
+    [
+        (
+            "SELECT day, COUNT(*) AS n, SUM(x), MIN(x), MAX(x) FROM t GROUP BY day",
+            ["key", "sum", "sum", "min", "max"],
+        ),
+        ("SELECT COUNT(x) FROM t WHERE x > 3", ["sum"]),
+        ("SELECT day, SUM(x) FILTER (WHERE x > 1) FROM t GROUP BY 1", ["key", "sum"]),
+        ("SELECT t.day AS d, SUM(x) FROM t GROUP BY ALL", ["key", "sum"]),
+        ("SELECT SUM(x) FROM t GROUP BY day", None),
+        ("SELECT day, AVG(x) FROM t GROUP BY day", None),
+        ("SELECT day, COUNT(DISTINCT x) FROM t GROUP BY day", None),
+        ("SELECT day, SUM(x) + 1 FROM t GROUP BY day", None),
+        ("SELECT day, SUM(x) FROM t GROUP BY day HAVING SUM(x) > 1", None),
+        ("SELECT day, SUM(x) FROM t GROUP BY ROLLUP (day)", None),
+        ("SELECT day, SUM(x) FROM t JOIN u USING (id) GROUP BY day", None),
+        ("SELECT x FROM t", None),
+    ],
+)
+def test_rollup_merges(sql, merges):
+    """Test aggregations that can be merged from parts of a table."""
+    assert rollup_merges(parse(sql)) == merges
+
+
+def test_replace_table():
+    """Test the scanned relation is replaced, keeping the name as alias."""
+    ast = parse("SELECT users.id FROM users WHERE id > 3")
+    replaced = replace_table(ast, "users", "users_part")
+
+    assert replaced["statements"][0]["node"]["from_table"]["alias"] == "users"
+    assert ast["statements"][0]["node"]["from_table"]["table_name"] == "users"
+    with pytest.raises(ValueError):
+        replace_table(ast, "orders", "orders_part")
+
+
+def test_replace_snapshots():
+    """Test tables read with AT clauses are replaced everywhere in a query."""
+    ast = parse(
+        "SELECT * FROM users AT (VERSION => 2) JOIN orders USING (id) "
+        "WHERE id IN (SELECT id FROM users AT (TIMESTAMP => '2024-01-02 03:00'))"
+    )
+    seen = []
+
+    def replacement(name, at):
+        seen.append((name, at))
+        return f"{name}_{len(seen)}"
+
+    replaced = replace_snapshots(ast, {"users", "orders"}, replacement)
+    node = replaced["statements"][0]["node"]
+
+    assert seen == [
+        ("users", 2),
+        ("users", datetime.datetime(2024, 1, 2, 3)),
+    ]
+    assert node["from_table"]["left"]["table_name"] == "users_1"
+    assert node["from_table"]["left"]["alias"] == "users"
+    assert node["from_table"]["left"]["at_clause"] is None
+    assert replace_snapshots(parse("SELECT * FROM users"), {"users"}, str) is None
+    with pytest.raises(ValueError, match="Unsupported AT clause"):
+        replace_snapshots(
+            parse("SELECT * FROM users AT (VERSION => 'x')"), {"users"}, replacement
+        )
+
+
+@pytest.mark.parametrize(
+    "sql,volatile",
+    [
+        ("SELECT * FROM users", False),
+        ("SELECT random()", True),
+        ("SELECT * FROM users WHERE id < RANDOM() * 10", True),
+        ("SELECT now(), id FROM users", True),
+        ("SELECT current_timestamp", True),
+        ("SELECT gen_random_uuid(), uuid()", True),
+        ("SELECT * FROM users WHERE day = current_date", True),
+        ("SELECT u.current_date FROM users u", False),
+    ],
+)
+def test_is_volatile(sql, volatile):
+    assert is_volatile(parse(sql)) == volatile
+
+
+def test_parameter_count():
+    """Test distinct parameters are counted."""
+    assert parameter_count(parse("SELECT * FROM users")) == 0
+    assert parameter_count(parse("SELECT * FROM users WHERE id = ? OR id = ?")) == 2
+    assert parameter_count(parse("SELECT $1 FROM users WHERE id = $1")) == 1
+
+
+def test_where_predicates():
+    """Test comparisons with constants are extracted from the WHERE clause."""
+    ast = parse(
+        "SELECT COUNT(*) FROM users u WHERE id >= 3 AND 5 > u.id AND name IN "
+        "('a', 'b') AND day BETWEEN DATE '2024-01-01' AND '2024-02-01' "
+        "AND value IS NULL AND (id = 1 OR id = 2) AND id + 1 = 3"
+    )
+    assert where_predicates(ast) == [
+        Predicate("id", ">=", 3),
+        Predicate("id", "<", 5),
+        Predicate("name", "in", ["a", "b"]),
+        Predicate("day", ">=", datetime.date(2024, 1, 1)),
+        Predicate("day", "<=", "2024-02-01"),
+        Predicate("value", "is_null"),
+    ]
+    assert where_predicates(parse("SELECT * FROM a JOIN b USING (id)")) == []
+    assert where_predicates(parse("SELECT * FROM users WHERE x = 1.5")) == [
+        Predicate("x", "=", decimal.Decimal("1.5"))
+    ]
@@ -0,0 +1,115 @@
+import itertools
+import threading
+import time
+
+import pytest
+
+from flydelta.pool import ConnectionPool, PoolError, PoolFull, PoolTimeout
+
+
+def make_pool(**kwargs):
+    counter = itertools.count()
+    closed = []
+    pool = ConnectionPool(lambda: next(counter), close=closed.append, **kwargs)
+    return pool, closed
+
+
+def test_pool_grows_lazily():
+    """Test connections are created on demand up to the lane size."""
+    pool, _ = make_pool(lanes={"interactive": 3}, min_size=1)
+    assert pool.stats()["interactive"]["size"] == 1
+
+    conns = [pool.get() for _ in range(3)]
+    stats = pool.stats()["interactive"]
+
+    assert sorted(conns) == [0, 1, 2]
+    assert stats["size"] == 3
+    assert stats["in_use"] == 3
+    assert stats["checkouts"] == 3
+
+
+def test_pool_timeout():
+    """Test checkouts give up after the timeout."""
+    pool, _ = make_pool(lanes={"interactive": 1}, timeout=0.05)
+    pool.get()
+
+    with pytest.raises(PoolTimeout):
+        pool.get()
+    assert pool.stats()["interactive"]["timeouts"] == 1
+
+
+def test_pool_rejects_when_queue_is_full():
+    """Test callers are rejected when too many are waiting."""
+    pool, _ = make_pool(lanes={"interactive": 1}, max_waiting=1)
+    conn = pool.get()
+    waiter = threading.Thread(target=lambda: pool.put(pool.get()))
+    waiter.start()
+    time.sleep(0.05)
+
+    assert pool.stats()["interactive"]["waiting"] == 1
+    with pytest.raises(PoolFull):
+        pool.get()
+
+    pool.put(conn)
+    waiter.join()
+    stats = pool.stats()["interactive"]
+    assert stats["rejections"] == 1
+    assert stats["max_wait_seconds"] > 0
+
+
+def test_pool_lanes_are_independent():
+    """Test an exhausted lane doesn't block other lanes."""
+    pool, _ = make_pool(lanes={"interactive": 1, "bulk": 1}, timeout=0.05)
+    pool.get("bulk")
+
+    with pytest.raises(PoolTimeout):
+        pool.get("bulk")
+    conn = pool.get("interactive")
+    pool.put(conn)
+    with pytest.raises(ValueError):
+        pool.get("unknown")
+
+
+def test_pool_shrinks_idle_connections():
+    """Test surplus connections are closed after being idle."""
+    pool, closed = make_pool(lanes={"interactive": 3}, idle_timeout=0.05)
+    first, second = pool.get(), pool.get()
+    pool.put(first)
+    time.sleep(0.1)
+    pool.put(second)
+
+    assert closed == [first]
+    assert pool.stats()["interactive"]["size"] == 1
+
+    pool.close()
+    assert closed == [first, second]
+
+
+def test_idle_pool_shrinks():
+    """Test surplus connections expire without further checkouts."""
+    pool, closed = make_pool(lanes={"interactive": 3}, idle_timeout=0.05)
+    first, second = pool.get(), pool.get()
+    pool.put(first)
+    pool.put(second)
+    pool.expire()
+    assert closed == []
+
+    time.sleep(0.1)
+    pool.expire()
+    assert closed == [first]
+    assert pool.stats()["interactive"]["size"] == 1
+
+
+def test_pool_close_closes_returned_connections():
+    """Test connections returned after the pool was closed are closed."""
+    pool, closed = make_pool(lanes={"interactive": 2}, min_size=1)
+    conn = pool.get()
+    pool.get()
+    pool.close()
+    assert closed == []
+
+    pool.put(conn)
+    assert closed == [conn]
+    assert pool.stats()["interactive"]["size"] == 1
+    with pytest.raises(PoolError):
+        pool.get()
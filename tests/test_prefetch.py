@@ -0,0 +1,80 @@
+import os
+import time
+
+import pyarrow as pa
+import pytest
+
+from flydelta.prefetch import PrefetchStream
+
+SCHEMA = pa.schema([("id", pa.int64())])
+
+
+class Source:
+    """Batches of one row each, recording when the source is closed."""
+
+    def __init__(self, rows, fail_at=None):
+        self.rows = rows
+        self.fail_at = fail_at
+        self.closed = False
+
+    def __iter__(self):
+        for i in range(self.rows):
+            if i == self.fail_at:
+                raise RuntimeError("query failed")
+            yield pa.record_batch([pa.array([i])], schema=SCHEMA)
+
+    def close(self):
+        self.closed = True
+
+
+def ids(batches):
+    return [i for batch in batches for i in batch.column("id").to_pylist()]
+
+
+def test_prefetch():
+    """Test batches are read ahead in order and the source is closed."""
+    source = Source(10)
+    stream = PrefetchStream(source, SCHEMA, depth=2)
+
+    assert ids(stream) == list(range(10))
+    assert source.closed
+    assert not stream.spilled
+
+
+def test_prefetch_error():
+    """Test errors of the source are raised by the consumer."""
+    stream = PrefetchStream(Source(10, fail_at=5), SCHEMA, depth=2)
+    with pytest.raises(RuntimeError, match="query failed"):
+        list(stream)
+
+
+def test_spill(tmp_path):
+    """Test the rest of a result is spilled when the consumer stalls."""
+    source = Source(100)
+    stream = PrefetchStream(
+        source, SCHEMA, depth=2, spill_after=0.1, spill_dir=str(tmp_path)
+    )
+    first = next(stream)
+    time.sleep(0.5)
+
+    # the source is released while the client is still reading
+    assert source.closed
+    assert len(os.listdir(tmp_path)) == 1
+    assert ids([first, *stream]) == list(range(100))
+    assert stream.spilled
+    assert os.listdir(tmp_path) == []
+
+
+def test_close_stops_producer(tmp_path):
+    """Test closing the stream early stops the producer and removes files."""
+    source = Source(100)
+    stream = PrefetchStream(
+        source, SCHEMA, depth=2, spill_after=0.1, spill_dir=str(tmp_path)
+    )
+    next(stream)
+    time.sleep(0.5)
+    stream.close()
+    time.sleep(0.3)
+
+    assert source.closed
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,112 @@
+import datetime
+
+import pyarrow as pa
+
+from flydelta.planner import Predicate
+from flydelta.pruning import lookup_predicates, skipped_files
+
+ACTIONS = pa.table(
+    {
+        "path": ["a", "b", "c", "d"],
+        "num_records": [10, 10, 10, 10],
+        "null_count.id": [0, 2, 10, None],
+        "min.id": [1, 11, None, None],
+        "max.id": [10, 20, None, None],
+        "partition.day": ["2024-01-01", "2024-01-02", None, "2024-01-02"],
+    }
+)
+
+
+def skipped(*predicates):
+    return skipped_files(ACTIONS, list(predicates), ["day"])
+
+
+def test_skip_by_statistics():
+    """Test files are skipped when min/max statistics rule out a predicate."""
+    assert skipped(Predicate("id", "=", 5)) == {"b", "c"}
+    assert skipped(Predicate("id", ">", 10)) == {"a", "c"}
+    assert skipped(Predicate("id", "<=", 10)) == {"b", "c"}
+    assert skipped(Predicate("id", "in", [0, 30])) == {"a", "b", "c"}
+    assert skipped(Predicate("id", "is_null")) == {"a"}
+    assert skipped(Predicate("id", "is_not_null")) == {"c"}
+
+
+def test_skip_by_partition():
+    """Test files are skipped by partition value."""
+    assert skipped(Predicate("day", "=", "2024-01-02")) == {"a", "c"}
+    assert skipped(Predicate("day", "is_null")) == {"a", "b", "d"}
+    assert skipped(Predicate("day", "=", "x"), Predicate("id", "=", 15)) == {
+        "a",
+        "b",
+        "c",
+        "d",
+    }
+
+
+def test_keep_unknown():
+    """Test files are kept when predicates can't be evaluated."""
+    assert skipped() == set()
+    assert skipped(Predicate("name", "=", "x")) == set()
+    assert skipped(Predicate("id", "=", "x")) == {"c"}
+
+
+def test_lookup_predicates():
+    """Test lookup keys become an IN list or, if there are many, a range."""
+    keys = pa.table({"id": [5, 3, None, 5], "name": ["a", "b", "c", "d"]})
+    assert lookup_predicates(keys, ["id"]) == [Predicate("id", "in", [5, 3])]
+    assert lookup_predicates(keys, ["id"], in_values=1) == [
+        Predicate("id", ">=", 3),
+        Predicate("id", "<=", 5),
+    ]
+    assert skipped(*lookup_predicates(keys, ["id"])) == {"b", "c"}
+    assert skipped(*lookup_predicates(keys.slice(2, 1), ["id"])) == {"a", "b", "c"}
+
+
+def test_partition_values_are_converted():
+    """Test constants are converted to the type of numeric partition values."""
+    actions = pa.table(
+        {"path": ["a", "b"], "num_records": [3, 3], "partition.year": [2020, 2021]}
+    )
+    assert skipped_files(actions, [Predicate("year", "=", "2020")], ["year"]) == {"b"}
+    assert skipped_files(actions, [Predicate("year", "in", ["2021"])], ["year"]) == {
+        "a"
+    }
+    assert skipped_files(actions, [Predicate("year", "=", "x")], ["year"]) == set()
+    assert skipped_files(actions, [Predicate("year", "=", True)], ["year"]) == set()
+
+
+def test_timestamp_statistics_are_truncated():
+    """Test timestamp maxima truncated to milliseconds still keep the file."""
+    low = datetime.datetime(2024, 1, 1)
+    actions = pa.table(
+        {"path": ["a"], "num_records": [2], "min.t": [low], "max.t": [low]}
+    )
+
+    def skipped_at(op, microseconds):
+        value = low + datetime.timedelta(microseconds=microseconds)
+        return skipped_files(actions, [Predicate("t", op, value)], [])
+
+    assert skipped_at("=", 500) == set()
+    assert skipped_at(">", 100) == set()
+    assert skipped_at(">", 1000) == {"a"}
+    assert skipped_at("<", 0) == {"a"}
+
+
+def test_naive_and_aware_timestamps_keep_the_file():
+    """Test naive constants aren't compared with time zone aware values."""
+    day = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    actions = pa.table(
+        {
+            "path": ["a", "b"],
+            "num_records": [1, 1],
+            "partition.day": [day, day + datetime.timedelta(days=1)],
+        }
+    )
+
+    def skipped_on(value):
+        return skipped_files(actions, [Predicate("day", "=", value)], ["day"])
+
+    assert skipped_on(datetime.datetime(2024, 1, 1)) == set()
+    assert skipped_on("2024-01-01 00:00:00") == set()
+    assert skipped_on(day) == {"b"}
+    assert skipped_on("2024-01-01 01:00:00+01:00") == {"b"}
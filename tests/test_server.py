@@ -1,4 +1,20 @@
-from flydelta import Client
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.flight as flight
+import pytest
+from deltalake import write_deltalake
+
+from benchmarks.utils import free_port
+from flydelta import Client, Server
+from flydelta.server import BYTES_FETCH_ROWS, PLAN_FILE_BYTES, _Query
 
 
 def test_server_query(server):
@@ -67,3 +83,892 @@ def test_stream_query_processes_incrementally(server_with_large_table):
             assert batch.num_rows <= 1000
 
         assert batch_count >= 10  # 10000 rows / 1000 batch_size
+
+
+def test_stream_query_batch_bytes(server_with_large_table):
+    """Test batches are coalesced or split to the requested size in bytes."""
+    with Client(server_with_large_table) as client:
+        # about 16 kB per DuckDB batch of 1000 rows
+        sql = "SELECT * FROM large_table"
+        batches = list(client.stream_query(sql, batch_bytes=60000))
+        assert [b.num_rows for b in batches] == [4000, 4000, 2000]
+        batches = list(client.stream_query(sql, batch_bytes=8000))
+        assert len(batches) > 20
+        assert all(b.nbytes <= 8000 for b in batches)
+        assert sum(b.num_rows for b in batches) == 10000
+        assert len(list(client.stream_query(sql, batch_bytes=0))) == 10
+
+
+def test_batch_bytes_fetch_small_chunks(large_delta_table_path, make_server):
+    """Test results sized in bytes never materialize large row batches."""
+    server = make_server(tables={"large_table": large_delta_table_path})
+
+    sql = "SELECT * FROM large_table"
+    stream = server._stream_batches(sql, running=_Query("q", None))
+    assert [b.num_rows for b in stream] == [10000]
+    stream = server._stream_batches(sql, running=_Query("q", None, batch_bytes=1))
+    assert max(b.num_rows for b in stream) <= BYTES_FETCH_ROWS
+
+    with Client(server.location) as client:
+        batches = list(client.stream_query(sql, batch_bytes=60000))
+        assert len(batches) == 3
+        assert sum(b.num_rows for b in batches) == 10000
+
+
+def test_result_cache(server_with_cache):
+    """Test repeated queries are served from the result cache."""
+    with Client(server_with_cache) as client:
+        first = client.query("SELECT * FROM users WHERE id > 3")
+        second = client.query("SELECT *  FROM users\nWHERE id > 3")
+        stats = client.cache_stats()
+
+        assert first.equals(second)
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["entries"] == 1
+
+
+def test_result_cache_skips_volatile_queries(server_with_cache):
+    """Test queries without tables or with volatile functions aren't cached."""
+    with Client(server_with_cache) as client:
+        first = client.query("SELECT random() AS r")
+        second = client.query("SELECT random() AS r")
+        assert first.column("r")[0] != second.column("r")[0]
+        client.query("SELECT id, now() FROM users")
+        client.query("SELECT 1")
+        assert client.cache_stats()["entries"] == 0
+
+
+def test_result_cache_disabled(server):
+    """Test cache stats are empty when the cache is disabled."""
+    with Client(server) as client:
+        client.query("SELECT * FROM users")
+
+        assert client.cache_stats() == {}
+
+
+def test_flight_info_ticket_is_opaque(server):
+    """Test tickets refer to a server-side plan instead of carrying SQL."""
+    client = flight.connect(server)
+    descriptor = flight.FlightDescriptor.for_command(b"SELECT id FROM users")
+    info = client.get_flight_info(descriptor)
+    ticket = info.endpoints[0].ticket
+
+    assert b"SELECT" not in ticket.ticket
+    assert client.do_get(ticket).read_all().num_rows == 5
+    # the same ticket can be fetched again until it expires
+    assert client.do_get(ticket).read_all().schema == info.schema
+
+
+def test_plain_sql_ticket(server):
+    """Test tickets carrying plain SQL are still executed."""
+    client = flight.connect(server)
+    reader = client.do_get(flight.Ticket(b"SELECT name FROM users WHERE id = 1"))
+
+    assert reader.read_all().column("name")[0].as_py() == "alice"
+
+
+def test_expired_ticket(delta_table_path, make_server):
+    """Test expired plan tickets are rejected."""
+    server = make_server(tables={"users": delta_table_path}, plan_ttl=0.1)
+
+    client = flight.connect(server.location)
+    descriptor = flight.FlightDescriptor.for_command(b"SELECT * FROM users")
+    ticket = client.get_flight_info(descriptor).endpoints[0].ticket
+    time.sleep(0.2)
+
+    with pytest.raises(flight.FlightServerError, match="expired"):
+        client.do_get(ticket).read_all()
+
+
+def test_flight_info_endpoints(server_with_endpoints):
+    """Test simple scans are split into independent endpoints."""
+    client = flight.connect(server_with_endpoints)
+    descriptor = flight.FlightDescriptor.for_command(
+        b"SELECT events.id, part FROM events WHERE id % 2 = 0"
+    )
+    info = client.get_flight_info(descriptor)
+
+    assert len(info.endpoints) == 4
+    tables = [client.do_get(e.ticket).read_all() for e in info.endpoints]
+    # each endpoint holds complete partitions
+    assert all(len(set(t.column("part").to_pylist())) <= 1 for t in tables)
+    assert sum(t.num_rows for t in tables) == 2000
+
+
+def test_flight_info_single_endpoint_for_aggregations(server_with_endpoints):
+    """Test queries that aren't simple scans keep a single endpoint."""
+    client = flight.connect(server_with_endpoints)
+    for sql in [
+        "SELECT COUNT(*) FROM events",
+        "SELECT * FROM events ORDER BY id",
+        "SELECT * FROM events LIMIT 10",
+    ]:
+        descriptor = flight.FlightDescriptor.for_command(sql.encode("utf-8"))
+        assert len(client.get_flight_info(descriptor).endpoints) == 1
+
+
+def append_user(path, id):
+    table = pa.table({"id": [id], "name": ["frank"], "value": [60.0], "active": [True]})
+    write_deltalake(path, table, mode="append")
+
+
+def test_refresh(server_with_cache, delta_table_path):
+    """Test new table versions become visible after a refresh."""
+    with Client(server_with_cache) as client:
+        assert client.query("SELECT * FROM users").num_rows == 5
+        append_user(delta_table_path, 6)
+        # cached result of the old version
+        assert client.query("SELECT * FROM users").num_rows == 5
+
+        assert client.refresh() == {"users": 1}
+        assert client.query("SELECT * FROM users").num_rows == 6
+        assert client.refresh("users") == {"users": 1}
+        with pytest.raises(flight.FlightServerError, match="Unknown table"):
+            client.refresh("orders")
+
+
+def test_refresh_keeps_running_queries_on_snapshot(
+    server_with_large_table, large_delta_table_path
+):
+    """Test a stream started before a refresh finishes on its snapshot."""
+    with Client(server_with_large_table) as client:
+        stream = client.stream_query("SELECT id FROM large_table")
+        rows = next(stream).num_rows
+        table = pa.table({"id": [10000], "value": [1.0]})
+        write_deltalake(large_delta_table_path, table, mode="append")
+        client.refresh()
+        rows += sum(batch.num_rows for batch in stream)
+
+        assert rows == 10000
+        assert client.query("SELECT * FROM large_table").num_rows == 10001
+
+
+def test_refresh_interval(delta_table_path, make_server):
+    """Test tables are refreshed in the background."""
+    server = make_server(tables={"users": delta_table_path}, refresh_interval=0.1)
+
+    with Client(server.location) as client:
+        append_user(delta_table_path, 6)
+        time.sleep(0.5)
+
+        assert client.query("SELECT * FROM users").num_rows == 6
+
+
+def test_compression_and_dictionary(delta_table_path, make_server):
+    """Test compressed streams with dictionary encoded columns."""
+    server = make_server(
+        tables={"users": delta_table_path},
+        compression="zstd",
+        compression_level=3,
+        compression_threshold=0,
+        dictionary_ratio=1.0,
+    )
+
+    with Client(server.location) as client:
+        result = client.query("SELECT id, name FROM users ORDER BY id")
+        assert pa.types.is_dictionary(result.schema.field("name").type)
+        assert result.column("name").to_pylist()[0] == "alice"
+
+        result = client.query("SELECT id FROM users", compression="lz4")
+        assert result.num_rows == 5
+
+        with pytest.raises(flight.FlightServerError, match="compression"):
+            client.query("SELECT id FROM users", compression="gzip")
+
+
+def test_pool_lanes(delta_table_path, make_server):
+    """Test queries use the requested lane and exhausted lanes reject."""
+    server = make_server(
+        tables={"users": delta_table_path},
+        pool_size=2,
+        pool_lanes={"bulk": 1},
+        pool_timeout=0.1,
+    )
+
+    with Client(server.location) as client:
+        # occupy the only connection of the bulk lane
+        conn = server._checkout("bulk")
+        with pytest.raises(flight.FlightUnavailableError):
+            client.query("SELECT * FROM users", lane="bulk")
+        assert client.query("SELECT * FROM users").num_rows == 5
+
+        stats = client.pool_stats()
+        assert stats["bulk"]["in_use"] == 1
+        assert stats["bulk"]["timeouts"] == 1
+        assert stats["interactive"]["in_use"] == 0
+        server._pool.put(conn)
+        assert client.query("SELECT * FROM users", lane="bulk").num_rows == 5
+
+
+def test_idle_pool_shrinks(delta_table_path, make_server):
+    """Test surplus connections of an idle server are closed."""
+    server = make_server(
+        tables={"users": delta_table_path},
+        pool_size=3,
+        pool_idle_timeout=0.1,
+    )
+
+    conns = [server._checkout() for _ in range(3)]
+    for conn in conns:
+        server._pool.put(conn)
+    assert server._pool.stats()["interactive"]["size"] == 3
+    time.sleep(0.5)
+    assert server._pool.stats()["interactive"]["size"] == 1
+
+
+def test_file_pruning(server_with_endpoints):
+    """Test files are skipped using partition values and statistics."""
+    with Client(server_with_endpoints) as client:
+        assert client.scan_info("SELECT * FROM events") == {
+            "table": "events",
+            "files_scanned": 16,
+            "files_skipped": 0,
+        }
+        scan = client.scan_info("SELECT COUNT(*) FROM events WHERE part = 'p1'")
+        assert (scan["files_scanned"], scan["files_skipped"]) == (4, 12)
+        scan = client.scan_info("SELECT * FROM events e WHERE e.id < 1000")
+        assert (scan["files_scanned"], scan["files_skipped"]) == (4, 12)
+        scan = client.scan_info(
+            "SELECT * FROM events WHERE part IN ('p1', 'p2') AND id >= 3000"
+        )
+        assert (scan["files_scanned"], scan["files_skipped"]) == (2, 14)
+        assert client.scan_info("SELECT 1") == {}
+
+        result = client.query("SELECT COUNT(*) AS n FROM events WHERE part = 'p1'")
+        assert result.column("n")[0].as_py() == 1000
+        result = client.query("SELECT * FROM events WHERE id < 1000", parallel=2)
+        assert result.num_rows == 1000
+        result = client.query("SELECT * FROM events WHERE part = 'p9'")
+        assert result.num_rows == 0
+        assert result.schema.names == ["id", "part"]
+        empty = client.query("SELECT * FROM events WHERE id < 0", parallel=2)
+        assert empty.schema == result.schema
+
+        stats = client.scan_stats()
+        assert stats["files_skipped"] >= 12 * 3 + 16
+
+
+def test_file_pruning_escaped_partitions(make_server):
+    """Test files are skipped by partition values that are escaped in paths."""
+    day = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    table = pa.table(
+        {
+            "city": ["Berlin", "New York", "a:b"],
+            "day": [day, day, day + datetime.timedelta(days=1)],
+            "id": [1, 2, 3],
+        }
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        write_deltalake(os.path.join(tmpdir, "cities"), table, partition_by=["city"])
+        write_deltalake(os.path.join(tmpdir, "days"), table, partition_by=["day"])
+        server = make_server(
+            tables={
+                "cities": os.path.join(tmpdir, "cities"),
+                "days": os.path.join(tmpdir, "days"),
+            },
+        )
+
+        with Client(server.location) as client:
+            for city, id_ in (("Berlin", 1), ("New York", 2), ("a:b", 3)):
+                query = f"SELECT id FROM cities WHERE city = '{city}'"
+                scan = client.scan_info(query)
+                assert (scan["files_scanned"], scan["files_skipped"]) == (1, 2)
+                assert client.query(query).column("id").to_pylist() == [id_]
+
+            # naive timestamps can't be compared with the aware partition
+            query = "SELECT id FROM days WHERE day = TIMESTAMP '2024-01-01 00:00:00'"
+            scan = client.scan_info(query)
+            assert (scan["files_scanned"], scan["files_skipped"]) == (2, 0)
+            query = "SELECT id FROM days WHERE day = '2024-01-01 00:00:00+00:00'"
+            scan = client.scan_info(query)
+            assert (scan["files_scanned"], scan["files_skipped"]) == (1, 1)
+            result = client.query(f"{query} ORDER BY id")
+            assert result.column("id").to_pylist() == [1, 2]
+
+
+def test_plans_count_their_files(partitioned_delta_table_path, make_server):
+    """Test cached plans are sized by the files they read, not their SQL."""
+    server = make_server(
+        tables={"events": partitioned_delta_table_path},
+        max_endpoints=4,
+        plan_cache_size=1024 * 1024,
+    )
+
+    with Client(server.location) as client:
+        info = client._get_info("SELECT * FROM events")
+    assert len(info.endpoints) == 4
+    assert server._plans.nbytes > 16 * PLAN_FILE_BYTES
+    assert server._plans.stats()["max_bytes"] == 1024 * 1024
+
+
+def test_lookup_pruning(server_with_endpoints):
+    """Test lookups only read the files that can hold the keys."""
+    with Client(server_with_endpoints) as client:
+        before = client.scan_stats()
+        keys = pa.table({"id": [5, 999, 3001]})
+        result = client.lookup("events", keys)
+        assert sorted(result.column("id").to_pylist()) == [5, 999, 3001]
+        after = client.scan_stats()
+        assert after["files_scanned"] - before["files_scanned"] == 6
+        assert after["files_skipped"] - before["files_skipped"] == 10
+
+        keys = pa.table({"id": range(2000, 2500), "part": ["p1"] * 500})
+        result = client.lookup("events", keys, on=["id", "part"])
+        assert result.num_rows == 125
+        assert client.scan_stats()["files_skipped"] - after["files_skipped"] == 15
+
+
+def test_materialized_views(partitioned_delta_table_path, make_server):
+    """Test views are kept up to date, from added files where possible."""
+    views = {
+        "by_part": "SELECT part, COUNT(*) AS n, SUM(id) AS total, MIN(id) AS lo, "
+        "MAX(id) AS hi FROM events WHERE id % 2 = 0 GROUP BY part",
+        "means": "SELECT part, AVG(id) AS mean FROM events GROUP BY part",
+    }
+    server = make_server(
+        tables={"events": partitioned_delta_table_path},
+        materialized_views=views,
+    )
+    merged = []
+    merge_view = server._merge_view
+    server._merge_view = lambda *args: merged.append(args[0]) or merge_view(*args)
+
+    def check(client):
+        for name, sql in views.items():
+            expected = client.query(sql).sort_by("part")
+            assert client.query(f"SELECT * FROM {name} ORDER BY part") == expected
+
+    with Client(server.location) as client:
+        assert set(client.list_tables()) == {"events", "by_part", "means"}
+        check(client)
+        assert client.versions("SELECT * FROM by_part") == {"by_part": 0}
+
+        rows = pa.table({"id": [5000, 5002, 5003], "part": ["p1", "p9", "p9"]})
+        write_deltalake(partitioned_delta_table_path, rows, mode="append")
+        client.refresh("events")
+        check(client)
+        assert merged == ["by_part"]
+        assert client.versions("SELECT * FROM by_part") == {"by_part": 1}
+
+        rows = pa.table({"id": [1, 2], "part": ["p1", "p2"]})
+        write_deltalake(partitioned_delta_table_path, rows, mode="overwrite")
+        client.refresh("events")
+        check(client)
+        assert merged == ["by_part"]
+        assert client.health()["errors"] == {}
+
+
+def test_dictionary_encoding_shared_by_endpoints(tmp_path, make_server):
+    """Test all endpoints of a query return the same dictionary encoding."""
+    for part in ("few", "many", "none"):
+        rows = 1000 if part != "none" else 0
+        labels = [f"l{i % 2}" if part == "few" else f"l{i}" for i in range(rows)]
+        table = pa.table(
+            {"label": pa.array(labels, pa.string()), "part": [part] * rows},
+        )
+        write_deltalake(
+            str(tmp_path / "t"), table, partition_by=["part"], mode="append"
+        )
+    server = make_server(
+        tables={"t": str(tmp_path / "t")},
+        max_endpoints=3,
+        dictionary_ratio=0.5,
+        spool_dir=str(tmp_path / "spool"),
+        spool_segment_bytes=1000,
+        batch_size=100,
+    )
+
+    with Client(server.location) as client:
+        for parallel in (1, 3):
+            result = client.query("SELECT * FROM t", parallel=parallel)
+            assert result.num_rows == 2000
+        assert client.read_all("SELECT label FROM t").num_rows == 2000
+        result = client.query("SELECT * FROM t ORDER BY part DESC", spool=True)
+        assert result.num_rows == 2000
+        assert pa.types.is_dictionary(result.schema.field("part").type)
+
+
+def test_metrics(delta_table_path, make_server):
+    """Test query path metrics are served for Prometheus."""
+    port = free_port()
+    server = make_server(
+        tables={"users": delta_table_path},
+        metrics_port=port,
+        metrics_host="127.0.0.1",
+    )
+
+    with Client(server.location) as client:
+        client.query("SELECT * FROM users")
+        client.query("SELECT * FROM users WHERE id > 3")
+        with pytest.raises(flight.FlightServerError):
+            client.query("SELECT * FROM missing")
+
+    assert server.metrics.rows.get(table="users") == 7
+    assert server.metrics.first_batch.count() == 2
+    assert server.metrics.errors.get(method="get_flight_info") == 1
+    assert server._metrics_server.server_address[0] == "127.0.0.1"
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+        text = response.read().decode("utf-8")
+    assert 'flydelta_batches_total{table="users"} 2' in text
+    assert 'flydelta_table_version{table="users"} 0' in text
+    assert 'flydelta_pool_connections{lane="interactive",state="idle"}' in text
+    assert "flydelta_stream_seconds_count 2" in text
+
+
+def test_prefetch_spills_for_slow_clients(delta_table_path, tmp_path, make_server):
+    """Test a stalled stream is spilled and releases its connection."""
+    server = make_server(
+        tables={"users": delta_table_path},
+        pool_size=1,
+        pool_timeout=2,
+        batch_size=1000,
+        prefetch=2,
+        spill_after=0.2,
+        spill_dir=str(tmp_path),
+    )
+
+    sql = "SELECT range AS id, repeat('x', 100) AS s FROM range(500000)"
+    with Client(server.location) as client, Client(server.location) as other:
+        stream = client.stream_query(sql)
+        rows = next(stream).num_rows
+        time.sleep(1)
+
+        # the only connection is free again while the stream is pending
+        assert other.query("SELECT COUNT(*) AS n FROM users")[0][0].as_py() == 5
+        assert server.metrics.spills.get() == 1
+        rows += sum(batch.num_rows for batch in stream)
+        assert rows == 500000
+    assert os.listdir(tmp_path) == []
+
+
+def test_cancel_and_limits(delta_table_path, make_server):
+    """Test running queries are interrupted when cancelled or over a limit."""
+    server = make_server(
+        tables={"users": delta_table_path},
+        pool_size=1,
+        pool_timeout=2,
+        batch_size=100,
+        max_query_time=1,
+        max_rows=1000,
+        query_memory_limit="256MB",
+        query_threads=1,
+    )
+
+    slow = "SELECT COUNT(*) FROM range(100000000) a, range(100000000) b"
+    errors = []
+
+    def run(client):
+        try:
+            client.query(slow, query_id="slow")
+        except flight.FlightError as e:
+            errors.append(e)
+
+    with Client(server.location) as client, Client(server.location) as other:
+        running = threading.Thread(target=run, args=(client,))
+        running.start()
+        time.sleep(0.3)
+        assert other.cancel("slow") == 1
+        running.join(2)
+        assert isinstance(errors[0], flight.FlightCancelledError)
+        assert "slow was cancelled" in str(errors[0])
+        assert other.cancel("slow") == 0
+
+        with pytest.raises(flight.FlightCancelledError, match="time limit"):
+            client.query(slow)
+        with pytest.raises(flight.FlightServerError, match="limit of 1000 rows"):
+            client.query("SELECT * FROM range(2000)")
+
+        # dropping a stream frees the only connection
+        stream = client.stream_query("SELECT * FROM range(10) a, range(50) b")
+        next(stream)
+        stream.close()
+        assert other.query("SELECT COUNT(*) AS n FROM users")[0][0].as_py() == 5
+
+
+def test_shutdown_stops_running_queries(delta_table_path, make_server):
+    """Test shutting down interrupts running queries instead of waiting for them."""
+    server = make_server(tables={"users": delta_table_path}, query_threads=1)
+    slow = "SELECT COUNT(*) FROM range(100000000) a, range(100000000) b"
+    errors = []
+
+    def run():
+        with Client(server.location) as client:
+            try:
+                client.query(slow)
+            except flight.FlightError as e:
+                errors.append(e)
+
+    running = threading.Thread(target=run)
+    running.start()
+    deadline = time.monotonic() + 5
+    while not server._queries and time.monotonic() < deadline:
+        time.sleep(0.01)
+    (query,) = server._queries
+
+    start = time.monotonic()
+    server.shutdown()
+    assert time.monotonic() - start < 2
+    running.join(2)
+    assert not running.is_alive()
+    assert query.reason == "was stopped by a server shutdown"
+    assert len(errors) == 1
+
+
+class FakeConnection:
+    """Connection counting the interrupts of its query."""
+
+    def __init__(self):
+        self.interrupts = 0
+
+    def interrupt(self):
+        self.interrupts += 1
+
+
+def test_stopped_queries_interrupted_again(delta_table_path, make_server):
+    """Test the watchdog interrupts stopped queries again until they finish."""
+    server = make_server(tables={"users": delta_table_path})
+    query = _Query("q", None)
+    # stopped while no statement was running on its connection
+    query.interrupt("was cancelled by the client")
+    conn = FakeConnection()
+    query.attach(conn)
+    with server._queries_lock:
+        server._queries.add(query)
+
+    time.sleep(0.5)
+    assert conn.interrupts >= 2
+    server._unregister(query)
+
+
+def test_pinned_tables(delta_table_path, large_delta_table_path, caplog, make_server):
+    """Test pinned tables are served from memory within the budget."""
+    server = make_server(
+        tables={"users": delta_table_path, "large_table": large_delta_table_path},
+        pinned=["users", "large_table"],
+        pin_memory=10_000,
+    )
+
+    # the large table doesn't fit into the budget and is read from files
+    assert set(server._pinned) == {"users"}
+    assert "Not pinning large_table" in caplog.text
+    with Client(server.location) as client:
+        sql = "SELECT COUNT(*) AS n FROM users u JOIN large_table l ON u.id = l.id"
+        assert client.query(sql)[0][0].as_py() == 5
+
+        append_user(delta_table_path, 6)
+        client.refresh()
+        assert server._pinned["users"].num_rows == 6
+        assert client.query(sql)[0][0].as_py() == 6
+        assert client.scan_info("SELECT * FROM users") == {}
+    with pytest.raises(ValueError, match="Unknown pinned tables: orders"):
+        Server(location=server.location, tables={}, pinned=["orders"])
+
+
+def test_disk_cache(delta_table_path, tmp_path, make_server):
+    """Test table files are read through the local disk cache."""
+    server = make_server(
+        tables={"users": delta_table_path},
+        disk_cache_dir=str(tmp_path),
+    )
+
+    with Client(server.location) as client:
+        assert client.query("SELECT * FROM users").num_rows == 5
+        assert len(os.listdir(tmp_path)) == 1
+        append_user(delta_table_path, 6)
+        client.refresh()
+        assert client.query("SELECT * FROM users").num_rows == 6
+        assert len(os.listdir(tmp_path)) == 2
+    assert server._file_cache.stats()["hits"] >= 1
+
+
+def test_time_travel(server, delta_table_path):
+    """Test older table versions are read with AT clauses."""
+    before = datetime.datetime.now(datetime.timezone.utc)
+    time.sleep(0.1)
+    append_user(delta_table_path, 6)
+    with Client(server) as client:
+        client.refresh()
+        sql = "SELECT COUNT(*) AS n FROM users AT (VERSION => 0)"
+        assert client.query(sql)[0][0].as_py() == 5
+        assert client.query(sql)[0][0].as_py() == 5
+        assert client.query("SELECT COUNT(*) AS n FROM users")[0][0].as_py() == 6
+
+        ts = before.isoformat()
+        sql = (
+            "SELECT COUNT(*) AS n FROM users u "
+            f"WHERE u.id NOT IN (SELECT id FROM users AT (TIMESTAMP => '{ts}'))"
+        )
+        assert client.query(sql)[0][0].as_py() == 1
+        reader = client._client.do_get(
+            flight.Ticket(b"SELECT * FROM users AT (VERSION => 1)")
+        )
+        assert reader.read_all().num_rows == 6
+        with pytest.raises(flight.FlightServerError):
+            client.query("SELECT * FROM users AT (VERSION => 7)")
+
+
+def test_background_load(
+    delta_table_path, large_delta_table_path, tmp_path, make_server
+):
+    """Test tables load in the background and register on first use."""
+    metadata = str(tmp_path / "metadata.json")
+    server = make_server(
+        tables={
+            "users": delta_table_path,
+            "large_table": large_delta_table_path,
+            "missing": str(tmp_path / "missing"),
+        },
+        pool_size=1,
+        background_load=True,
+        metadata_cache=metadata,
+    )
+
+    assert server.ready
+    with Client(server.location) as client:
+        health = client.health()
+        assert health["ready"] and health["loaded"] == 2
+        assert "missing" in health["errors"]
+        assert client.query("SELECT * FROM USERS").num_rows == 5
+        (registered,) = server._registered.values()
+        assert set(registered) == {"users"}
+        with pytest.raises(flight.FlightUnavailableError, match="failed to load"):
+            client.query("SELECT * FROM missing")
+
+    with open(metadata) as f:
+        assert set(json.load(f)) == {"users", "large_table"}
+    restarted = Server(
+        location=f"grpc://127.0.0.1:{free_port()}",
+        tables={"users": delta_table_path},
+        background_load=True,
+        metadata_cache=metadata,
+    )
+    try:
+        assert set(restarted._schemas) == {"users"}
+    finally:
+        restarted.wait_ready(10)
+        restarted.shutdown()
+
+
+class FlakyReader:
+    """Stream reader failing with a connection error after the first batch."""
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __iter__(self):
+        for i, chunk in enumerate(self.reader):
+            if i == 1:
+                raise flight.FlightUnavailableError("Connection reset by peer")
+            yield chunk
+
+    def cancel(self):
+        self.reader.cancel()
+
+
+def test_spooled_results(delta_table_path, tmp_path, monkeypatch, make_server):
+    """Test spooled results are served per segment and resumed after errors."""
+    server = make_server(
+        tables={"users": delta_table_path},
+        batch_size=10_000,
+        spool_dir=str(tmp_path),
+        spool_segment_bytes=100_000,
+    )
+
+    sql = "SELECT range AS id FROM range(100000) ORDER BY id"
+    with Client(server.location, retry_backoff=0.01) as client:
+        info = client.spool(sql)
+        assert len(info.endpoints) == 5
+        assert info.total_records == 100_000
+        assert all(e.expiration_time is not None for e in info.endpoints)
+        assert len(os.listdir(tmp_path)) == 5
+
+        batches = list(client.stream_segments(info, start=3))
+        assert sum(batch.num_rows for batch in batches) == 40_000
+        assert batches[0]["id"][0].as_py() == 60_000
+
+        result = client.query(sql, spool=True, parallel=3)
+        assert result["id"].to_pylist() == list(range(100_000))
+        empty = client.query("SELECT range AS id FROM range(0)", spool=True)
+        assert empty.num_rows == 0
+        assert empty.schema.names == result.schema.names
+
+        # every first request of a segment fails after one batch
+        failed = set()
+
+        class FlakyConnection:
+            def do_get(self, ticket, options=None):
+                reader = client._client.do_get(ticket, options)
+                if ticket.ticket in failed:
+                    return reader
+                failed.add(ticket.ticket)
+                return FlakyReader(reader)
+
+            def get_flight_info(self, descriptor, options=None):
+                return client._client.get_flight_info(descriptor, options)
+
+        monkeypatch.setattr(
+            client, "_connection", lambda location=None: FlakyConnection()
+        )
+        ids = []
+        for batch in client.stream_query(sql, spool=True):
+            ids.extend(batch["id"].to_pylist())
+        assert ids == list(range(100_000))
+        assert len(failed) == 5
+
+        # plain tickets can't be requested again
+        with pytest.raises(flight.FlightUnavailableError):
+            client.query(sql, parallel=2)
+
+    without = make_server(tables={"users": delta_table_path})
+    with Client(without.location) as client:
+        with pytest.raises(flight.FlightServerError, match="not enabled"):
+            client.spool("SELECT * FROM users")
+
+
+def test_queries_parsed_per_thread(delta_table_path, make_server):
+    """Test threads parse queries on their own cursor, once per query."""
+    server = make_server(tables={"users": delta_table_path})
+    parser = server._parser()
+    assert server._parser() is parser
+    other = []
+    thread = threading.Thread(target=lambda: other.append(server._parser()))
+    thread.start()
+    thread.join()
+    assert other[0] is not parser
+
+    parsed = []
+    referenced_tables = server._referenced_tables
+    server._referenced_tables = lambda q: parsed.append(q) or referenced_tables(q)
+    with Client(server.location) as client:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            sql = "SELECT * FROM users WHERE id > {}"
+            results = executor.map(lambda i: client.query(sql.format(i)), range(8))
+            assert [result.num_rows for result in results] == [5, 4, 3, 2, 1, 0, 0, 0]
+    assert len(parsed) == 8
+
+
+def test_shared_database(delta_table_path, make_server):
+    """Test pooled connections can be cursors of one DuckDB database."""
+    with pytest.raises(ValueError, match="shared database"):
+        Server(tables={"users": delta_table_path}, threads=2)
+    with pytest.raises(ValueError, match="use memory_limit"):
+        Server(
+            tables={"users": delta_table_path},
+            shared_database=True,
+            query_threads=2,
+        )
+
+    server = make_server(
+        tables={"users": delta_table_path},
+        pool_size=3,
+        shared_database=True,
+        memory_limit="1GB",
+        threads=2,
+    )
+
+    with Client(server.location, connections=3) as client:
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            results = list(
+                executor.map(
+                    lambda i: client.query(f"SELECT * FROM users WHERE id > {i}"),
+                    range(6),
+                )
+            )
+        assert [result.num_rows for result in results] == [5, 4, 3, 2, 1, 0]
+        settings = client.query(
+            "SELECT current_setting('threads') AS threads, "
+            "current_setting('memory_limit') AS memory_limit"
+        ).to_pylist()[0]
+        assert settings["threads"] == 2
+        assert settings["memory_limit"].startswith("953.6")
+        with client.prepare("SELECT name FROM users WHERE id = ?") as stmt:
+            assert stmt.execute([1]).num_rows == 1
+
+
+def test_cluster(partitioned_delta_table_path, make_server):
+    """Test table scans are spread over the nodes of a cluster."""
+    locations = [f"grpc://127.0.0.1:{free_port()}" for _ in range(3)]
+    servers = [
+        make_server(
+            location=location,
+            tables={"events": partitioned_delta_table_path},
+            peers=locations,
+        )
+        for location in locations
+    ]
+
+    sql = "SELECT * FROM events WHERE part <> 'p0'"
+    with Client(locations[0]) as client:
+        info = client._get_info(sql)
+        owners = {e.locations[0].uri.decode() for e in info.endpoints}
+        assert len(owners) > 1
+        for endpoint in info.endpoints:
+            if endpoint.locations[0].uri.decode() != locations[0]:
+                assert endpoint.locations[1].uri.decode() == locations[0]
+
+        result = client.query(sql, parallel=3)
+        assert result.num_rows == 3000
+        assert sorted(result["id"].to_pylist()) == sorted(
+            i for i in range(4000) if i % 1000 % 4 != 0
+        )
+        assert client.read_all(sql).num_rows == 3000
+        for server, location in zip(servers, locations):
+            if location in owners:
+                assert server.metrics.requests.get(method="do_get") == 2
+
+        # parts of stopped nodes are executed by the planning node
+        servers[1].shutdown()
+        servers[2].shutdown()
+        assert client.query(sql, parallel=3).num_rows == 3000
+
+
+def test_cluster_parts_cached_per_file_list(
+    partitioned_delta_table_path, tmp_path, make_server
+):
+    """Test cached parts aren't reused once the peers file moves their files."""
+    locations = [f"grpc://127.0.0.1:{free_port()}" for _ in range(2)]
+    peers_file = tmp_path / "peers"
+    peers_file.write_text("\n".join(locations))
+    for location in locations:
+        make_server(
+            location=location,
+            tables={"events": partitioned_delta_table_path},
+            peers_file=str(peers_file),
+            cache_size=10 * 1024 * 1024,
+        )
+
+    sql = "SELECT * FROM events WHERE part > 'p0'"
+    with Client(locations[0]) as client:
+        assert client.query(sql, parallel=2).num_rows == 3000
+
+        peers_file.write_text(locations[0])
+        os.utime(peers_file, (time.time() + 10, time.time() + 10))
+        assert len(client._get_info(sql).endpoints) == 1
+        assert client.query(sql, parallel=2).num_rows == 3000
+
+
+def test_prepared_statements_expire(delta_table_path, make_server):
+    """Test unclosed statements are evicted, expire and get deallocated."""
+    server = make_server(
+        tables={"users": delta_table_path},
+        pool_size=1,
+        statement_ttl=0.5,
+        max_statements=1,
+    )
+
+    with Client(server.location) as client:
+        first = client.prepare("SELECT name FROM users WHERE id = ?")
+        assert first.execute([1]).num_rows == 1
+        second = client.prepare("SELECT name FROM users WHERE id > ?")
+        with pytest.raises(flight.FlightServerError, match="Unknown or closed"):
+            first.execute([1])
+        assert second.execute([1]).num_rows == 4
+        (prepared,) = server._prepared.values()
+        assert prepared == {second.handle}
+
+        time.sleep(0.7)
+        with pytest.raises(flight.FlightServerError, match="Unknown or closed"):
+            second.execute([1])
+        assert client.query("SELECT 1").num_rows == 1
+        assert prepared == set()
@@ -0,0 +1,95 @@
+import os
+import time
+
+import pyarrow as pa
+import pytest
+
+from flydelta.spool import SpoolFullError, SpoolStore, decode_ticket
+
+
+def batches(count, rows=1000):
+    for i in range(count):
+        yield pa.record_batch({"id": pa.array(range(i * rows, (i + 1) * rows))})
+
+
+SCHEMA = pa.schema([("id", pa.int64())])
+
+
+def test_spool_segments(tmp_path):
+    """Test results are split into segments that read back in order."""
+    store = SpoolStore(str(tmp_path), max_bytes=10**6, segment_bytes=10_000)
+    spool = store.write(SCHEMA, batches(5))
+
+    assert len(spool.segments) == 3
+    assert spool.rows == 5000
+    sizes = [os.path.getsize(segment.path) for segment in spool.segments]
+    assert spool.nbytes == store.nbytes == sum(sizes)
+    assert decode_ticket(spool.ticket(2)) == (spool.id, 2)
+    ids = []
+    for i in range(len(spool.segments)):
+        ids.extend(store.read(spool.id, i).read_all().column("id").to_pylist())
+    assert ids == list(range(5000))
+    with pytest.raises(KeyError):
+        store.read(spool.id, 3)
+
+    empty = store.write(SCHEMA, [])
+    assert len(empty.segments) == 1
+    assert store.read(empty.id, 0).read_all().num_rows == 0
+
+
+def test_spool_budget(tmp_path):
+    """Test old spools are evicted, results larger than the budget fail."""
+    store = SpoolStore(str(tmp_path), max_bytes=20_000, segment_bytes=10_000)
+    first = store.write(SCHEMA, batches(1))
+    second = store.write(SCHEMA, batches(1))
+    third = store.write(SCHEMA, batches(1))
+
+    assert first.id not in store
+    assert not os.path.exists(first.segments[0].path)
+    assert second.id in store and third.id in store
+    with pytest.raises(SpoolFullError):
+        store.write(SCHEMA, batches(5))
+    # the failed result made room by evicting spools and was then removed
+    assert os.listdir(tmp_path) == []
+    assert store.nbytes == 0
+
+
+def test_spool_budget_concurrent(tmp_path):
+    """Test spools being written count towards the budget together."""
+    store = SpoolStore(str(tmp_path), max_bytes=20_000, segment_bytes=10_000)
+    written = []
+
+    def interleaved():
+        yield from batches(1)
+        written.append(store.write(SCHEMA, batches(1)))
+        assert store.nbytes <= store.max_bytes
+        yield from batches(1)
+
+    spool = store.write(SCHEMA, interleaved())
+    assert written[0].id not in store
+    assert not os.path.exists(written[0].segments[0].path)
+    sizes = [os.path.getsize(segment.path) for segment in spool.segments]
+    assert store.nbytes == spool.nbytes == sum(sizes) <= store.max_bytes
+
+    def competing():
+        yield from batches(1)
+        with pytest.raises(SpoolFullError):
+            store.write(SCHEMA, batches(2))
+        yield from batches(1)
+
+    store.write(SCHEMA, competing())
+    assert store.nbytes <= store.max_bytes
+
+
+def test_spool_ttl(tmp_path):
+    """Test expired spools are deleted and leftovers removed on startup."""
+    store = SpoolStore(str(tmp_path), max_bytes=10**6, ttl=0.1)
+    spool = store.write(SCHEMA, batches(1))
+    time.sleep(0.2)
+    store.expire()
+    assert len(store) == 0
+    assert not os.path.exists(spool.segments[0].path)
+
+    store.write(SCHEMA, batches(1))
+    SpoolStore(str(tmp_path), max_bytes=10**6)
+    assert os.listdir(tmp_path) == []
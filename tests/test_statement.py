@@ -0,0 +1,53 @@
+import datetime
+import decimal
+
+import duckdb
+import pyarrow as pa
+import pytest
+
+from flydelta.statement import decode_ticket, encode_ticket, params_batch, sql_literal
+
+HANDLE = "0" * 32
+
+
+def test_ticket_roundtrip():
+    """Test handle and parameters are encoded in the ticket."""
+    params = params_batch([(1, "a"), (2, "b")])
+    handle, decoded = decode_ticket(encode_ticket(HANDLE, params))
+
+    assert handle == HANDLE
+    assert decoded.column_names == ["p1", "p2"]
+    assert decoded.equals(params)
+    assert decode_ticket(encode_ticket(HANDLE)) == (HANDLE, None)
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        None,
+        True,
+        42,
+        1.5,
+        decimal.Decimal("1.25"),
+        "it's",
+        b"\x00\xff",
+        datetime.date(2024, 1, 2),
+        datetime.datetime(2024, 1, 2, 3, 4, 5),
+        datetime.time(3, 4, 5),
+    ],
+)
+def test_sql_literal(value):
+    """Test values survive rendering as SQL literals."""
+    result = duckdb.sql(f"SELECT {sql_literal(value)} AS v").fetchone()[0]
+    assert result == value
+
+
+def test_sql_literal_unsupported():
+    with pytest.raises(TypeError):
+        sql_literal(object())
+    with pytest.raises(TypeError):
+        sql_literal(pa.scalar(1))
+    with pytest.raises(ValueError):
+        sql_literal(decimal.Decimal("NaN"))
+    with pytest.raises(ValueError):
+        sql_literal(decimal.Decimal("-Infinity"))